@@ -0,0 +1,26 @@
+from models import Media, PageStats
+from utils import setup_logging
+import argparse
+import logging
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the engagement rollups of every page")
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--media', action='store_true',
+                        help="Also recount media references and delete unreferenced media")
+    args = parser.parse_args()
+
+    setup_logging()
+    started = time.monotonic()
+    count = PageStats.rebuild(args.batch_size)
+    logging.info(f"Rebuilt rollups for {count} pages in {time.monotonic() - started:.1f}s")
+    if args.media:
+        started = time.monotonic()
+        corrected = Media.recount(args.batch_size)
+        pruned = Media.prune()
+        logging.info(f"Corrected {corrected} media reference counts and deleted {pruned} unreferenced media "
+                     f"in {time.monotonic() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
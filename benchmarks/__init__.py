@@ -0,0 +1,4 @@
+"""Benchmarks for the scraper, the models and the API.
+
+Run ``python -m benchmarks run`` from the project root; see README.md.
+"""
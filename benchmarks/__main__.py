@@ -0,0 +1,135 @@
+from benchmarks import fixtures
+from benchmarks.harness import compare
+from config import Config
+from datetime import datetime, timezone
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+
+SUITES = ('scraper', 'models', 'api', 'startup', 'filters')
+# filters loads a million pages by default, so it only runs when asked for
+DEFAULT_SUITES = ('scraper', 'models', 'api', 'startup')
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(fixtures.FIXTURE_DIR), capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_results(results, comparison):
+    for name, stats in results.items():
+        line = f"{name:<50} median {stats['median'] * 1000:10.3f} ms  p95 {stats['p95'] * 1000:10.3f} ms"
+        if stats.get('ops_per_sec'):
+            line += f"  {stats['ops_per_sec']:12.1f} ops/s"
+        change = comparison.get(name)
+        if change:
+            line += f"  {change['change']:+.1%} {change['status']}"
+        print(line)
+
+def run(args):
+    if args.mongo_uri:
+        # Must be set before the first database access
+        Config.MONGODB_URI = args.mongo_uri
+    results = {}
+    for suite in args.suite or DEFAULT_SUITES:
+        logging.info(f"Running {suite} benchmarks")
+        module = importlib.import_module(f'benchmarks.bench_{suite}')
+        results.update(module.run(args))
+
+    comparison = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparison = compare(results, json.load(f)['results'], args.threshold)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'commit': git_commit(),
+            'mongodb_uri': Config.MONGODB_URI.split('@')[-1],
+            'pages': args.pages
+        },
+        'results': results,
+        'comparison': comparison
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print_results(results, comparison)
+
+    regressions = [name for name, change in comparison.items() if change['status'] == 'regression']
+    if regressions and args.fail_on_regression:
+        print(f"{len(regressions)} regressions against {args.baseline}", file=sys.stderr)
+        return 1
+    return 0
+
+def compare_files(args):
+    with open(args.current) as f:
+        current = json.load(f)['results']
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    comparison = compare(current, baseline, args.threshold)
+    print_results({name: current[name] for name in comparison}, comparison)
+    regressions = [name for name, change in comparison.items() if change['status'] == 'regression']
+    return 1 if regressions and args.fail_on_regression else 0
+
+def record(args):
+    from scraper import FacebookScraper
+    path = fixtures.record(args.username, FacebookScraper())
+    print(f"Recorded {args.username} to {path}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Performance benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Run benchmark suites")
+    run_parser.add_argument('--suite', action='append', choices=SUITES,
+                            help="Suite to run, repeatable (default: all but filters)")
+    run_parser.add_argument('--fixture', dest='fixtures', action='append',
+                            help="HTML fixture for the scraper suite, repeatable (default: all)")
+    run_parser.add_argument('--pages', type=int, default=1000,
+                            help="Pages stored for the models and api suites")
+    run_parser.add_argument('--filter-pages', type=int, default=1000000,
+                            help="Pages stored for the filters suite")
+    run_parser.add_argument('--threads', type=int, default=4,
+                            help="Concurrent clients in the api suite")
+    run_parser.add_argument('--min-time', type=float, default=0.2,
+                            help="Minimum seconds spent timing each benchmark")
+    run_parser.add_argument('--startup-runs', type=int, default=5)
+    run_parser.add_argument('--mongo-uri',
+                            help="Benchmark against this MongoDB instead of mongomock; "
+                                 "its collections are emptied")
+    run_parser.add_argument('--output', help="Write results as JSON to this file")
+    run_parser.add_argument('--baseline', help="Results JSON to compare against")
+    run_parser.add_argument('--threshold', type=float, default=0.1,
+                            help="Relative median change reported as a regression")
+    run_parser.add_argument('--fail-on-regression', action='store_true')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help="Compare two results files")
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    compare_parser.add_argument('--fail-on-regression', action='store_true')
+    compare_parser.set_defaults(handler=compare_files)
+
+    record_parser = commands.add_parser('record', help="Save a live page as an HTML fixture")
+    record_parser.add_argument('username')
+    record_parser.set_defaults(handler=record)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(args.handler(args))
+
+if __name__ == '__main__':
+    main()
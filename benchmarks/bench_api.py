@@ -0,0 +1,60 @@
+from benchmarks.bench_models import PREFIX, clear, scraped_pages
+from benchmarks.harness import measure
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from migrate import migrate_indexes
+from models import ingest
+import itertools
+
+def run(options):
+    """Requests through the Flask test client, with a cold and a warm cache"""
+    # Indexes are created here rather than racing the app's background migration
+    Config.INDEX_MIGRATION = 'off'
+    import main
+    import routes
+    app = main.create_app()
+    migrate_indexes()
+    clear()
+    ingest(scraped_pages(options.pages))
+
+    client = app.test_client()
+    # Cold requests spread over every page, warm ones repeat a small hot set
+    usernames = [f'{PREFIX}{i}' for i in range(options.pages)]
+    spread = itertools.cycle(usernames)
+    hot = itertools.cycle(usernames[:10])
+    endpoints = {
+        'page': lambda names: f'/api/page/{next(names)}',
+        'pages': lambda names: '/api/pages?per_page=20',
+        'pages_filtered': lambda names: '/api/pages?category=Media&min_followers=1000&per_page=20',
+        'posts': lambda names: f'/api/page/{next(names)}/posts?limit=15'
+    }
+
+    def get(url, client=client):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+
+    results = {}
+    for name, url in endpoints.items():
+        def cold():
+            routes.cache.clear()
+            get(url(spread))
+
+        results[f'api.{name}.cold'] = measure(cold, min_time=options.min_time)
+        results[f'api.{name}.warm'] = measure(lambda: get(url(hot)), min_time=options.min_time)
+
+        # Concurrent clients, reported per batch of requests
+        clients = [app.test_client() for _ in range(options.threads)]
+        requests_per_client = 20
+
+        def burst():
+            with ThreadPoolExecutor(len(clients)) as pool:
+                list(pool.map(
+                    lambda c: [get(url(hot), c) for _ in range(requests_per_client)], clients
+                ))
+
+        results[f'api.{name}.concurrent'] = dict(
+            measure(burst, rounds=3, min_time=options.min_time, operations=len(clients) * requests_per_client),
+            threads=len(clients)
+        )
+    return results
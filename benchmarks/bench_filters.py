@@ -0,0 +1,89 @@
+from benchmarks.harness import measure
+from config import Config
+from datetime import datetime, timedelta
+from models import Page, TopPages, _is_mock, sync_indexes
+import math
+import random
+
+PREFIX = 'filter'
+CATEGORIES = 50
+INSERT_BATCH = 10000
+
+def synthetic_pages(count, seed=0):
+    """Bare page documents, with categories as unevenly used as real ones
+    (Zipf) and log-normal follower counts"""
+    rng = random.Random(seed)
+    categories = [f'Category {i}' for i in range(CATEGORIES)]
+    weights = [1 / (rank + 1) for rank in range(CATEGORIES)]
+    started = datetime(2020, 1, 1)
+    for i in range(count):
+        yield {
+            'username': f'{PREFIX}{i}',
+            'name': f'Filter Page {i}',
+            'category': rng.choices(categories, weights)[0],
+            'follower_count': int(math.exp(rng.gauss(8, 2.5))),
+            'created_at': started + timedelta(seconds=rng.randint(0, 5 * 365 * 86400)),
+            'search_terms': []
+        }
+
+def load(count):
+    """Replace the pages collection with ``count`` synthetic pages"""
+    Page.collection.delete_many({})
+    TopPages.clear()
+    sync_indexes(Page)
+    batch = []
+    for page in synthetic_pages(count):
+        batch.append(page)
+        if len(batch) >= INSERT_BATCH:
+            Page.collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        Page.collection.insert_many(batch, ordered=False)
+
+def combinations():
+    """/api/pages filter combinations by name, most used category first"""
+    popular, rare = 'Category 0', f'Category {CATEGORIES - 1}'
+    return {
+        'category': {'category': popular},
+        'category_min': {'category': popular, 'min_followers': 10000},
+        'category_range': {'category': popular, 'min_followers': 1000, 'max_followers': 100000},
+        'category_range_page5': {'category': popular, 'min_followers': 1000, 'max_followers': 100000,
+                                 'page': 5},
+        'rare_category_range': {'category': rare, 'min_followers': 1000, 'max_followers': 100000},
+        'range': {'min_followers': 1000, 'max_followers': 100000},
+        'category_range_by_created': {'category': popular, 'min_followers': 1000, 'max_followers': 100000,
+                                      'sort': 'created_at'}
+    }
+
+def explain(filters):
+    """Index used and keys and documents examined by the database query"""
+    stats = Page.find_by_filters(per_page=20, **filters).explain()
+    execution = stats.get('executionStats', {})
+    stage = stats.get('queryPlanner', {}).get('winningPlan', {})
+    while 'inputStage' in stage and 'indexName' not in stage:
+        stage = stage['inputStage']
+    return {
+        'index': stage.get('indexName'),
+        'keys_examined': execution.get('totalKeysExamined'),
+        'docs_examined': execution.get('totalDocsExamined'),
+        'returned': execution.get('nReturned')
+    }
+
+def run(options):
+    """Latency of /api/pages filter combinations over ``--filter-pages``
+    pages, from the in-memory rankings and from the indexes alone"""
+    load(options.filter_pages)
+    size = Config.TOP_PAGES_SIZE
+    results = {}
+    try:
+        for name, filters in combinations().items():
+            for mode, top_pages in (('ranked', size), ('index', 0)):
+                Config.TOP_PAGES_SIZE = top_pages
+                results[f'filters.{name}.{mode}'] = measure(
+                    lambda: list(Page.find_by_filters(per_page=20, **filters)), min_time=options.min_time
+                )
+            if not _is_mock(Page.collection):
+                results[f'filters.{name}.index']['explain'] = explain(filters)
+    finally:
+        Config.TOP_PAGES_SIZE = size
+    return results
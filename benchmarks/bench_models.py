@@ -0,0 +1,83 @@
+from benchmarks import fixtures
+from benchmarks.bench_scraper import fixture_scraper
+from benchmarks.harness import measure
+from models import Comment, Follower, Media, Page, PageHistory, PageStats, Post, Search, TopPages, ingest
+import copy
+import random
+
+PREFIX = 'bench'
+
+def scraped_pages(count, fixture='small', seed=0):
+    """``count`` scrape results built from one fixture with varied usernames and counts"""
+    template = fixture_scraper('html.parser', fixtures.load(fixture)).fetch_page(PREFIX)
+    rng = random.Random(seed)
+    pages = []
+    for i in range(count):
+        page = copy.deepcopy(template)
+        page.update({
+            'username': f'{PREFIX}{i}',
+            'name': f'Benchmark Page {i}',
+            'category': rng.choice(('Brand', 'Media', 'Sports', 'Music')),
+            'follower_count': rng.randint(0, 10 ** 7)
+        })
+        for post in page['posts']:
+            post['content'] = f"{post['content']} {i}"
+        pages.append(page)
+    return pages
+
+def clear():
+    """Empty the collections the benchmarks write to"""
+    for model in (Page, Post, Comment, Follower, Media, PageStats, PageHistory):
+        model.collection.delete_many({})
+    TopPages.clear()
+
+def run(options):
+    """Ingest throughput and the latency of the read paths"""
+    results = {}
+    clear()
+    pages = scraped_pages(options.pages)
+    usernames = [page['username'] for page in pages]
+    rng = random.Random(1)
+
+    # The first ingest inserts everything, later ones are idempotent updates
+    results['models.ingest.insert'] = measure(
+        lambda: ingest(copy.deepcopy(pages)), rounds=1, min_time=0, warmup=0, operations=len(pages)
+    )
+    results['models.ingest.update'] = measure(
+        lambda: ingest(copy.deepcopy(pages)), rounds=2, min_time=0, warmup=0, operations=len(pages)
+    )
+
+    def lookups():
+        for username in rng.sample(usernames, min(100, len(usernames))):
+            Page.find_by_username(username)
+
+    results['models.find_by_username'] = measure(
+        lookups, min_time=options.min_time, operations=min(100, len(usernames))
+    )
+    results['models.find_by_filters.first_page'] = measure(
+        lambda: list(Page.find_by_filters(per_page=20)), min_time=options.min_time
+    )
+    results['models.find_by_filters.category'] = measure(
+        lambda: list(Page.find_by_filters(category='Media', per_page=20)), min_time=options.min_time
+    )
+
+    def walk():
+        cursor = None
+        for _ in range(5):
+            docs = list(Page.find_by_filters(per_page=20, cursor=cursor))
+            cursor = Page.next_cursor(docs[-1] if docs else None, len(docs), 20)
+            if cursor is None:
+                break
+
+    results['models.find_by_filters.cursor_walk'] = measure(walk, min_time=options.min_time)
+    page_id = Page.find_by_username(usernames[0], {'_id': 1})['_id']
+    results['models.posts.find_by_page'] = measure(
+        lambda: list(Post.find_by_page(page_id, limit=15)), min_time=options.min_time
+    )
+    results['models.stats.leaderboard'] = measure(
+        lambda: list(PageStats.leaderboard('engagement_rate', 20)), min_time=options.min_time
+    )
+    results['models.search'] = measure(
+        lambda: Search.query('summer sa', limit=20), min_time=options.min_time
+    )
+    return results
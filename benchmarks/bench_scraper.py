@@ -0,0 +1,36 @@
+from benchmarks import fixtures
+from benchmarks.harness import measure
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+from extractor import walk_soup
+from scraper import FacebookScraper, PARSER_BACKENDS, page_extractor
+
+def fixture_scraper(parser, body):
+    """FacebookScraper whose requests are answered with ``body``"""
+    scraper = FacebookScraper(parser=parser, base_url='http://fixture')
+    scraper.session.mount('http://fixture', fixtures.FixtureAdapter(lambda path: body))
+    return scraper
+
+def run(options):
+    """fetch_page per fixture and parser backend, plus the parse and
+    extraction stages of the default backend on their own"""
+    results = {}
+    for name in options.fixtures or fixtures.available():
+        body = fixtures.load(name)
+        for parser in PARSER_BACKENDS:
+            if parser == 'lxml' and builder_registry.lookup('lxml') is None:
+                continue
+            scraper = fixture_scraper(parser, body)
+            stats = measure(lambda: scraper.fetch_page(name), min_time=options.min_time)
+            results[f'scraper.fetch_page.{name}.{parser}'] = dict(stats, bytes=len(body))
+
+        text = body.decode('utf-8')
+        results[f'scraper.parse.{name}'] = measure(
+            lambda: BeautifulSoup(text, 'html.parser'), min_time=options.min_time
+        )
+        soup = BeautifulSoup(text, 'html.parser')
+        results[f'scraper.extract.{name}'] = measure(
+            lambda: walk_soup(soup, page_extractor(name, 'http://fixture')),
+            min_time=options.min_time
+        )
+    return results
@@ -0,0 +1,41 @@
+from benchmarks.harness import summarize
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so that nothing is already imported
+_PROBE = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/api/pages?per_page=1')
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'total': served - started,
+    'status': response.status_code
+}))
+"""
+
+PHASES = ('import', 'create_app', 'first_request', 'total')
+
+def run(options):
+    """Cold start timings over ``options.startup_runs`` fresh interpreters"""
+    samples = []
+    for _ in range(options.startup_runs):
+        output = subprocess.run(
+            [sys.executable, '-c', _PROBE],
+            cwd=ROOT,
+            env=dict(os.environ, INDEX_MIGRATION='off'),
+            capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {f'startup.{phase}': summarize([sample[phase] for sample in samples]) for phase in PHASES}
@@ -0,0 +1,115 @@
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from urllib.parse import urlparse
+import io
+import os
+import random
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# name: (posts, comments per post, followers)
+SIZES = {
+    'small': (5, 2, 10),
+    'medium': (30, 20, 200),
+    'large': (30, 100, 1000)
+}
+
+_WORDS = ('launch', 'summer', 'sale', 'update', 'community', 'thanks', 'team', 'event', 'photo',
+          'video', 'story', 'news', 'live', 'today', 'week', 'fans', 'offer', 'season')
+
+def synthetic_page(posts, comments, followers, seed=0, name='Benchmark Page'):
+    """Deterministic page markup using the structure the extractor looks for"""
+    rng = random.Random(seed)
+
+    def text(words):
+        return ' '.join(rng.choice(_WORDS) for _ in range(words))
+
+    out = [
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Page</title>',
+        '<script>window.__data = {"page": 1};</script><style>.x{color:red}</style></head><body>',
+        '<div class="header"><h1 class="page-name">', name, '</h1>',
+        '<img class="profile-pic" src="https://cdn.example.com/p/profile.jpg"></div>',
+        '<div class="contact"><a href="mailto:contact@example.com">Email</a>',
+        '<a href="https://www.facebook.com/example">Facebook</a><a href="https://example.com">Website</a></div>',
+        '<div class="page-category">Brand</div>',
+        '<div class="about-section">', text(40), '</div>',
+        f'<div>{rng.randint(1, 999)}.{rng.randint(0, 9)}K followers</div>',
+        f'<div>{rng.randint(1000, 99999):,} people like this</div>',
+        '<div>Page created - March 3, 2012</div><div class="feed">'
+    ]
+    for i in range(posts):
+        out.append(f'<div class="feed-story" id="post-{i}"><div class="post-content"><p>{text(30)}</p></div>')
+        out.append(f'<abbr title="2024-{1 + i % 12:02d}-{1 + i % 28:02d} 12:{i % 60:02d}:00">{i}h</abbr>')
+        out.append(f'<span class="like-count">{rng.randint(0, 5000)}</span>')
+        out.append(f'<span class="share-count">{rng.randint(0, 90)}</span>')
+        out.append(f'<img src="https://cdn.example.com/m/{seed}-{i}.jpg">')
+        if i % 4 == 0:
+            out.append(f'<video data-url="https://cdn.example.com/v/{seed}-{i}.mp4"></video>')
+        out.append('<div class="replies">')
+        for j in range(comments):
+            out.append(
+                f'<div class="comment"><a class="comment-author" href="https://www.facebook.com/u{j}">'
+                f'User {j}</a><span>{text(12)}</span></div>'
+            )
+        out.append('</div></div>')
+    out.append('</div><div class="followers">')
+    for k in range(followers):
+        out.append(
+            f'<div class="follower-item"><img src="https://cdn.example.com/f/{k}.jpg">'
+            f'<a class="follower-name" href="https://www.facebook.com/f{k}">Follower {k}</a></div>'
+        )
+    out.append('</div></body></html>')
+    return ''.join(out)
+
+def fixture_path(name):
+    return os.path.join(FIXTURE_DIR, f'{name}.html')
+
+def load(name):
+    """Bytes of fixture ``name``: a recorded page, or a synthetic size
+    from SIZES that is written on first use"""
+    path = fixture_path(name)
+    if not os.path.exists(path):
+        if name not in SIZES:
+            raise KeyError(f"No fixture named {name!r}")
+        os.makedirs(FIXTURE_DIR, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(synthetic_page(*SIZES[name]))
+    with open(path, 'rb') as f:
+        return f.read()
+
+def available():
+    """Names of the synthetic sizes and of every recorded fixture"""
+    recorded = []
+    if os.path.isdir(FIXTURE_DIR):
+        recorded = sorted(name[:-5] for name in os.listdir(FIXTURE_DIR) if name.endswith('.html'))
+    return list(SIZES) + [name for name in recorded if name not in SIZES]
+
+def record(username, scraper):
+    """Save the live page of ``username`` as a fixture and return its path"""
+    response = scraper.session.get(scraper.page_url(username), headers=scraper.headers)
+    response.raise_for_status()
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with open(fixture_path(username), 'wb') as f:
+        f.write(response.content)
+    return fixture_path(username)
+
+class FixtureAdapter(BaseAdapter):
+    """requests transport answering every URL with fixture bytes, so that
+    the scraper's full fetch path runs without a network"""
+
+    def __init__(self, body_for):
+        super().__init__()
+        self.body_for = body_for
+
+    def send(self, request, stream=False, **kwargs):
+        response = Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response.raw = io.BytesIO(self.body_for(urlparse(request.url).path.strip('/')))
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        return response
+
+    def close(self):
+        pass
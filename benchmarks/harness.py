@@ -0,0 +1,62 @@
+from statistics import mean, median
+import time
+
+def measure(fn, rounds=None, min_time=None, warmup=1, operations=1):
+    """Time ``fn()`` and summarize the per-call durations in seconds.
+
+    Calls ``fn`` ``warmup`` times untimed, then at least ``rounds`` times
+    and for at least ``min_time`` seconds. ``operations`` is the number of
+    operations one call performs, used for ``ops_per_sec``.
+    """
+    rounds = rounds or 5
+    min_time = 0.2 if min_time is None else min_time
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < rounds or time.perf_counter() - started < min_time:
+        begin = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - begin)
+    return summarize(samples, operations)
+
+def summarize(samples, operations=1):
+    ordered = sorted(samples)
+    middle = median(ordered)
+    return {
+        'unit': 's',
+        'rounds': len(ordered),
+        'min': ordered[0],
+        'median': middle,
+        'mean': mean(ordered),
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max': ordered[-1],
+        'ops_per_sec': operations / middle if middle else None
+    }
+
+def compare(results, baseline, threshold=0.1):
+    """Median change of every benchmark present in both result sets.
+
+    Returns {name: {'baseline', 'current', 'change', 'status'}} where
+    status is 'regression' or 'improvement' when the median moved by more
+    than ``threshold`` (a fraction), else 'unchanged'.
+    """
+    report = {}
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if not previous or not previous.get('median'):
+            continue
+        change = current['median'] / previous['median'] - 1
+        if change > threshold:
+            status = 'regression'
+        elif change < -threshold:
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+        report[name] = {
+            'baseline': previous['median'],
+            'current': current['median'],
+            'change': round(change, 4),
+            'status': status
+        }
+    return report
@@ -0,0 +1,324 @@
+import requests
+from config import Config
+from models import Page, Post, flush_writes, ingest, ingest_scrape
+from parsing import ParsePool, decode_page, parse_body
+from refresh import REFRESH_PROJECTION, apply_refresh, get_validators
+from scraper import FacebookScraper, NOT_MODIFIED
+from utils import setup_logging
+from urllib.parse import urlparse
+import argparse
+import logging
+import queue
+import random
+import re
+import threading
+import time
+
+_RATE_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+_RATE_PATTERN = re.compile(r'^\s*(\d+)\s*(?:/|per)\s*(second|minute|hour|day)s?\s*$', re.I)
+
+_DONE = object()
+
+
+def parse_rate(limit):
+    """Parse a rate limit string like '100/hour' into (count, seconds)"""
+    match = _RATE_PATTERN.match(limit or '')
+    if not match:
+        raise ValueError(f"Invalid rate limit {limit!r}")
+    return int(match.group(1)), _RATE_PERIODS[match.group(2).lower()]
+
+
+def is_retryable(error):
+    """Whether a scrape failure is worth retrying: throttling, server errors
+    and connection problems"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, requests.RequestException)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``rate`` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostRateLimiter:
+    """One token bucket per upstream host"""
+
+    def __init__(self, limit=None):
+        count, period = parse_rate(limit or Config.SCRAPE_RATELIMIT)
+        self.rate = count / period
+        self.capacity = count
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.capacity)
+        bucket.acquire()
+
+
+class BulkStats:
+    """Counters for one bulk run"""
+
+    def __init__(self):
+        self.scraped = 0
+        self.not_found = 0
+        self.failed = 0
+        self.retries = 0
+        self.not_modified = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.pages_written = 0
+        self.posts_written = 0
+        self.batches = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def to_dict(self):
+        return {
+            'scraped': self.scraped,
+            'not_found': self.not_found,
+            'failed': self.failed,
+            'retries': self.retries,
+            'not_modified': self.not_modified,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'pages_written': self.pages_written,
+            'posts_written': self.posts_written,
+            'batches': self.batches,
+            'elapsed': round(time.monotonic() - self.started, 3)
+        }
+
+
+def count_writes(written, stats):
+    """Add an ingest result to ``stats`` and return its per-collection totals"""
+    totals = written.totals()
+    stats.incr('batches')
+    stats.incr('pages_written', totals.get(Page.collection.name, {}).get('operations', 0))
+    stats.incr('posts_written', totals.get(Post.collection.name, {}).get('operations', 0))
+    return totals
+
+
+class BulkScraper:
+    """Scrape many pages concurrently and store them in batches.
+
+    A bounded pool of worker threads pulls usernames from a queue, waits on
+    the per-host rate limiter, scrapes with retry and exponential backoff,
+    and hands results to the calling thread, which stores them with
+    models.ingest once ``batch_size`` pages are ready.
+
+    With ``refresh=True`` pages that are already stored are refreshed
+    incrementally instead: a conditional fetch that finds no change costs
+    no parse or write, and changed pages only get their changed fields and
+    new posts written.
+
+    With ``stream=True`` each worker stores new pages itself with
+    iter_scrape, posts and followers in bounded batches as the page
+    downloads, so memory no longer grows with page size times workers.
+
+    With ``parse_processes`` set, worker threads only download and the
+    parsing runs in a ParsePool of that many processes, so extraction is
+    no longer limited to one core by the GIL. Stream mode still parses
+    new pages in the worker threads, as it overlaps parse and download.
+    """
+
+    def __init__(self, workers=None, batch_size=None, max_retries=None, rate_limit=None,
+                 scraper_factory=FacebookScraper, refresh=False, stream=False, parse_processes=None):
+        self.workers = workers or Config.BULK_WORKERS
+        self.batch_size = batch_size or Config.BULK_BATCH_SIZE
+        self.max_retries = Config.BULK_MAX_RETRIES if max_retries is None else max_retries
+        self.limiter = HostRateLimiter(rate_limit)
+        self.scraper_factory = scraper_factory
+        self.refresh = refresh
+        self.stream = stream
+        parse_processes = Config.PARSE_PROCESSES if parse_processes is None else parse_processes
+        self.parse_pool = ParsePool(parse_processes) if parse_processes else None
+        self.local = threading.local()
+
+    def _scraper(self):
+        # requests.Session is not thread-safe, keep one scraper per worker
+        scraper = getattr(self.local, 'scraper', None)
+        if scraper is None:
+            scraper = self.local.scraper = self.scraper_factory()
+        return scraper
+
+    def scrape_one(self, username, stats, validators=None):
+        """Scrape a single page, retrying transient failures"""
+        if self.parse_pool is not None:
+            fetch = lambda scraper: self._fetch_and_parse(scraper, username, validators)
+        else:
+            fetch = lambda scraper: scraper.fetch_page(username, validators)
+        return self._with_retries(username, stats, fetch)
+
+    def _fetch_and_parse(self, scraper, username, validators):
+        fetched = scraper.fetch_body(username, validators)
+        if fetched is NOT_MODIFIED:
+            return NOT_MODIFIED
+        page_data = decode_page(self.parse_pool.run(
+            parse_body, username, fetched['url'], fetched['body'], fetched['encoding'], scraper.parser
+        ))
+        page_data.update(fetched['validators'])
+        return page_data
+
+    def stream_one(self, username, stats):
+        """Scrape and store a single page batch by batch, retrying transient failures"""
+        written = self._with_retries(
+            username, stats, lambda scraper: ingest_scrape(username, scraper.iter_scrape(username))
+        )
+        if written is not None:
+            count_writes(written, stats)
+
+    def _with_retries(self, username, stats, fetch):
+        """``fetch(scraper)`` with retry and backoff; None when the page is
+        missing or the retries are used up"""
+        scraper = self._scraper()
+        url = scraper.page_url(username)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(url)
+            try:
+                result = fetch(scraper)
+                stats.incr('scraped')
+                return result
+            except Exception as e:
+                if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 404:
+                    stats.incr('not_found')
+                    return None
+                if not is_retryable(e) or attempt == self.max_retries:
+                    logging.error(f"Giving up on {username} after {attempt + 1} attempts: {e}")
+                    stats.incr('failed')
+                    return None
+                delay = min(Config.BULK_BACKOFF_MAX, Config.BULK_BACKOFF_BASE * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.0)
+                logging.warning(f"Retrying {username} in {delay:.1f}s: {e}")
+                stats.incr('retries')
+                time.sleep(delay)
+
+    def _worker(self, usernames, results, stats):
+        while True:
+            username = usernames.get()
+            if username is _DONE:
+                results.put(_DONE)
+                return
+            try:
+                page = None
+                if self.refresh:
+                    page = Page.find_by_username(username, REFRESH_PROJECTION)
+                if self.stream and page is None:
+                    self.stream_one(username, stats)
+                    continue
+                page_data = self.scrape_one(username, stats, get_validators(page))
+                if page_data is NOT_MODIFIED:
+                    stats.incr('not_modified')
+                elif page_data and page:
+                    stats.incr(apply_refresh(page, page_data))
+                elif page_data:
+                    results.put(page_data)
+            except Exception as e:
+                # A dead worker would never put _DONE and run() would wait forever
+                logging.error(f"Failed to process {username}: {e}")
+                stats.incr('failed')
+
+    def write_batch(self, batch, stats):
+        """Store one batch of scraped pages with their posts, comments and followers"""
+        totals = count_writes(ingest(batch), stats)
+        logging.info(f"Wrote batch of {len(batch)} pages: {totals}")
+
+    def run(self, usernames):
+        """Scrape all usernames and return a BulkStats"""
+        stats = BulkStats()
+        pending = queue.Queue()
+        # Bounded so that workers block instead of piling up unwritten pages
+        results = queue.Queue(maxsize=self.batch_size * 2)
+
+        threads = [
+            threading.Thread(target=self._worker, args=(pending, results, stats), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for username in dict.fromkeys(usernames):
+            pending.put(username)
+        for _ in threads:
+            pending.put(_DONE)
+
+        batch = []
+        running = len(threads)
+        while running:
+            item = results.get()
+            if item is _DONE:
+                running -= 1
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch, stats)
+                batch = []
+        if batch:
+            self.write_batch(batch, stats)
+
+        for thread in threads:
+            thread.join()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        flush_writes()
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape Facebook pages in bulk")
+    parser.add_argument('file', help="File with one username per line")
+    parser.add_argument('--workers', type=int, default=Config.BULK_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=Config.BULK_BATCH_SIZE)
+    parser.add_argument('--refresh', action='store_true',
+                        help="Refresh stored pages incrementally instead of skipping them")
+    parser.add_argument('--rate-limit', default=Config.SCRAPE_RATELIMIT,
+                        help="Requests per host, e.g. '100/hour'")
+    parser.add_argument('--stream', action='store_true',
+                        help="Store new pages in batches while they download instead of whole")
+    parser.add_argument('--parse-processes', type=int, default=Config.PARSE_PROCESSES,
+                        help="Parse in this many worker processes instead of the download threads")
+    args = parser.parse_args()
+
+    with open(args.file) as f:
+        usernames = [line.strip() for line in f if line.strip()]
+
+    setup_logging()
+    stats = BulkScraper(
+        workers=args.workers,
+        batch_size=args.batch_size,
+        rate_limit=args.rate_limit,
+        refresh=args.refresh,
+        stream=args.stream,
+        parse_processes=args.parse_processes
+    ).run(usernames)
+    logging.info(f"Bulk scrape finished: {stats.to_dict()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,527 @@
+from collections import OrderedDict
+from config import Config
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+class _Entry:
+    __slots__ = ('payload', 'fresh_until', 'stale_until', 'tags')
+
+    def __init__(self, payload, fresh_until, stale_until, tags):
+        self.payload = payload
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+        self.tags = tags
+
+    @property
+    def size(self):
+        return len(self.payload)
+
+class LRUCache:
+    """In-process LRU of pickled values bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes, max_items=None):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.bytes += entry.size
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.bytes > self.max_bytes or (self.max_items and len(self._entries) > self.max_items):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+class SQLiteCache:
+    """Cache shared by all worker processes on a host, backed by one SQLite file.
+
+    Tag invalidations are appended to a log so that every process can drop
+    the same entries from its in-process layer.
+    """
+
+    # Invalidation log rows kept for processes that have not caught up yet
+    LOG_RETENTION = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY, payload BLOB, fresh_until REAL, stale_until REAL
+                );
+                CREATE TABLE IF NOT EXISTS entry_tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key));
+                CREATE INDEX IF NOT EXISTS entry_tags_key ON entry_tags (key);
+                CREATE TABLE IF NOT EXISTS invalidations (id INTEGER PRIMARY KEY AUTOINCREMENT, tag TEXT);
+            """)
+
+    def _connect(self):
+        # One connection per thread, reopened after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT payload, fresh_until, stale_until FROM entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        tags = tuple(tag for (tag,) in self._connect().execute(
+            'SELECT tag FROM entry_tags WHERE key = ?', (key,)
+        ))
+        return _Entry(row[0], row[1], row[2], tags)
+
+    # Keys per query, below SQLite's bound parameter limit
+    MAX_KEYS = 500
+
+    def get_many(self, keys):
+        """Map of key to entry for the stored keys, in one query per MAX_KEYS keys"""
+        conn = self._connect()
+        entries = {}
+        keys = list(keys)
+        for start in range(0, len(keys), self.MAX_KEYS):
+            chunk = keys[start:start + self.MAX_KEYS]
+            marks = ','.join('?' * len(chunk))
+            tags = {}
+            for tag, key in conn.execute(f'SELECT tag, key FROM entry_tags WHERE key IN ({marks})', chunk):
+                tags.setdefault(key, []).append(tag)
+            for key, payload, fresh_until, stale_until in conn.execute(
+                f'SELECT key, payload, fresh_until, stale_until FROM entries WHERE key IN ({marks})', chunk
+            ):
+                entries[key] = _Entry(payload, fresh_until, stale_until, tuple(tags.get(key, ())))
+        return entries
+
+    def set(self, key, entry):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, payload, fresh_until, stale_until) VALUES (?, ?, ?, ?)',
+                (key, entry.payload, entry.fresh_until, entry.stale_until)
+            )
+            conn.execute('DELETE FROM entry_tags WHERE key = ?', (key,))
+            conn.executemany('INSERT INTO entry_tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in entry.tags])
+
+    def delete_tags(self, tags):
+        """Delete entries carrying any of ``tags`` and log the invalidation; returns its sequence"""
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            seq = None
+            for tag in tags:
+                conn.execute(
+                    'DELETE FROM entries WHERE key IN (SELECT key FROM entry_tags WHERE tag = ?)', (tag,)
+                )
+                conn.execute('DELETE FROM entry_tags WHERE tag = ?', (tag,))
+                seq = conn.execute('INSERT INTO invalidations (tag) VALUES (?)', (tag,)).lastrowid
+            if seq is not None and seq % 1000 == 0:
+                conn.execute('DELETE FROM invalidations WHERE id <= ?', (seq - self.LOG_RETENTION,))
+            return seq
+
+    def invalidations_since(self, seq):
+        """Tags invalidated after ``seq`` as a list of (seq, tag)"""
+        return self._connect().execute(
+            'SELECT id, tag FROM invalidations WHERE id > ? ORDER BY id', (seq,)
+        ).fetchall()
+
+    def last_invalidation(self):
+        row = self._connect().execute('SELECT MAX(id) FROM invalidations').fetchone()
+        return row[0] or 0
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM entry_tags')
+
+class InvalidationFeed:
+    """Tag invalidations exchanged with processes on other hosts, e.g.
+    worker.py, through a log in the database.
+
+    ``store`` is models.CacheInvalidation or anything with its add(tags,
+    origin) and since(at). Entries are read again for
+    CACHE_INVALIDATION_SKEW seconds past the newest one seen, so that one
+    written by a host whose clock is slightly behind is not missed.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.origin = uuid.uuid4().hex
+        self.mark = datetime.utcnow()
+        self.seen = {}
+        self.polled = 0.0
+        self.lock = threading.Lock()
+
+    def publish(self, tags):
+        self.store.add(tags, self.origin)
+
+    def poll(self):
+        """Tags other processes invalidated since the last poll, read at
+        most once per CACHE_INVALIDATION_POLL seconds"""
+        if time.monotonic() - self.polled < Config.CACHE_INVALIDATION_POLL:
+            return set()
+        # Another thread is already reading them
+        if not self.lock.acquire(blocking=False):
+            return set()
+        try:
+            self.polled = time.monotonic()
+            skew = timedelta(seconds=Config.CACHE_INVALIDATION_SKEW)
+            tags = set()
+            for entry in self.store.since(self.mark - skew):
+                if entry['_id'] in self.seen:
+                    continue
+                self.seen[entry['_id']] = entry['at']
+                self.mark = max(self.mark, entry['at'])
+                if entry['origin'] != self.origin:
+                    tags.update(entry['tags'])
+            self.seen = {key: at for key, at in self.seen.items() if at >= self.mark - skew}
+            return tags
+        finally:
+            self.lock.release()
+
+class TieredCache:
+    """Two-tier cache: a size-bounded LRU in each process in front of an
+    optional shared SQLite layer.
+
+    Entries carry tags; ``invalidate`` drops every entry with a tag from
+    both layers and, through the shared invalidation log, from the LRU of
+    every other process before its next read. With an InvalidationFeed
+    (``feed``) invalidations also reach processes that share no SQLite
+    file, within CACHE_INVALIDATION_POLL seconds. Entries stay fresh for
+    ``timeout`` seconds and may then be served for ``stale_timeout`` more
+    seconds while ``get_or_load`` reloads them in the background.
+    """
+
+    def __init__(self, max_bytes=None, max_items=None, default_timeout=None, stale_timeout=None, l2_path=None,
+                 feed=None):
+        self.l1 = LRUCache(
+            max_bytes or Config.CACHE_L1_MAX_BYTES,
+            max_items or Config.CACHE_THRESHOLD
+        )
+        self.l2 = SQLiteCache(l2_path) if l2_path else None
+        self.feed = feed
+        self.default_timeout = default_timeout or Config.CACHE_DEFAULT_TIMEOUT
+        self.stale_timeout = Config.CACHE_STALE_TIMEOUT if stale_timeout is None else stale_timeout
+        self.metrics = dict.fromkeys(
+            ('l1_hits', 'l2_hits', 'misses', 'stale_hits', 'sets', 'invalidations', 'revalidations'), 0
+        )
+        self._lock = threading.Lock()
+        self._seq = self.l2.last_invalidation() if self.l2 else 0
+        self._tag_versions = {}
+        self._refreshing = set()
+
+    def _count(self, metric):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def _sync(self):
+        """Apply invalidations logged by other processes to the local layer"""
+        if self.feed is not None:
+            try:
+                tags = self.feed.poll()
+            except Exception as e:
+                logging.warning(f"Reading cache invalidations failed: {e}")
+                tags = ()
+            if tags:
+                self._invalidate(tags)
+        if self.l2 is None:
+            return
+        rows = self.l2.invalidations_since(self._seq)
+        if not rows:
+            return
+        self.l1.delete_tags({tag for _, tag in rows})
+        with self._lock:
+            for seq, tag in rows:
+                self._tag_versions[tag] = seq
+            self._seq = max(self._seq, rows[-1][0])
+
+    def _lookup(self, key):
+        """Return (value, fresh) or None"""
+        return self._lookup_many([key]).get(key)
+
+    def _lookup_many(self, keys):
+        """Map of key to (value, fresh) for the keys that were found, reading
+        the shared layer once for all local misses"""
+        self._sync()
+        now = time.time()
+        entries, missing = {}, []
+        for key in keys:
+            entry = self.l1.get(key)
+            if entry is not None and entry.stale_until <= now:
+                self.l1.delete(key)
+                entry = None
+            if entry is not None:
+                entries[key] = entry
+                self._count('l1_hits')
+            else:
+                missing.append(key)
+        if missing and self.l2 is not None:
+            for key, entry in self.l2.get_many(missing).items():
+                if entry.stale_until > now:
+                    self.l1.set(key, entry)
+                    entries[key] = entry
+                    self._count('l2_hits')
+        found = {}
+        for key in keys:
+            entry = entries.get(key)
+            if entry is None:
+                self._count('misses')
+                continue
+            fresh = entry.fresh_until > now
+            if not fresh:
+                self._count('stale_hits')
+            found[key] = (pickle.loads(entry.payload), fresh)
+        return found
+
+    def get(self, key):
+        """Cached value (fresh or stale) or None"""
+        found = self._lookup(key)
+        return found[0] if found else None
+
+    def get_many(self, keys):
+        """Map of key to cached value for the keys that were found"""
+        return {key: value for key, (value, _) in self._lookup_many(keys).items()}
+
+    def set(self, key, value, timeout=None, tags=(), stale_timeout=None, since=None):
+        """Cache ``value``; with ``since`` (an invalidation sequence taken
+        before the value was loaded) the write is dropped if any of its
+        tags was invalidated in between"""
+        if since is not None:
+            with self._lock:
+                if any(self._tag_versions.get(tag, 0) > since for tag in tags):
+                    return False
+        now = time.time()
+        fresh_until = now + (timeout or self.default_timeout)
+        stale = self.stale_timeout if stale_timeout is None else stale_timeout
+        entry = _Entry(
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL), fresh_until, fresh_until + stale, tuple(tags)
+        )
+        self.l1.set(key, entry)
+        if self.l2 is not None:
+            try:
+                self.l2.set(key, entry)
+            except sqlite3.Error as e:
+                logging.warning(f"Shared cache write failed for {key}: {e}")
+        self._count('sets')
+        return True
+
+    def get_or_load(self, key, loader, timeout=None, tags=(), stale_timeout=None):
+        """Return the cached value for ``key``, calling ``loader`` on a miss.
+
+        Stale hits are returned immediately and reloaded in a background
+        thread. ``loader`` results of None are not cached. ``tags`` may be a
+        function of the loaded value.
+        """
+        found = self._lookup(key)
+        if found is not None:
+            value, fresh = found
+            if not fresh:
+                self._revalidate(key, loader, timeout, tags, stale_timeout)
+            return value
+        return self._load(key, loader, timeout, tags, stale_timeout)
+
+    def get_or_load_many(self, keys, loader, timeout=None, tags=(), stale_timeout=None):
+        """Map of key to value for ``keys``, calling ``loader(missing_keys)``
+        once for all misses; it returns a map of key to value.
+
+        Like get_or_load, stale hits are reloaded in the background, one key
+        at a time, and None values are neither cached nor returned.
+        """
+        values = {}
+        for key, (value, fresh) in self._lookup_many(keys).items():
+            values[key] = value
+            if not fresh:
+                self._revalidate(key, lambda key=key: loader([key]).get(key), timeout, tags, stale_timeout)
+        missing = [key for key in keys if key not in values]
+        if not missing:
+            return values
+
+        since = self._seq
+        loaded = loader(missing)
+        self._sync()
+        for key in missing:
+            value = loaded.get(key)
+            if value is None:
+                continue
+            values[key] = value
+            self.set(key, value, timeout, tags(value) if callable(tags) else tags, stale_timeout, since=since)
+        return values
+
+    def _load(self, key, loader, timeout, tags, stale_timeout):
+        since = self._seq
+        value = loader()
+        if value is not None:
+            if callable(tags):
+                tags = tags(value)
+            self._sync()
+            self.set(key, value, timeout, tags, stale_timeout, since=since)
+        return value
+
+    def _revalidate(self, key, loader, timeout, tags, stale_timeout):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._load(key, loader, timeout, tags, stale_timeout)
+                self._count('revalidations')
+            except Exception as e:
+                logging.warning(f"Background revalidation of {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying one of ``tags`` from all layers and processes"""
+        tags = [tag for tag in tags if tag]
+        if not tags:
+            return
+        self._invalidate(tags)
+        if self.feed is not None:
+            try:
+                self.feed.publish(tags)
+            except Exception as e:
+                logging.error(f"Publishing cache invalidation failed for {tags}: {e}")
+
+    def _invalidate(self, tags):
+        self.l1.delete_tags(tags)
+        seq = None
+        if self.l2 is not None:
+            try:
+                seq = self.l2.delete_tags(tags)
+            except sqlite3.Error as e:
+                logging.error(f"Shared cache invalidation failed for {tags}: {e}")
+        with self._lock:
+            if self.l2 is None:
+                self._seq += 1
+                seq = self._seq
+            # Loads that started before this point must not cache their result
+            seq = seq or self._seq + 1
+            for tag in tags:
+                self._tag_versions[tag] = max(self._tag_versions.get(tag, 0), seq)
+            self.metrics['invalidations'] += 1
+
+    def clear(self):
+        self.l1.clear()
+        if self.l2 is not None:
+            self.l2.clear()
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        lookups = metrics['l1_hits'] + metrics['l2_hits'] + metrics['misses']
+        metrics.update({
+            'hit_ratio': round((metrics['l1_hits'] + metrics['l2_hits']) / lookups, 4) if lookups else None,
+            'l1_items': len(self.l1),
+            'l1_bytes': self.l1.bytes,
+            'l1_evictions': self.l1.evictions,
+            'l2_enabled': self.l2 is not None
+        })
+        return metrics
+
+def query_key(prefix, args, ignore=()):
+    """Cache key for a list query, independent of argument order and of
+    empty or ignored arguments"""
+    items = sorted(
+        (name.lower(), value.strip())
+        for name, values in args.lists()
+        for value in values
+        if name.lower() not in ignore and value.strip()
+    )
+    return f"{prefix}?{urlencode(items)}" if items else prefix
+
+# Tag of every cached /api/pages listing
+PAGES_TAG = 'pages'
+# Tag of every cached /api/leaderboard listing
+LEADERBOARD_TAG = 'leaderboard'
+
+def page_tag(page_id):
+    """Tag of every cached response derived from one page"""
+    return f'page:{page_id}'
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Process-wide cache configured from Config"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                feed = None
+                if Config.CACHE_INVALIDATION_POLL:
+                    # Imported here, models imports this module
+                    from models import CacheInvalidation
+                    feed = InvalidationFeed(CacheInvalidation)
+                _cache = TieredCache(l2_path=Config.CACHE_L2_PATH, feed=feed)
+    return _cache
+
+def invalidate(*tags):
+    """Invalidate cache tags after a write; model write paths call this"""
+    try:
+        get_cache().invalidate(*tags)
+    except Exception as e:
+        logging.error(f"Cache invalidation failed for {tags}: {e}")
@@ -5,8 +5,6 @@ class Config:
     MONGODB_URI = os.getenv('MONGODB_URI', 'mongomock://localhost:27017/facebook_insights')
     MONGODB_CONNECT_TIMEOUT = 5000  # milliseconds
     MONGODB_SERVER_SELECTION_TIMEOUT = 5000  # milliseconds
-    MONGODB_MAX_RETRIES = 3
-    MONGODB_RETRY_DELAY = 2  # seconds
     MONGODB_CONNECT_OPTIONS = {
         "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT,
         "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT,
@@ -18,25 +16,130 @@ class Config:
         "waitQueueTimeoutMS": 5000
     }
 
+    # Index migration: 'background' syncs indexes once per index version from
+    # the first worker that starts, 'off' leaves it to `python migrate.py`
+    INDEX_MIGRATION = os.getenv('INDEX_MIGRATION', 'background')
+    INDEX_MIGRATION_LOCK_TTL = 600  # seconds
+
     # Cache configuration
-    CACHE_TYPE = "SimpleCache"  # Using simple cache for development
     CACHE_DEFAULT_TIMEOUT = 300  # 5 minutes
-    CACHE_THRESHOLD = 1000  # Maximum number of items the cache will store
+    CACHE_STALE_TIMEOUT = 60  # seconds an expired entry is served while it is reloaded
+    CACHE_THRESHOLD = 1000  # Maximum number of items the in-process cache will store
+    CACHE_L1_MAX_BYTES = 64 * 1024 * 1024  # size budget of the in-process cache
+    CACHE_L2_PATH = os.getenv('CACHE_L2_PATH')  # SQLite file shared by the workers, unset to disable
+    # Seconds between reads of the cache invalidations other processes, such as worker.py, log in MongoDB;
+    # bounds how long their writes leave cached responses stale. 0 disables the log
+    CACHE_INVALIDATION_POLL = float(os.getenv('CACHE_INVALIDATION_POLL', 1))
+    CACHE_INVALIDATION_SKEW = 5  # seconds the clocks of hosts writing invalidations may differ by
 
     # Flask configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key')
     DEBUG = True
-    LOG_LEVEL = 'DEBUG'
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 
     # Scraping configuration
     MAX_POSTS_PER_PAGE = 40
     MAX_COMMENTS_PER_POST = 100
     MAX_FOLLOWERS_PER_PAGE = 1000
+    SCRAPER_BASE_URL = os.getenv('SCRAPER_BASE_URL', 'https://www.facebook.com')
+    SCRAPER_PARSER = os.getenv('SCRAPER_PARSER', 'html.parser')  # html.parser, lxml or stream
+    SCRAPER_CHUNK_SIZE = 64 * 1024  # bytes per chunk in streaming mode
+    SCRAPE_BATCH_SIZE = 100  # posts or followers per batch yielded by iter_scrape
+    SCRAPE_LOCK_TTL = 60  # seconds a worker may hold the scrape lease for a page
+    SCRAPE_LOCK_WAIT = 30  # seconds other workers wait for that scrape to finish
+    SCRAPE_LOCK_POLL_INTERVAL = 0.25  # seconds
 
     # Rate limiting
     RATELIMIT_DEFAULT = "100/hour"
     RATELIMIT_STORAGE_URL = "memory://"
 
+    # Bulk scraping
+    SCRAPE_RATELIMIT = os.getenv('SCRAPE_RATELIMIT', RATELIMIT_DEFAULT)  # per upstream host
+    BULK_WORKERS = 16
+    BULK_BATCH_SIZE = 100
+    BULK_MAX_RETRIES = 3
+    BULK_BACKOFF_BASE = 1  # seconds, doubled on every retry
+    BULK_BACKOFF_MAX = 60  # seconds
+    PARSE_PROCESSES = 0  # parser processes for bulk scraping, 0 parses in the worker threads
+    PARSE_MAX_PENDING = 2  # bodies queued per parser process before fetching blocks
+
+    # Background jobs
+    SCRAPE_MODE = os.getenv('SCRAPE_MODE', 'queue')  # 'queue' for the worker processes, 'inline' in the request
+    JOB_WORKERS = 4  # concurrent jobs per worker process
+    JOB_LEASE_SECONDS = 120  # a running job is handed to another worker after this
+    JOB_MAX_ATTEMPTS = 3
+    JOB_BACKOFF_BASE = 5  # seconds before the first retry, doubled on every retry
+    JOB_BACKOFF_MAX = 300  # seconds
+    JOB_POLL_INTERVAL = 1  # seconds an idle worker thread waits before polling again
+    JOB_RETENTION_SECONDS = 86400  # finished jobs are kept this long
+    JOB_NOT_FOUND_TTL = 600  # seconds a page reported missing upstream is not scraped again
+    JOB_PRIORITY_INTERACTIVE = 10  # API requests go ahead of scheduled refreshes
+
+    # Media
+    # Query parameters that change between fetches of the same CDN asset
+    # (signatures, expiry, cache hints); shell-style patterns
+    MEDIA_VOLATILE_PARAMS = ('oh', 'oe', 'efg', 'ccb', '_nc_*')
+    MEDIA_RESOLVE_MAX = 500  # media ids per /api/media/resolve request
+
+    # Refresh scheduling
+    SCHEDULE_BUDGET = int(os.getenv('SCHEDULE_BUDGET', 500))  # scheduled refreshes per hour for all pages together
+    SCHEDULE_MIN_INTERVAL = 900  # seconds, shortest time between refreshes of a page
+    SCHEDULE_MAX_INTERVAL = 7 * 86400  # seconds, longest
+    SCHEDULE_PRIOR_CHANGE_RATE = 1 / 24  # changes per hour assumed for a page without history
+    SCHEDULE_HISTORY_DECAY = 0.8  # weight of each older check in the change rate estimate
+    SCHEDULE_DEMAND_WINDOW = 24  # hours over which API requests for a page are averaged
+    SCHEDULE_BASE_DEMAND = 0.05  # requests per hour credited to every page, so unviewed pages still refresh
+    SCHEDULE_TICK = 60  # seconds between scheduler passes
+    SCHEDULE_PLAN_INTERVAL = 900  # seconds between recomputing the interval of every page
+    SCHEDULE_VIEW_FLUSH = 30  # seconds API requests are counted in memory before being written
+
+    # Bulk writes
+    INGEST_BATCH_SIZE = 500  # operations per unordered bulk_write
+    # 'on' queues page, post metric, follower and history updates and writes them
+    # in merged batches from a background thread; reads may lag by up to the interval
+    WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'off')
+    WRITE_BEHIND_MAX_OPS = 1000  # pending documents that trigger a flush
+    WRITE_BEHIND_INTERVAL = 1.0  # seconds between flushes
+    WRITE_BEHIND_MAX_PENDING = 10000  # pending documents at which writers block
+
+    # Follower history
+    HISTORY_RAW_RETENTION_DAYS = 30  # every scrape, one bucket per page per day
+    HISTORY_HOURLY_RETENTION_DAYS = 365  # hourly points, one bucket per page per month
+    HISTORY_DAILY_RETENTION_DAYS = None  # daily points, one bucket per page per year, kept forever
+    HISTORY_DEFAULT_RANGE_DAYS = 30
+
+    # Search
+    SEARCH_MIN_PREFIX = 2  # shortest word still being typed that is matched as a prefix
+
+    # HTTP caching and compression
+    HTTP_MAX_AGE = {  # Cache-Control max-age per route, in seconds
+        'page': 60,
+        'pages': 30,
+        'posts': 60,
+        'stats': 300,
+        'history': 300,
+        'leaderboard': 300,
+        'search': 30
+    }
+    COMPRESS_MIN_BYTES = 1024  # smaller bodies are sent uncompressed
+    GZIP_LEVEL = 6
+    BROTLI_QUALITY = 5  # used when the optional brotli package is installed
+
+    # Instrumentation
+    SLOW_REQUEST_SECONDS = 1.0  # requests slower than this are logged with their phase breakdown
+    SLOW_QUERY_SECONDS = 0.1  # MongoDB commands slower than this are logged and explained
+    EXPLAIN_SAMPLE_RATE = float(os.getenv('EXPLAIN_SAMPLE_RATE', '0.01'))  # fraction of reads explained
+    EXPLAIN_INTERVAL = 300  # seconds before the same query shape is explained again
+    PROFILING = os.getenv('PROFILING', 'off')  # 'on' lets ?profile=1 return a cProfile report
+    PROFILE_LIMIT = 40  # functions listed in a profile report
+
+    # Page rankings
+    TOP_PAGES_SIZE = 200  # pages per category ranked by followers in memory for /api/pages, 0 disables
+    TOP_PAGES_TTL = 60  # seconds before a ranking is reloaded to pick up writes from other processes
+    TOP_PAGES_CATEGORIES = 1000  # categories whose rankings are kept, least recently used go first
+
     # Default pagination settings
     DEFAULT_PAGE_SIZE = 10
-    MAX_PAGE_SIZE = 100
\ No newline at end of file
+    MAX_PAGE_SIZE = 100
+    BATCH_MAX_USERNAMES = 100  # usernames per /api/pages/batch request
+    BATCH_INLINE_SCRAPES = 5  # unknown pages /api/pages/batch scrapes during the request with SCRAPE_MODE=inline
\ No newline at end of file
@@ -0,0 +1,243 @@
+from config import Config
+from pymongo import monitoring
+import metrics
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters of this process's MongoClient"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.pool_clears = 0
+
+    def _add(self, **deltas):
+        with self.lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        timed_out = event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT
+        self._add(waiting=-1, checkout_failures=1, checkout_timeouts=int(timed_out))
+
+    def connection_checked_out(self, event):
+        wait = event.duration or 0.0
+        with self.lock:
+            self.waiting -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'open': self.open,
+                'checked_out': self.checked_out,
+                'waiting': self.waiting,
+                'max_pool_size': Config.MONGODB_CONNECT_OPTIONS.get('maxPoolSize'),
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'checkout_timeouts': self.checkout_timeouts,
+                'avg_wait_ms': round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else 0,
+                'max_wait_ms': round(self.max_wait_seconds * 1000, 3),
+                'pool_clears': self.pool_clears
+            }
+
+MONGO_COMMAND = metrics.Histogram(
+    'mongo_command_duration_seconds', "MongoDB command latency", ('command', 'collection')
+)
+MONGO_SLOW = metrics.Counter('mongo_slow_commands_total', "MongoDB commands slower than SLOW_QUERY_SECONDS",
+                             ('command', 'collection'))
+MONGO_FAILED = metrics.Counter('mongo_failed_commands_total', "MongoDB commands that failed",
+                               ('command', 'collection'))
+MONGO_COLLSCANS = metrics.Counter('mongo_collscan_queries_total', "Sampled queries planned as a collection scan",
+                                  ('command', 'collection'))
+
+def query_shape(value):
+    """``value`` with every literal replaced by 1, for logging queries without their data"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(item) for item in value[:1]]
+    return 1
+
+def _plan_stages(plan):
+    """Stage names of an explain result, leaving out rejected plans"""
+    if isinstance(plan, dict):
+        if isinstance(plan.get('stage'), str):
+            yield plan['stage']
+        for key, value in plan.items():
+            if key != 'rejectedPlans':
+                yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+class QuerySampler:
+    """Explain sampled read queries on a background thread and count the
+    ones whose winning plan scans the whole collection.
+
+    Each query shape is explained at most once per EXPLAIN_INTERVAL, and
+    queries are dropped while ``max_pending`` are already waiting.
+    """
+
+    # Command fields that describe the query, by command
+    QUERY_FIELDS = {
+        'find': ('filter', 'sort', 'hint'),
+        'aggregate': ('pipeline', 'hint'),
+        'count': ('query', 'hint'),
+        'distinct': ('key', 'query')
+    }
+    # Session and routing fields the explain command must not repeat
+    SESSION_FIELDS = frozenset(('lsid', 'txnNumber', 'autocommit', 'startTransaction'))
+
+    def __init__(self, max_pending=100):
+        # Set by CommandStats.attach once the client exists
+        self.client = None
+        self.pending = queue.Queue(max_pending)
+        self.explained = {}
+        self.lock = threading.Lock()
+        self.thread_pid = None
+
+    def shape(self, command_name, command):
+        return json.dumps(
+            {field: query_shape(command.get(field)) for field in self.QUERY_FIELDS[command_name] if field in command},
+            sort_keys=True, default=str
+        )
+
+    def offer(self, database, collection, command_name, command):
+        """Queue a query for explain unless its shape was explained recently"""
+        shape = self.shape(command_name, command)
+        now = time.monotonic()
+        with self.lock:
+            last = self.explained.get((collection, shape))
+            if last is not None and now - last < Config.EXPLAIN_INTERVAL:
+                return
+            self.explained[(collection, shape)] = now
+            if self.thread_pid != os.getpid():
+                self.thread_pid = os.getpid()
+                threading.Thread(target=self._run, name='query-sampler', daemon=True).start()
+        body = {key: value for key, value in command.items()
+                if not key.startswith('$') and key not in self.SESSION_FIELDS}
+        try:
+            self.pending.put_nowait((database, collection, command_name, shape, body))
+        except queue.Full:
+            pass
+
+    def explain(self, database, collection, command_name, shape, body):
+        """Explain one query, returning whether it scans the collection"""
+        plan = self.client[database].command('explain', body, verbosity='queryPlanner')
+        if 'COLLSCAN' not in set(_plan_stages(plan)):
+            return False
+        MONGO_COLLSCANS.inc(command=command_name, collection=collection)
+        logging.warning(f"Unindexed {command_name} on {collection} scans the collection: {shape}")
+        return True
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            try:
+                self.explain(*item)
+            except Exception as e:
+                logging.debug(f"Failed to explain query on {item[1]}: {e}")
+
+class CommandStats(monitoring.CommandListener):
+    """Time every MongoDB command, log slow ones and sample reads for
+    explain to catch queries no index serves"""
+
+    # Driver housekeeping that says nothing about our queries
+    IGNORED = frozenset(('hello', 'isMaster', 'ismaster', 'ping', 'explain', 'endSessions',
+                         'saslStart', 'saslContinue', 'killCursors'))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.sampler = QuerySampler()
+
+    def attach(self, client):
+        """Explain sampled queries through ``client``, the one this listens to"""
+        self.sampler.client = client
+
+    def started(self, event):
+        name = event.command_name
+        if name in self.IGNORED:
+            return
+        command = event.command
+        collection = command.get('collection') if name == 'getMore' else command.get(name)
+        # Only reads are kept, for explain
+        explainable = command if name in QuerySampler.QUERY_FIELDS else None
+        with self.lock:
+            self.running[(event.connection_id, event.request_id)] = (
+                collection if isinstance(collection, str) else '', event.database_name, explainable
+            )
+
+    def _finished(self, event):
+        with self.lock:
+            return self.running.pop((event.connection_id, event.request_id), None)
+
+    def succeeded(self, event):
+        running = self._finished(event)
+        if running is None:
+            return
+        collection, database, command = running
+        name = event.command_name
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND.observe(seconds, command=name, collection=collection)
+        metrics.record('db', seconds)
+        slow = seconds >= Config.SLOW_QUERY_SECONDS
+        if slow:
+            MONGO_SLOW.inc(command=name, collection=collection)
+            shape = self.sampler.shape(name, command) if command is not None else ''
+            logging.warning(f"Slow MongoDB {name} on {collection}: {seconds * 1000:.0f}ms {shape}")
+        if command is not None and (slow or random.random() < Config.EXPLAIN_SAMPLE_RATE):
+            self.sampler.offer(database, collection, name, command)
+
+    def failed(self, event):
+        running = self._finished(event)
+        if running is None:
+            return
+        seconds = event.duration_micros / 1e6
+        MONGO_FAILED.inc(command=event.command_name, collection=running[0])
+        MONGO_COMMAND.observe(seconds, command=event.command_name, collection=running[0])
+        metrics.record('db', seconds)
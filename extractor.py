@@ -0,0 +1,568 @@
+from bs4.builder import HTMLTreeBuilder
+from bs4.element import (
+    CData, NavigableString, RubyParenthesisString, RubyTextString, Script,
+    Stylesheet, Tag, TemplateString
+)
+from datetime import datetime
+from html.parser import HTMLParser
+from records import Author, Comment, Follower, Page, Post
+import collections
+import itertools
+import logging
+import re
+
+# Precompiled selector table of the single-pass engine: field -> (tag, attribute, pattern)
+SELECTORS = {
+    'page_name': ('h1', 'class', re.compile(r'.*page-name.*')),
+    'profile_pic': ('img', 'class', re.compile(r'.*profile.*pic.*')),
+    'email': ('a', 'href', re.compile(r'mailto:.*')),
+    'website': ('a', 'href', re.compile(r'https?://(?!.*facebook\.com).*')),
+    'category': ('div', 'class', re.compile(r'.*category.*')),
+    'about': ('div', 'class', re.compile(r'.*about.*')),
+    'post': ('div', 'class', re.compile(r'.*feed.*story.*')),
+    'post_content': ('div', 'class', re.compile(r'.*post-content.*')),
+    'post_likes': ('span', 'class', re.compile(r'.*like.*count.*')),
+    'post_shares': ('span', 'class', re.compile(r'.*share.*count.*')),
+    'comment': ('div', 'class', re.compile(r'.*comment.*')),
+    'comment_author': ('a', 'class', re.compile(r'.*author.*')),
+    'follower': ('div', 'class', re.compile(r'.*follower.*item.*')),
+    'follower_name': ('a', 'class', re.compile(r'.*name.*')),
+}
+
+# Page-level fields located by the first text node matching a pattern
+STRING_SELECTORS = {
+    'follower_count': re.compile(r'.*followers.*', re.I),
+    'likes_count': re.compile(r'.*people like this.*', re.I),
+    'creation_date': re.compile(r'.*Page created.*', re.I),
+}
+
+CREATION_DATE_PATTERN = re.compile(r'(\w+ \d+,? \d{4})')
+
+# Characters of recent text kept for STRING_SELECTORS matches. A matching
+# string's parent is normally a short label; a larger parent, up to the
+# whole body, only contributes its last STRING_LOG_WINDOW characters
+STRING_LOG_WINDOW = 8192
+
+# Text kinds mirror BeautifulSoup's string containers so that captured text
+# matches Tag.get_text() for the same element
+TEXT = 'text'
+STRING_CONTAINERS = frozenset(['rt', 'rp', 'style', 'script', 'template'])
+_STRING_KINDS = {
+    NavigableString: TEXT,
+    CData: TEXT,
+    RubyTextString: 'rt',
+    RubyParenthesisString: 'rp',
+    Stylesheet: 'style',
+    Script: 'script',
+    TemplateString: 'template',
+}
+
+_P = {field: pattern for field, (_, _, pattern) in SELECTORS.items()}
+
+
+def parse_count(text):
+    """Extract number from text like '1.2K' or '1.2M'"""
+    if not text:
+        return 0
+    text = text.strip().upper()
+    multipliers = {'K': 1000, 'M': 1000000, 'B': 1000000000}
+    try:
+        if text[-1] in multipliers:
+            number = float(text[:-1]) * multipliers[text[-1]]
+        else:
+            number = float(text.replace(',', ''))
+        return int(number)
+    except (ValueError, IndexError):
+        return 0
+
+
+def parse_creation_date(text):
+    """Parse the date out of a 'Page created - June 1, 2015' style string"""
+    try:
+        date_match = CREATION_DATE_PATTERN.search(text)
+        if date_match:
+            return datetime.strptime(date_match.group(1), '%B %d, %Y')
+    except Exception as e:
+        logging.error(f"Error parsing creation date: {e}")
+    return None
+
+
+def parse_post_date(title):
+    """Parse a post timestamp from an <abbr title=...>, defaulting to now"""
+    if title:
+        try:
+            return datetime.strptime(title, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+def _matches(pattern, value):
+    """Match an attribute value the way BeautifulSoup's find() does"""
+    if value is None:
+        return False
+    if isinstance(value, str):
+        return pattern.search(value) is not None
+    for item in value:
+        if pattern.search(item) is not None:
+            return True
+    if len(value) != 1:
+        return pattern.search(' '.join(value)) is not None
+    return False
+
+
+class _Capture:
+    """Accumulates the text of one element while it is open"""
+    __slots__ = ('kind', 'chunks')
+
+    def __init__(self, kind=TEXT, chunks=None):
+        self.kind = kind
+        self.chunks = chunks if chunks is not None else []
+
+    @property
+    def text(self):
+        return ''.join(self.chunks)
+
+
+class _PostState:
+    __slots__ = ('content', 'date_seen', 'date_title', 'likes', 'shares',
+                 'comments', 'media_urls')
+
+    def __init__(self):
+        self.content = None
+        self.date_seen = False
+        self.date_title = None
+        self.likes = None
+        self.shares = None
+        self.comments = []
+        self.media_urls = []
+
+    def to_record(self):
+        return Post(
+            content=self.content.text.strip() if self.content else None,
+            created_at=parse_post_date(self.date_title),
+            likes_count=parse_count(self.likes.text) if self.likes else 0,
+            shares_count=parse_count(self.shares.text) if self.shares else 0,
+            comments=[comment.to_record() for comment in self.comments],
+            media_urls=self.media_urls
+        )
+
+
+class _CommentState:
+    __slots__ = ('content', 'author', 'author_url', 'created_at')
+
+    def __init__(self, created_at):
+        self.content = _Capture()
+        self.author = None
+        self.author_url = None
+        self.created_at = created_at  # Facebook might hide actual dates
+
+    def to_record(self):
+        author = None
+        if self.author:
+            author = Author(self.author.text.strip(), self.author_url)
+        return Comment(self.content.text.strip(), self.created_at, author)
+
+
+class _FollowerState:
+    __slots__ = ('name', 'pic_seen', 'profile_pic', 'url_seen', 'profile_url',
+                 'created_at')
+
+    def __init__(self, created_at):
+        self.name = None
+        self.pic_seen = False
+        self.profile_pic = None
+        self.url_seen = False
+        self.profile_url = None
+        self.created_at = created_at
+
+    def to_record(self):
+        return Follower(
+            self.name.text.strip() if self.name else None,
+            self.profile_pic,
+            self.profile_url,
+            self.created_at
+        )
+
+
+class PageExtractor:
+    """Single-pass extraction engine for a Facebook page document.
+
+    The engine consumes start/data/end events in document order and fills
+    in page fields, posts, comments, media and followers as it goes, so the
+    document is only traversed once. Every field is the first match in
+    document order, among descendants only for post/comment/follower
+    scoped fields.
+
+    With ``keep=False`` posts and followers are not collected for
+    result(); each is handed out by drain() once its element has closed,
+    so a page never has to be held in memory in full.
+
+    Only the first ``post_limit`` posts and ``follower_limit`` followers
+    are extracted; None extracts them all.
+
+    ``scraped_at`` defaults to now; pass the download time when
+    extracting a saved document.
+    """
+
+    def __init__(self, username, url, post_limit=None, follower_limit=None, keep=True, scraped_at=None):
+        self.username = username
+        self.url = url
+        self.post_limit = float('inf') if post_limit is None else post_limit
+        self.follower_limit = float('inf') if follower_limit is None else follower_limit
+        self.keep = keep
+        # Comments and followers carry no date of their own, they share the scrape time
+        self.scraped_at = scraped_at or datetime.utcnow()
+
+        self._fields = {}
+        self._first_h1 = None
+        self._posts = []
+        self._followers = []
+        self._post_count = 0
+        self._follower_count = 0
+        self._closed_posts = []
+        self._closed_followers = []
+
+        self._open_posts = []
+        self._open_comments = []
+        self._open_followers = []
+        self._captures = []
+
+        # Page-level string fields need the text of the matching string's
+        # parent, so a flat log of recent text is kept until all are found.
+        # Frames store absolute log positions; _log_base is that of _log[0]
+        self._pending_strings = dict(STRING_SELECTORS)
+        self._log = collections.deque()
+        self._log_base = 0
+        self._log_chars = 0
+
+        # Frames: (kind, log_start, captures, posts, comments, followers)
+        self._frames = [(TEXT, 0, 0, 0, 0, 0)]
+
+        self._handlers = {
+            'div': self._start_div,
+            'a': self._start_a,
+            'img': self._start_img,
+            'span': self._start_span,
+            'h1': self._start_h1,
+            'abbr': self._start_abbr,
+            'video': self._start_video,
+        }
+
+    def _capture(self):
+        capture = _Capture()
+        self._captures.append(capture)
+        return capture
+
+    def start(self, name, attrs):
+        """Open an element. ``attrs`` maps attribute names to values"""
+        log = self._log
+        self._frames.append((
+            name if name in STRING_CONTAINERS else TEXT,
+            self._log_base + len(log) if log is not None else 0,
+            len(self._captures),
+            len(self._open_posts),
+            len(self._open_comments),
+            len(self._open_followers),
+        ))
+        handler = self._handlers.get(name)
+        if handler is not None:
+            handler(attrs)
+
+    def end(self):
+        """Close the most recently opened element"""
+        if len(self._frames) == 1:
+            return
+        _, _, captures, posts, comments, followers = self._frames.pop()
+        del self._captures[captures:]
+        if not self.keep:
+            self._closed_posts.extend(self._open_posts[posts:])
+            self._closed_followers.extend(self._open_followers[followers:])
+        del self._open_posts[posts:]
+        del self._open_comments[comments:]
+        del self._open_followers[followers:]
+
+    def data(self, text, kind=TEXT):
+        """Feed a string node; ``kind`` is None for comments/doctypes"""
+        if kind is not None:
+            for capture in self._captures:
+                if capture.kind == kind:
+                    capture.chunks.append(text)
+
+        log = self._log
+        if log is None:
+            return
+        log.append((kind, text))
+        self._log_chars += len(text)
+        while self._log_chars > STRING_LOG_WINDOW and len(log) > 1:
+            self._log_chars -= len(log.popleft()[1])
+            self._log_base += 1
+        for field, pattern in list(self._pending_strings.items()):
+            if pattern.search(text) is not None:
+                parent_kind, log_start = self._frames[-1][:2]
+                entries = itertools.islice(log, max(log_start - self._log_base, 0), None)
+                chunks = [t for k, t in entries if k == parent_kind]
+                capture = _Capture(parent_kind, chunks)
+                self._captures.append(capture)
+                self._fields[field] = capture
+                del self._pending_strings[field]
+        if not self._pending_strings:
+            self._log = None
+
+    def _first(self, field, attrs, attr):
+        if field not in self._fields and _matches(_P[field], attrs.get(attr)):
+            self._fields[field] = attrs
+            return True
+        return False
+
+    def _start_div(self, attrs):
+        css = attrs.get('class')
+        if css is None:
+            return
+        fields = self._fields
+        if 'category' not in fields and _matches(_P['category'], css):
+            fields['category'] = self._capture()
+        if 'about' not in fields and _matches(_P['about'], css):
+            fields['about'] = self._capture()
+
+        if self._open_posts:
+            if _matches(_P['post_content'], css):
+                for post in self._open_posts:
+                    if post.content is None:
+                        post.content = self._capture()
+            if _matches(_P['comment'], css):
+                comment = _CommentState(self.scraped_at)
+                for post in self._open_posts:
+                    post.comments.append(comment)
+                self._captures.append(comment.content)
+                self._open_comments.append(comment)
+
+        if self._post_count < self.post_limit and _matches(_P['post'], css):
+            post = _PostState()
+            self._post_count += 1
+            if self.keep:
+                self._posts.append(post)
+            self._open_posts.append(post)
+
+        if self._follower_count < self.follower_limit and _matches(_P['follower'], css):
+            follower = _FollowerState(self.scraped_at)
+            self._follower_count += 1
+            if self.keep:
+                self._followers.append(follower)
+            self._open_followers.append(follower)
+
+    def _start_a(self, attrs):
+        self._first('email', attrs, 'href')
+        self._first('website', attrs, 'href')
+
+        css = attrs.get('class')
+        if self._open_comments and _matches(_P['comment_author'], css):
+            for comment in self._open_comments:
+                if comment.author is None:
+                    comment.author = self._capture()
+                    comment.author_url = attrs.get('href')
+        if self._open_followers:
+            is_name = _matches(_P['follower_name'], css)
+            for follower in self._open_followers:
+                if is_name and follower.name is None:
+                    follower.name = self._capture()
+                if not follower.url_seen:
+                    follower.url_seen = True
+                    follower.profile_url = attrs.get('href')
+
+    def _start_img(self, attrs):
+        self._first('profile_pic', attrs, 'class')
+        src = attrs.get('src')
+        if src:
+            for post in self._open_posts:
+                post.media_urls.append(src)
+        for follower in self._open_followers:
+            if not follower.pic_seen:
+                follower.pic_seen = True
+                follower.profile_pic = src
+
+    def _start_video(self, attrs):
+        url = attrs.get('src') or attrs.get('data-url')
+        if url:
+            for post in self._open_posts:
+                post.media_urls.append(url)
+
+    def _start_span(self, attrs):
+        if not self._open_posts:
+            return
+        css = attrs.get('class')
+        if _matches(_P['post_likes'], css):
+            for post in self._open_posts:
+                if post.likes is None:
+                    post.likes = self._capture()
+        if _matches(_P['post_shares'], css):
+            for post in self._open_posts:
+                if post.shares is None:
+                    post.shares = self._capture()
+
+    def _start_h1(self, attrs):
+        if self._first_h1 is None:
+            self._first_h1 = self._capture()
+        if 'page_name' not in self._fields and _matches(_P['page_name'], attrs.get('class')):
+            self._fields['page_name'] = self._capture()
+
+    def _start_abbr(self, attrs):
+        for post in self._open_posts:
+            if not post.date_seen:
+                post.date_seen = True
+                post.date_title = attrs.get('title')
+
+    def _text(self, field):
+        capture = self._fields.get(field)
+        return capture.text.strip() if capture else None
+
+    def drain(self):
+        """Posts and followers whose elements closed since the last call,
+        as records. Only used with ``keep=False``."""
+        posts = [post.to_record() for post in self._closed_posts]
+        followers = [follower.to_record() for follower in self._closed_followers]
+        self._closed_posts = []
+        self._closed_followers = []
+        return posts, followers
+
+    def result(self):
+        """Close any open elements and build the scrape_page() dict"""
+        return self.record().to_doc()
+
+    def record(self):
+        """Close any open elements and build the Page record"""
+        while len(self._frames) > 1:
+            self.end()
+        fields = self._fields
+
+        name = self._text('page_name')
+        if name is None and self._first_h1 is not None:
+            name = self._first_h1.text.strip()
+        email = fields.get('email')
+        if email is not None:
+            email = email.get('href', '').replace('mailto:', '')
+        website = fields.get('website')
+        creation_date = fields.get('creation_date')
+        profile_pic = fields.get('profile_pic')
+
+        return Page(
+            username=self.username,
+            url=self.url,
+            scraped_at=self.scraped_at,
+            name=name,
+            profile_pic=profile_pic.get('src') if profile_pic else None,
+            email=email,
+            website=website.get('href') if website else None,
+            category=self._text('category'),
+            follower_count=parse_count(fields['follower_count'].text) if 'follower_count' in fields else 0,
+            likes_count=parse_count(fields['likes_count'].text) if 'likes_count' in fields else 0,
+            creation_date=parse_creation_date(creation_date.text) if creation_date else None,
+            about=self._text('about'),
+            posts=[post.to_record() for post in self._posts],
+            followers=[follower.to_record() for follower in self._followers]
+        )
+
+
+def walk_soup(soup, extractor):
+    """Feed a parsed BeautifulSoup tree to an extractor in a single walk"""
+    stack = [soup]
+    for node in soup.descendants:
+        parent = node.parent
+        while stack[-1] is not parent:
+            stack.pop()
+            extractor.end()
+        if isinstance(node, Tag):
+            extractor.start(node.name, node.attrs)
+            stack.append(node)
+        else:
+            extractor.data(node, _STRING_KINDS.get(type(node)))
+    return extractor.result()
+
+
+class StreamingParser(HTMLParser):
+    """SAX-style tokenizer that feeds a PageExtractor without building a DOM.
+
+    Markup can be fed in arbitrary chunks as it is downloaded; only the
+    extractor's own state is kept in memory. Tree construction follows the
+    html.parser tree builder closely (void elements, adjacent text merged
+    into one string, end tags closing back to the matching open element),
+    so results match the tree backends for well-formed pages.
+    """
+
+    def __init__(self, extractor):
+        super().__init__(convert_charrefs=True)
+        self.extractor = extractor
+        self._open = []
+        self._containers = []
+        self._text = []
+
+    def _flush(self):
+        if self._text:
+            text = ''.join(self._text)
+            self._text = []
+            self.extractor.data(text, self._containers[-1] if self._containers else TEXT)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        values = {}
+        for name, value in attrs:
+            if value is None:
+                value = ''
+            if name == 'class':
+                value = value.split()
+            values[name] = value
+        self.extractor.start(tag, values)
+        if tag in HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS:
+            self.extractor.end()
+            return
+        self._open.append(tag)
+        if tag in STRING_CONTAINERS:
+            self._containers.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag not in self._open:
+            return
+        while self._open:
+            name = self._open.pop()
+            if name in STRING_CONTAINERS:
+                self._containers.pop()
+            self.extractor.end()
+            if name == tag:
+                break
+
+    def handle_data(self, data):
+        self._text.append(data)
+
+    def _handle_other(self, data, kind=None):
+        self._flush()
+        self.extractor.data(data, kind)
+
+    def handle_comment(self, data):
+        self._handle_other(data)
+
+    def handle_decl(self, decl):
+        self._handle_other(decl[len('DOCTYPE '):])
+
+    def handle_pi(self, data):
+        self._handle_other(data)
+
+    def unknown_decl(self, data):
+        if data.upper().startswith('CDATA['):
+            self._handle_other(data[len('CDATA['):], TEXT)
+        else:
+            self._handle_other(data)
+
+    def finish(self):
+        """Process any buffered markup without building the result"""
+        super().close()
+        self._flush()
+
+    def close(self):
+        self.finish()
+        return self.extractor.result()
@@ -0,0 +1,112 @@
+from config import Config
+from flask import Response, request
+from utils import json_encoder
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first when the client accepts several with the same quality
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=Config.BROTLI_QUALITY)
+    return gzip.compress(body, Config.GZIP_LEVEL)
+
+def negotiate(available=ENCODINGS):
+    """Best of the ``available`` content codings the client accepts, or None"""
+    accepted = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in available:
+        quality = accepted.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def etag_for(*parts):
+    """Strong ETag value derived from ``parts``, e.g. an id and a modification time"""
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+def _variant(etag, encoding):
+    # A strong ETag names one exact representation, so every coding gets its own
+    return f'{etag}-{encoding}' if encoding else etag
+
+def not_modified(etag):
+    """Whether the request's If-None-Match already names ``etag`` in any coding"""
+    tags = request.if_none_match
+    if not tags:
+        return False
+    return any(tags.contains(_variant(etag, encoding)) for encoding in (None,) + ENCODINGS) or tags.star_tag
+
+def cache_headers(response, max_age, etag=None, last_modified=None, encoding=None):
+    """Set validators and Cache-Control; ``max_age`` None means no-store"""
+    if etag:
+        response.set_etag(_variant(etag, encoding))
+    if last_modified:
+        response.last_modified = last_modified
+    if max_age is None:
+        response.headers['Cache-Control'] = 'no-store'
+    else:
+        response.headers['Cache-Control'] = (
+            f'public, max-age={max_age}, stale-while-revalidate={Config.CACHE_STALE_TIMEOUT}'
+        )
+    response.vary.add('Accept-Encoding')
+    return response
+
+def encode(value):
+    """Serialize ``value`` once into a cacheable response: the JSON body,
+    its compressed variants when it is large enough, and a strong ETag"""
+    body = json_encoder.encode(value).encode('utf-8')
+    entry = {'etag': hashlib.blake2b(body, digest_size=16).hexdigest(), 'body': body}
+    if len(body) >= Config.COMPRESS_MIN_BYTES:
+        for encoding in ENCODINGS:
+            entry[encoding] = compress(body, encoding)
+    return entry
+
+def respond(entry, max_age):
+    """Response for an encode() entry: 304 when the client has it, else the
+    best encoded body the client accepts"""
+    if not_modified(entry['etag']):
+        return cache_headers(Response(status=304), max_age, entry['etag'])
+    encoding = negotiate([encoding for encoding in ENCODINGS if encoding in entry])
+    response = Response(entry[encoding] if encoding else entry['body'], mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return cache_headers(response, max_age, entry['etag'], encoding=encoding)
+
+def conditional(etag, max_age, build, last_modified=None):
+    """304 when the client already has ``etag``, else ``build()`` with cache headers.
+
+    ``build`` is only called, and the body only serialized, when needed.
+    Compression is left to compress_response.
+    """
+    if not_modified(etag):
+        return cache_headers(Response(status=304), max_age, etag, last_modified)
+    return cache_headers(build(), max_age, etag, last_modified)
+
+def compress_response(response):
+    """Compress large uncompressed bodies the client accepts an encoding for"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code == 304
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    body = response.get_data()
+    response.vary.add('Accept-Encoding')
+    if len(body) < Config.COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -0,0 +1,98 @@
+from bulk import BulkStats, count_writes
+from config import Config
+from functools import partial
+from models import ingest
+from parsing import DUMP_SUFFIXES, ParsePool, decode_page, parse_file
+from scraper import resolve_parser
+from utils import setup_logging
+import argparse
+import logging
+import os
+import queue
+import threading
+
+_DONE = object()
+
+
+def find_dumps(directory):
+    """Saved page dumps in ``directory``, one <username>.html per page"""
+    return sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and entry.name.endswith(DUMP_SUFFIXES)
+    )
+
+
+def _writer(batches, stats):
+    while True:
+        batch = batches.get()
+        if batch is _DONE:
+            return
+        try:
+            totals = count_writes(ingest(batch), stats)
+        except Exception as e:
+            # Keep draining, a dead writer would block the parsing loop for good
+            logging.error(f"Failed to write batch of {len(batch)} pages: {e}")
+            stats.incr('failed', len(batch))
+            continue
+        logging.info(f"Wrote batch of {len(batch)} pages: {totals}")
+
+
+def import_dumps(paths, processes=None, batch_size=None, parser=None, base_url=None):
+    """Parse saved page dumps in a ParsePool and store them in batches.
+
+    Files are read and parsed in the worker processes and batches are
+    written from a separate thread, so the calling process only decodes
+    results and throughput grows with the number of processes until the
+    database becomes the limit. Returns a BulkStats.
+    """
+    batch_size = batch_size or Config.BULK_BATCH_SIZE
+    parser = resolve_parser(parser or Config.SCRAPER_PARSER)
+    stats = BulkStats()
+    pool = ParsePool(processes)
+    # Bounded so that parsing pauses instead of piling up unwritten pages
+    batches = queue.Queue(maxsize=2)
+    writer = threading.Thread(target=_writer, args=(batches, stats), daemon=True)
+    writer.start()
+
+    batch = []
+    try:
+        for path, result in pool.imap(partial(parse_file, base_url=base_url, parser=parser), paths):
+            if isinstance(result, Exception):
+                logging.error(f"Failed to parse {path}: {result!r}")
+                stats.incr('failed')
+                continue
+            stats.incr('scraped')
+            batch.append(decode_page(result))
+            if len(batch) >= batch_size:
+                batches.put(batch)
+                batch = []
+        if batch:
+            batches.put(batch)
+    finally:
+        batches.put(_DONE)
+        writer.join()
+        pool.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse and store a directory of saved Facebook pages")
+    parser.add_argument('directory', help="Directory of <username>.html files, optionally gzipped")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help="Parser processes (default: one per core)")
+    parser.add_argument('--batch-size', type=int, default=Config.BULK_BATCH_SIZE)
+    parser.add_argument('--parser', default=Config.SCRAPER_PARSER,
+                        help="html.parser, lxml or stream")
+    parser.add_argument('--base-url', default=Config.SCRAPER_BASE_URL,
+                        help="Base URL the stored page URLs are built from")
+    args = parser.parse_args()
+
+    setup_logging()
+    paths = find_dumps(args.directory)
+    logging.info(f"Importing {len(paths)} pages from {args.directory} with {args.processes} processes")
+    stats = import_dumps(paths, args.processes, args.batch_size, args.parser, args.base_url)
+    logging.info(f"Import finished: {stats.to_dict()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,33 @@
 from flask import Flask, render_template
 from routes import api, init_cache
 from config import Config
-from utils import setup_logging
-from models import Page, Post
+from utils import MongoJSONProvider, setup_logging
+from migrate import migrate_indexes_once, migrate_media_once
+import http_cache
+import metrics
 import logging
+import threading
 from datetime import datetime
 
 def init_db_indexes():
-    """Initialize database indexes with proper error handling"""
-    try:
-        page_indexes = Page.create_indexes()
-        post_indexes = Post.create_indexes()
-        if page_indexes and post_indexes:
-            logging.info("All database indexes created successfully")
-        else:
-            logging.warning("Some database indexes could not be created")
-    except Exception as e:
-        logging.error(f"Failed to create database indexes: {e}")
-        # Don't raise here, allow the application to start even if indexes fail
-        # They can be created later when the database becomes available
+    """Sync database indexes in the background unless another worker
+    already did it for the current index declarations"""
+    if Config.INDEX_MIGRATION == 'off':
+        logging.info("Index migration disabled, run migrate.py to create indexes")
+        return
+
+    def run():
+        try:
+            result = migrate_indexes_once()
+            logging.info(f"Index migration: {result}")
+            # Posts stored under pre-media keys would be duplicated by their next scrape
+            logging.info(f"Media key migration: {migrate_media_once()}")
+        except Exception as e:
+            logging.error(f"Failed to migrate database indexes: {e}")
+            # Don't raise here, allow the application to start even if indexes fail
+            # They can be created later with migrate.py
+
+    threading.Thread(target=run, name='index-migration', daemon=True).start()
 
 def create_app():
     # Setup logging first
@@ -27,8 +36,14 @@ def create_app():
 
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.json = MongoJSONProvider(app)
     logging.info("Loaded configuration")
 
+    # Time requests and serve /metrics
+    metrics.init_app(app)
+    # Compress responses the routes did not serve precompressed
+    http_cache.init_app(app)
+
     # Initialize cache
     cache = init_cache(app)
     if cache:
@@ -0,0 +1,315 @@
+from config import Config
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a cached read to a slow scrape
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format.
+
+    Registering a metric under a name that is already taken replaces it.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logging.error(f"Failed to collect metric {metric.name}: {e}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=(), callback=None, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Optional function returning (labels dict, value) pairs, read on every render
+        self.callback = callback
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def _label_pairs(self, key):
+        return tuple(zip(self.labels, key))
+
+    def samples(self):
+        if self.callback is not None:
+            for labels, value in self.callback():
+                yield self.name, self._label_pairs(self._key(labels)), value
+            return
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, self._label_pairs(key), value
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels, registry=registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts)) for key, counts in self.values.items()]
+        for key, counts in items:
+            pairs = self._label_pairs(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', pairs + (('le', _format_value(float(bound))),), cumulative
+            yield f'{self.name}_sum', pairs, counts[-1]
+            yield f'{self.name}_count', pairs, cumulative
+
+def render():
+    return REGISTRY.render()
+
+# Per-request timing
+
+_local = threading.local()
+
+class Trace:
+    """Time spent in each phase of one request.
+
+    Phases hold self time: a span nested in another is subtracted from its
+    parent, so the phases of a request never add up to more than its
+    duration.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.stack = []
+
+    def add(self, phase, seconds, total=None):
+        """Add ``seconds`` of self time to ``phase`` and charge ``total``
+        (default ``seconds``) to the enclosing span"""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        if self.stack:
+            self.stack[-1][1] += seconds if total is None else total
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+def start_trace():
+    _local.trace = Trace()
+    return _local.trace
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+def end_trace():
+    trace = current_trace()
+    _local.trace = None
+    return trace
+
+@contextmanager
+def span(phase):
+    """Count the enclosed time towards ``phase`` of the current request, if any"""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    frame = [phase, 0.0]
+    trace.stack.append(frame)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        trace.stack.pop()
+        trace.add(phase, max(0.0, elapsed - frame[1]), elapsed)
+
+def record(phase, seconds):
+    """Count time measured elsewhere, e.g. by a MongoDB command listener,
+    towards ``phase`` of the current request"""
+    trace = current_trace()
+    if trace is not None:
+        trace.add(phase, seconds)
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', "Request latency by route",
+    ('method', 'route', 'status')
+)
+REQUEST_PHASE = Histogram(
+    'http_request_phase_seconds', "Time spent per request in cache, db, scrape and app code",
+    ('route', 'phase')
+)
+
+def _profile_response(profiler, sort):
+    from flask import Response
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    try:
+        stats.sort_stats(sort)
+    except KeyError:
+        stats.sort_stats('cumulative')
+    stats.print_stats(Config.PROFILE_LIMIT)
+    return Response(out.getvalue(), mimetype='text/plain')
+
+def _cache_metrics(*names, label=None):
+    from caching import get_cache
+    stats = get_cache().stats()
+    for name in names:
+        yield ({label: name} if label else {}), stats[name]
+
+def _pool_metrics(state):
+    from models import database_stats
+    pool = database_stats().get('pool')
+    if pool is not None:
+        yield {}, pool[state]
+
+def init_app(app):
+    """Time every request and serve /metrics"""
+    from flask import Response, g, request
+
+    Counter('cache_requests_total', "Cache lookups by result", ('result',),
+            callback=lambda: _cache_metrics('l1_hits', 'l2_hits', 'misses', 'stale_hits', label='result'))
+    Gauge('cache_items', "Entries in the in-process cache", callback=lambda: _cache_metrics('l1_items'))
+    Gauge('cache_bytes', "Size of the in-process cache", callback=lambda: _cache_metrics('l1_bytes'))
+    Counter('cache_evictions_total', "Entries evicted from the in-process cache",
+            callback=lambda: _cache_metrics('l1_evictions'))
+    Gauge('mongo_pool_checked_out', "MongoDB connections in use", callback=lambda: _pool_metrics('checked_out'))
+    Gauge('mongo_pool_waiting', "Threads waiting for a MongoDB connection", callback=lambda: _pool_metrics('waiting'))
+    Counter('mongo_pool_checkout_timeouts_total', "MongoDB connection checkouts that timed out",
+            callback=lambda: _pool_metrics('checkout_timeouts'))
+
+    @app.before_request
+    def begin_request():
+        start_trace()
+        if Config.PROFILING == 'on' and request.args.get('profile'):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def end_request(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response = _profile_response(profiler, request.args.get('profile_sort', 'cumulative'))
+        trace = end_trace()
+        if trace is None:
+            return response
+
+        # Streamed bodies are sent after this, so only their first chunk is timed
+        elapsed = trace.elapsed()
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_DURATION.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        phases = dict(trace.phases)
+        phases['app'] = max(0.0, elapsed - sum(phases.values()))
+        for phase, seconds in phases.items():
+            REQUEST_PHASE.observe(seconds, route=route, phase=phase)
+        response.headers['Server-Timing'] = ', '.join(
+            f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items()
+        )
+        if elapsed >= Config.SLOW_REQUEST_SECONDS:
+            breakdown = ', '.join(f'{phase} {seconds * 1000:.0f}ms' for phase, seconds in phases.items())
+            logging.warning(f"Slow request {request.method} {request.full_path}: {elapsed * 1000:.0f}ms ({breakdown})")
+        return response
+
+    @app.teardown_request
+    def discard_trace(error=None):
+        # after_request is skipped when a view raises
+        end_trace()
+
+    app.add_url_rule('/metrics', 'metrics', lambda: Response(render(), content_type=CONTENT_TYPE))
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port, host='0.0.0.0'):
+    """Serve /metrics from a background thread, for processes without the Flask app"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Serving metrics on {host}:{port}")
+    return server
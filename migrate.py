@@ -0,0 +1,88 @@
+from config import Config
+from models import MODELS, Lock, Media, Migration, index_version, sync_indexes
+from utils import setup_logging
+import argparse
+import json
+import logging
+
+INDEX_MIGRATION = 'indexes'
+INDEX_MIGRATION_LOCK = 'migrate:indexes'
+# Posts and followers keyed on normalized media URLs, see Media.backfill
+MEDIA_MIGRATION = 'media_keys'
+MEDIA_MIGRATION_VERSION = 1
+MEDIA_MIGRATION_LOCK = 'migrate:media_keys'
+
+def migrate_indexes(drop_extra=False, dry_run=False):
+    """Sync the indexes of every model and record the applied index version.
+
+    Returns {collection: report}; the version is only recorded when every
+    collection succeeded.
+    """
+    reports = {vars(model)['collection'].name: sync_indexes(model, drop_extra, dry_run) for model in MODELS}
+    if not dry_run and all(report is not None for report in reports.values()):
+        Migration.set_version(INDEX_MIGRATION, index_version())
+    return reports
+
+def migrate_indexes_once():
+    """Run the index migration unless it already ran for the declared
+    indexes, letting only one process at a time do it.
+
+    Returns 'current', 'busy' or 'migrated'.
+    """
+    version = index_version()
+    if Migration.get_version(INDEX_MIGRATION) == version:
+        return 'current'
+    token = Lock.acquire(INDEX_MIGRATION_LOCK, Config.INDEX_MIGRATION_LOCK_TTL)
+    if token is None:
+        return 'busy'
+    try:
+        # Another process may have finished just before we took the lease
+        if Migration.get_version(INDEX_MIGRATION) == version:
+            return 'current'
+        migrate_indexes()
+        return 'migrated'
+    finally:
+        Lock.release(INDEX_MIGRATION_LOCK, token)
+
+def migrate_media(dry_run=False):
+    """Convert posts and followers stored before media keys and record the
+    migration; returns Media.backfill's counts"""
+    counts = Media.backfill(dry_run=dry_run)
+    if not dry_run:
+        Migration.set_version(MEDIA_MIGRATION, MEDIA_MIGRATION_VERSION)
+    return counts
+
+def migrate_media_once():
+    """Run the media key migration unless it already ran, letting only one
+    process at a time do it. Returns 'current', 'busy' or 'migrated'."""
+    if Migration.get_version(MEDIA_MIGRATION) == MEDIA_MIGRATION_VERSION:
+        return 'current'
+    token = Lock.acquire(MEDIA_MIGRATION_LOCK, Config.INDEX_MIGRATION_LOCK_TTL)
+    if token is None:
+        return 'busy'
+    try:
+        if Migration.get_version(MEDIA_MIGRATION) == MEDIA_MIGRATION_VERSION:
+            return 'current'
+        counts = migrate_media()
+        logging.info(f"Media key migration: {counts}")
+        return 'migrated'
+    finally:
+        Lock.release(MEDIA_MIGRATION_LOCK, token)
+
+def main():
+    parser = argparse.ArgumentParser(description="Create, rebuild or drop indexes to match the models "
+                                                 "and convert documents stored in older formats")
+    parser.add_argument('--dry-run', action='store_true', help="Only report the differences")
+    parser.add_argument('--drop-extra', action='store_true', help="Drop indexes that are not declared")
+    args = parser.parse_args()
+
+    setup_logging()
+    reports = migrate_indexes(drop_extra=args.drop_extra, dry_run=args.dry_run)
+    if any(report is None for report in reports.values()):
+        print(json.dumps(reports, indent=2))
+        raise SystemExit(1)
+    reports[MEDIA_MIGRATION] = migrate_media(dry_run=args.dry_run)
+    print(json.dumps(reports, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,94 +1,353 @@
-from datetime import datetime
-from pymongo import MongoClient, errors
-from mongomock import MongoClient as MockMongoClient
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, MongoClient, ReturnDocument, UpdateOne, errors
+from bson import ObjectId
+from caching import LEADERBOARD_TAG, PAGES_TAG, invalidate, page_tag
 from config import Config
+from db_monitoring import CommandStats, PoolStats
+import metrics
+from ranking import TopN, rank_key
+from records import as_doc
+from search import InvertedIndex, parse_query, search_terms
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import atexit
+import base64
+import collections
+import fnmatch
+import hashlib
+import json
 import time
 import logging
+import os
 import re
+import threading
+import uuid
+
+# One client per process, created on first use. A client inherited across
+# fork() is unsafe to use, so a child process connects again.
+_client = None
+_client_pid = None
+_db = None
+_db_generation = 0
+_pool_stats = None
+_command_stats = CommandStats()
+_client_lock = threading.Lock()
 
 def get_database():
-    """Initialize MongoDB connection with retries"""
-    last_error = None
+    """Database of this process's MongoDB client, connecting on first use.
 
-    for attempt in range(Config.MONGODB_MAX_RETRIES):
+    The client connects in the background, so this never blocks on an
+    unreachable server; operations wait up to the server selection timeout.
+    """
+    global _client, _client_pid, _db, _db_generation, _pool_stats
+    pid = os.getpid()
+    if _db is not None and _client_pid == pid:
+        return _db
+    with _client_lock:
+        if _db is not None and _client_pid == pid:
+            return _db
         try:
             if Config.MONGODB_URI.startswith('mongomock://'):
-                client = MockMongoClient()
-                db = client.get_database('facebook_insights')
+                # In-memory data must survive a fork, so the mock client is kept
+                if _client is None:
+                    # Imported here so that real deployments never load mongomock
+                    from mongomock import MongoClient as MockMongoClient
+                    _client = MockMongoClient()
+                    _pool_stats = None
+                db = _client.get_database('facebook_insights')
             else:
-                client = MongoClient(
+                _pool_stats = PoolStats()
+                _client = MongoClient(
                     Config.MONGODB_URI,
+                    event_listeners=[_pool_stats, _command_stats],
                     **Config.MONGODB_CONNECT_OPTIONS
                 )
-                db = client.get_default_database()
-                db.command('ping')
-            logging.info("Successfully connected to MongoDB")
-            return db
+                _command_stats.attach(_client)
+                db = _client.get_default_database()
         except Exception as e:
-            last_error = str(e)
-            logging.warning(f"MongoDB connection attempt {attempt + 1} failed: {last_error}")
-            if attempt < Config.MONGODB_MAX_RETRIES - 1:
-                time.sleep(Config.MONGODB_RETRY_DELAY)
-                continue
-
-    logging.error(f"Failed to connect to MongoDB after {Config.MONGODB_MAX_RETRIES} attempts")
-    return None
+            logging.error(f"Failed to initialize MongoDB client: {e}")
+            return None
+        _db, _client_pid = db, pid
+        _db_generation += 1
+        logging.info(f"Initialized MongoDB client for process {pid}")
+        return _db
 
-# Initialize database connection
-db = None
-try:
+def database_stats():
+    """Client and connection pool state of this process"""
     db = get_database()
-except Exception as e:
-    logging.error(f"Failed to initialize database: {e}")
+    stats = {
+        'pid': os.getpid(),
+        'initialized': db is not None,
+        'backend': 'mongomock' if _is_mock(_client) else 'mongodb'
+    }
+    if _pool_stats is not None:
+        stats['pool'] = _pool_stats.to_dict()
+    if _write_buffer is not None:
+        stats['write_buffer'] = _write_buffer.stats()
+    return stats
+
+def _is_mock(obj):
+    """Whether a client or collection comes from mongomock"""
+    return type(obj).__module__.startswith('mongomock')
+
+class _LazyCollection:
+    """Class attribute resolving to a collection of this process's database,
+    or None when the database is unavailable"""
+
+    def __init__(self, name):
+        self.name = name
+        self.generation = None
+        self.collection = None
+
+    def __get__(self, instance, owner):
+        db = get_database()
+        if db is None:
+            return None
+        if self.generation != _db_generation:
+            self.collection, self.generation = db[self.name], _db_generation
+        return self.collection
+
+def _comparable(value):
+    """Normalize a value for comparison with its stored copy (Mongo keeps
+    datetimes at millisecond precision)"""
+    if isinstance(value, datetime):
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, list):
+        return [_comparable(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _comparable(item) for key, item in value.items()}
+    return value
+
+def encode_cursor(sort, doc):
+    """Opaque keyset pagination token for the position after ``doc``"""
+    value = doc.get(sort)
+    if isinstance(value, datetime):
+        value = {'$date': value.isoformat()}
+    payload = json.dumps([sort, value, str(doc['_id'])], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """Decode a token from encode_cursor into (sort, value, _id)"""
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        sort, value, _id = json.loads(payload)
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value['$date'])
+        return sort, value, ObjectId(_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+_FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+# Stored fields that are only there for querying and never returned
+HIDDEN_FIELDS = {'search_terms': 0}
+
+def projection(fields, *required):
+    """Mongo projection including only ``fields`` plus the ``required`` keys
+    (e.g. the pagination sort key); None returns whole documents"""
+    if not fields:
+        return dict(HIDDEN_FIELDS)
+    invalid = [field for field in fields if not _FIELD_NAME.match(field)]
+    if invalid:
+        raise ValueError(f"Invalid field names: {', '.join(invalid)}")
+    return dict.fromkeys(list(fields) + list(required), 1)
+
+def percentile(values, q):
+    """``q``-th percentile of sorted ``values`` with linear interpolation"""
+    if not values:
+        return 0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def _after_cursor(query, sort, cursor):
+    """Restrict ``query`` to documents after ``cursor`` in (sort desc, _id desc) order"""
+    if not cursor:
+        return query
+    cursor_sort, value, _id = decode_cursor(cursor)
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match the requested sort order")
+    after = {'$or': [{sort: {'$lt': value}}, {sort: value, '_id': {'$lt': _id}}]}
+    return {'$and': [query, after]} if query else after
 
 class Page:
-    collection = db.pages if db else None
+    collection = _LazyCollection('pages')
+
+    # Page fields filled in by FacebookScraper.scrape_page
+    SCRAPED_FIELDS = ('name', 'profile_pic', 'email', 'website', 'category', 'follower_count',
+                      'likes_count', 'creation_date', 'about')
+    # HTTP validators and body hash used for conditional refreshes
+    VALIDATOR_FIELDS = ('etag', 'last_modified', 'content_hash')
+
+    INDEXES = [
+        IndexModel("username", unique=True),
+        # Keyset pagination sorts on (key desc, _id desc)
+        IndexModel([("follower_count", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+        # Category listings: equality on category, then the sort key, which
+        # also bounds follower ranges (these replace the category index)
+        IndexModel([("category", ASCENDING), ("follower_count", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("category", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel("name"),
+        # Ranked search; search_terms serves prefix matches on the last word
+        IndexModel([("name", TEXT), ("about", TEXT)], weights={'name': 10, 'about': 2}, name='search_text'),
+        IndexModel("search_terms")
+    ]
 
     @staticmethod
     def create_indexes():
         """Create indexes for the Page collection"""
-        if not Page.collection:
-            logging.error("Database not initialized, cannot create indexes")
-            return False
-        try:
-            Page.collection.create_index("username", unique=True)
-            Page.collection.create_index("follower_count")
-            Page.collection.create_index("category")
-            Page.collection.create_index("name")
-            Page.collection.create_index([("name", "text")])  # Text index for search
-            logging.info("Successfully created indexes for Page collection")
-            return True
-        except Exception as e:
-            logging.error(f"Error creating indexes for Page collection: {e}")
-            return False
+        return sync_indexes(Page) is not None
 
     @staticmethod
     def create(data):
         """Create a new page"""
-        if not Page.collection:
+        if Page.collection is None:
             raise Exception("Database not initialized")
         data.update({
             'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
+            'updated_at': datetime.utcnow(),
+            'search_terms': search_terms(data.get('name'), data.get('about'))
         })
-        return Page.collection.insert_one(data).inserted_id
+        page_id = Page.collection.insert_one(data).inserted_id
+        Search.index_pages([data])
+        TopPages.update([data])
+        invalidate(PAGES_TAG)
+        return page_id
+
+    @staticmethod
+    def create_many(pages):
+        """Create multiple pages, skipping usernames that already exist.
+
+        Returns a list aligned with ``pages`` holding the new ``_id`` or
+        None for pages that were rejected as duplicates.
+        """
+        if Page.collection is None:
+            raise Exception("Database not initialized")
+        if not pages:
+            return []
+        now = datetime.utcnow()
+        for page in pages:
+            page.update({
+                'created_at': now,
+                'updated_at': now,
+                'search_terms': search_terms(page.get('name'), page.get('about'))
+            })
+        try:
+            Page.collection.insert_many(pages, ordered=False)
+            failed = set()
+        except errors.BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in write_errors):
+                raise
+            failed = {error['index'] for error in write_errors}
+            logging.warning(f"Skipped {len(failed)} pages that already exist")
+        Search.index_pages([page for i, page in enumerate(pages) if i not in failed])
+        TopPages.update([page for i, page in enumerate(pages) if i not in failed])
+        invalidate(PAGES_TAG)
+        return [None if i in failed else page['_id'] for i, page in enumerate(pages)]
+
+    @staticmethod
+    def upsert_op(page_data):
+        """(filter, update) pair storing a scrape result's page fields"""
+        now = datetime.utcnow()
+        fields = {
+            key: value for key, value in page_data.items()
+            if key not in ('_id', 'posts', 'followers', 'created_at')
+        }
+        fields['updated_at'] = now
+        fields['search_terms'] = search_terms(page_data.get('name'), page_data.get('about'))
+        return (
+            {'username': page_data['username']},
+            # Posts and followers live in their own collections; storing the
+            # page fields completes a page staged by ingest_scrape
+            {'$set': fields, '$setOnInsert': {'created_at': now},
+             '$unset': {'posts': '', 'followers': '', 'partial': ''}}
+        )
+
+    @staticmethod
+    def find_by_username(username, projection=None):
+        """Find a page by username, ignoring one still staged by ingest_scrape"""
+        if Page.collection is None:
+            raise Exception("Database not initialized")
+        return Page.collection.find_one(
+            {"username": username, 'partial': {'$ne': True}}, projection or HIDDEN_FIELDS
+        )
 
     @staticmethod
-    def find_by_username(username):
-        """Find a page by username"""
-        if not Page.collection:
+    def find_by_usernames(usernames, projection=None):
+        """Map of username to page for the stored ones, in one query"""
+        if Page.collection is None:
             raise Exception("Database not initialized")
-        return Page.collection.find_one({"username": username})
+        usernames = list(dict.fromkeys(usernames))
+        if not usernames:
+            return {}
+        cursor = Page.collection.find(
+            {'username': {'$in': usernames}, 'partial': {'$ne': True}}, projection or HIDDEN_FIELDS
+        )
+        return {page['username']: page for page in cursor}
 
     @staticmethod
-    def find_by_filters(name=None, category=None, min_followers=None, max_followers=None, page=1, per_page=10):
-        """Find pages using various filters"""
-        if not Page.collection:
+    def changed_fields(page, page_data):
+        """Scraped fields whose value differs from the stored page"""
+        if '_id' in page:
+            page = dict(page, **_pending_fields(Page.collection, {'_id': page['_id']}))
+        return {
+            field: page_data.get(field) for field in Page.SCRAPED_FIELDS
+            if _comparable(page.get(field)) != _comparable(page_data.get(field))
+        }
+
+    @staticmethod
+    def update_fields(page_id, fields):
+        """Set the given fields on a page.
+
+        Returns the number of modified pages, or None when the update went
+        to the write-behind buffer. Name and about changes are always
+        written at once, as their search terms depend on the stored page.
+        """
+        if Page.collection is None:
             raise Exception("Database not initialized")
+        fields = dict(fields, updated_at=datetime.utcnow())
+        TopPages.update([dict(fields, _id=page_id)])
+        if 'name' not in fields and 'about' not in fields and _write_behind(
+                Page.collection, [({'_id': page_id}, {'$set': fields})], (PAGES_TAG, page_tag(page_id)),
+                [page_id] if 'follower_count' in fields else (), upsert=False):
+            return None
+        searchable = None
+        if 'name' in fields or 'about' in fields:
+            searchable = Page.collection.find_one({'_id': page_id}, {'name': 1, 'about': 1}) or {'_id': page_id}
+            searchable.update({key: fields[key] for key in ('name', 'about') if key in fields})
+            fields['search_terms'] = search_terms(searchable.get('name'), searchable.get('about'))
+        modified = Page.collection.update_one({'_id': page_id}, {'$set': fields}).modified_count
+        if searchable is not None:
+            Search.index_pages([searchable])
+        if 'follower_count' in fields:
+            PageStats.refresh([page_id])
+        invalidate(PAGES_TAG, page_tag(page_id))
+        return modified
+
+    # Keys /api/pages can be ordered by, always descending with _id as tiebreaker
+    SORT_KEYS = ('follower_count', 'created_at')
+
+    @staticmethod
+    def find_by_filters(name=None, category=None, min_followers=None, max_followers=None, page=1, per_page=10,
+                        cursor=None, sort='follower_count', fields=None):
+        """Find pages using various filters.
+
+        Results are ordered by ``sort`` descending. Pass the ``cursor`` from
+        Page.next_cursor to continue after the previous page; ``page`` is
+        only used as an offset when no cursor is given. ``fields`` limits
+        the returned fields.
+        """
+        if Page.collection is None:
+            raise Exception("Database not initialized")
+        if sort not in Page.SORT_KEYS:
+            raise ValueError(f"Unsupported sort key {sort!r}")
+        per_page = max(1, min(per_page, Config.MAX_PAGE_SIZE))
 
         query = {}
         if name:
-            if isinstance(Page.collection, MockMongoClient):
+            if _is_mock(Page.collection):
                 # Mongomock doesn't support text search, fallback to regex
                 query['name'] = {'$regex': name, '$options': 'i'}
             else:
@@ -101,67 +360,322 @@ class Page:
                 query['follower_count']['$gte'] = min_followers
             if max_followers is not None:
                 query['follower_count']['$lte'] = max_followers
+        if not category and 'follower_count' not in query:
+            # Staged pages have neither, so only unfiltered listings can meet them
+            query['partial'] = {'$ne': True}
+
+        offset = (page - 1) * per_page if cursor is None and page > 1 else 0
+        if not name and sort == 'follower_count':
+            docs = Page._find_ranked(category, min_followers, max_followers, cursor, offset, per_page, fields)
+            if docs is not None:
+                return docs
+
+        results = Page.collection.find(
+            _after_cursor(query, sort, cursor), projection(fields, sort)
+        ).sort([(sort, -1), ('_id', -1)])
+        if not name and (sort == 'follower_count' or 'follower_count' not in query):
+            # The index answers the filter and the order on its own, so
+            # the planner is not left to pick a single-field index and sort
+            results = results.hint(Page.index_for(category, sort))
+        if offset:
+            results = results.skip(offset)
+        return results.limit(per_page)
+
+    @staticmethod
+    def index_for(category, sort):
+        """Key pattern of the index serving a listing in (``sort`` desc,
+        _id desc) order, with or without a category filter"""
+        keys = [(sort, DESCENDING), ("_id", DESCENDING)]
+        return [("category", ASCENDING)] + keys if category else keys
+
+    @staticmethod
+    def _find_ranked(category, min_followers, max_followers, cursor, offset, limit, fields):
+        """A follower count listing answered from TopPages, or None when
+        it reaches past the pages ranked in memory"""
+        after = None
+        if cursor:
+            cursor_sort, value, _id = decode_cursor(cursor)
+            if cursor_sort != 'follower_count':
+                raise ValueError("Cursor does not match the requested sort order")
+            after = rank_key(value, _id)
+        ids = TopPages.window(category, min_followers, max_followers, after, offset, limit)
+        if ids is None:
+            return None
+        if not ids:
+            return []
+        order = {page_id: i for i, page_id in enumerate(ids)}
+        docs = Page.collection.find({'_id': {'$in': ids}}, projection(fields, 'follower_count'))
+        return sorted(docs, key=lambda doc: order[doc['_id']])
+
+    @staticmethod
+    def next_cursor(last, count, per_page=10, sort='follower_count'):
+        """Cursor continuing after ``last``, the final of ``count`` returned
+        pages, or None when that was the last page"""
+        per_page = max(1, min(per_page, Config.MAX_PAGE_SIZE))
+        if count < per_page:
+            return None
+        return encode_cursor(sort, last)
+
+class TopPages:
+    """Pages ranked by follower count, overall and per category, so that
+    the first pages of /api/pages follower listings are answered without
+    a range scan.
 
-        skip = (page - 1) * per_page
-        return Page.collection.find(query).skip(skip).limit(per_page)
+    Each ranking is a TopN of TOP_PAGES_SIZE pages, loaded from the
+    (category, follower_count, _id) index on first use and kept current
+    by the page write paths of this process. Writes made by other
+    processes show once a ranking is reloaded after TOP_PAGES_TTL seconds.
+    """
+    # category, or None for all pages -> (TopN, loaded at)
+    _rankings = collections.OrderedDict()
+    # page _id -> category, for the pages in a category ranking
+    _members = {}
+    _generation = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _load(category):
+        size = Config.TOP_PAGES_SIZE
+        query = {'category': category} if category else {'partial': {'$ne': True}}
+        cursor = Page.collection.find(query, {'follower_count': 1}).sort(
+            [('follower_count', DESCENDING), ('_id', DESCENDING)]
+        ).hint(Page.index_for(category, 'follower_count')).limit(size)
+        entries = [rank_key(doc.get('follower_count'), doc['_id']) for doc in cursor]
+        return TopN(size, entries, complete=len(entries) < size)
+
+    @staticmethod
+    def _drop(category):
+        ranking, _ = TopPages._rankings.pop(category)
+        if category:
+            for page_id in ranking.keys:
+                if TopPages._members.get(page_id) == category:
+                    del TopPages._members[page_id]
+
+    @staticmethod
+    def _ranking(category):
+        # Called with the lock held
+        if TopPages._generation != _db_generation:
+            TopPages._rankings.clear()
+            TopPages._members.clear()
+            TopPages._generation = _db_generation
+        now = time.monotonic()
+        cached = TopPages._rankings.get(category)
+        if cached is not None:
+            ranking, loaded_at = cached
+            # Pages that dropped out leave a shorter prefix, reload before it runs out
+            if now - loaded_at < Config.TOP_PAGES_TTL and (ranking.complete or len(ranking) * 2 >= ranking.size):
+                TopPages._rankings.move_to_end(category)
+                return ranking
+            TopPages._drop(category)
+        ranking = TopPages._load(category)
+        TopPages._rankings[category] = (ranking, now)
+        if category:
+            TopPages._members.update(dict.fromkeys(ranking.keys, category))
+        while len(TopPages._rankings) > Config.TOP_PAGES_CATEGORIES + 1:
+            TopPages._drop(next(iter(TopPages._rankings)))
+        return ranking
+
+    @staticmethod
+    def window(category, min_followers=None, max_followers=None, after=None, offset=0, limit=10):
+        """Ids of a follower count listing as TopN.window returns them,
+        or None when it is not answered from memory"""
+        if Page.collection is None:
+            raise Exception("Database not initialized")
+        if offset + limit > Config.TOP_PAGES_SIZE:
+            return None
+        with TopPages._lock:
+            return TopPages._ranking(category or None).window(min_followers, max_followers, after, offset, limit)
+
+    @staticmethod
+    def update(pages):
+        """Re-rank pages after a write; ``pages`` are dicts with the _id
+        and the written fields"""
+        if not TopPages._rankings:
+            return
+        pages = [page for page in pages if '_id' in page and ('follower_count' in page or 'category' in page)]
+        # Partial writes are completed with the stored fields they leave alone
+        partial = [page['_id'] for page in pages if 'follower_count' not in page or 'category' not in page]
+        stored = {}
+        if partial:
+            for doc in Page.collection.find({'_id': {'$in': partial}}, {'follower_count': 1, 'category': 1}):
+                stored[doc['_id']] = doc
+        with TopPages._lock:
+            if TopPages._generation != _db_generation:
+                return
+            for page in pages:
+                page = dict(stored.get(page['_id'], {}), **page)
+                page_id, category, count = page['_id'], page.get('category') or None, page.get('follower_count')
+                if None in TopPages._rankings:
+                    TopPages._rankings[None][0].update(page_id, count)
+                previous = TopPages._members.pop(page_id, None)
+                if previous is not None and previous != category and previous in TopPages._rankings:
+                    TopPages._rankings[previous][0].remove(page_id)
+                if category is None or category not in TopPages._rankings:
+                    continue
+                ranking = TopPages._rankings[category][0]
+                dropped = ranking.update(page_id, count)
+                if page_id in ranking:
+                    TopPages._members[page_id] = category
+                if dropped is not None and TopPages._members.get(dropped) == category:
+                    del TopPages._members[dropped]
+
+    @staticmethod
+    def clear():
+        """Forget every ranking, e.g. after pages were removed in bulk"""
+        with TopPages._lock:
+            TopPages._rankings.clear()
+            TopPages._members.clear()
 
 class Post:
-    collection = db.posts if db else None
+    collection = _LazyCollection('posts')
+
+    INDEXES = [
+        IndexModel([("page_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("page_id", ASCENDING), ("post_key", ASCENDING)]),
+        IndexModel("created_at"),
+        IndexModel([("content", TEXT)], name='search_text'),
+        IndexModel("search_terms")
+    ]
 
     @staticmethod
     def create_indexes():
         """Create indexes for the Post collection"""
-        if not Post.collection:
-            logging.error("Database not initialized, cannot create indexes")
-            return False
-        try:
-            Post.collection.create_index([("page_id", 1), ("created_at", -1)])
-            Post.collection.create_index("created_at")
-            logging.info("Successfully created indexes for Post collection")
-            return True
-        except Exception as e:
-            logging.error(f"Error creating indexes for Post collection: {e}")
-            return False
+        return sync_indexes(Post) is not None
+
+    # Fields of a stored post that change over its lifetime
+    METRIC_FIELDS = ('likes_count', 'shares_count', 'comments_count')
+
+    @staticmethod
+    def fingerprint(post):
+        """Stable key identifying a scraped post across refreshes"""
+        digest = hashlib.blake2b(digest_size=12)
+        digest.update((post.get('content') or '').encode('utf-8'))
+        # Normalized, so that a new CDN signature does not make a new post
+        for url in post.get('media_urls') or []:
+            digest.update(b'\0' + Media.normalize_url(url).encode('utf-8'))
+        return digest.hexdigest()
 
     @staticmethod
     def create_many(posts):
         """Create multiple posts"""
-        if not Post.collection:
+        if Post.collection is None:
             raise Exception("Database not initialized")
         if posts:
             for post in posts:
                 post['created_at'] = post.get('created_at', datetime.utcnow())
-            return Post.collection.insert_many(posts).inserted_ids
+                post.setdefault('post_key', Post.fingerprint(post))
+                post['search_terms'] = search_terms(post.get('content'))
+            post_ids = Post.collection.insert_many(posts).inserted_ids
+            Search.index_posts(posts)
+            page_ids = {post['page_id'] for post in posts if post.get('page_id')}
+            PageStats.refresh(page_ids)
+            invalidate(*(page_tag(page_id) for page_id in page_ids))
+            return post_ids
         return None
 
     @staticmethod
-    def find_by_page(page_id, limit=15):
-        """Find posts by page ID"""
-        if not Post.collection:
+    def upsert_op(page_id, post):
+        """(filter, update) pair storing a scraped post without its comments"""
+        key = post.get('post_key') or Post.fingerprint(post)
+        fields = {
+            'page_id': page_id,
+            'post_key': key,
+            'content': post.get('content'),
+            'likes_count': post.get('likes_count', 0),
+            'shares_count': post.get('shares_count', 0),
+            'comments_count': len(post.get('comments') or []),
+            'media_ids': [Media.key(url) for url in post.get('media_urls') or []],
+            'search_terms': search_terms(post.get('content'))
+        }
+        return (
+            {'page_id': page_id, 'post_key': key},
+            {'$set': fields, '$setOnInsert': {'created_at': post.get('created_at') or datetime.utcnow()},
+             '$unset': {'comments': '', 'media_urls': ''}}
+        )
+
+    @staticmethod
+    def sync_page_posts(page_id, posts, stats=None):
+        """Write only the posts of a page that are new or whose metrics
+        changed, with their comments. Returns (inserted, updated) counts.
+
+        With write-behind on, posts that only gained likes or shares are
+        updated through the write buffer.
+        """
+        if Post.collection is None:
             raise Exception("Database not initialized")
-        return Post.collection.find({"page_id": page_id}).sort("created_at", -1).limit(limit)
+        buffer = get_write_buffer()
+        projection = dict.fromkeys(Post.METRIC_FIELDS + ('post_key',), 1)
+        existing = {}
+        for doc in Post.collection.find({'page_id': page_id}, projection):
+            query = {'page_id': page_id, 'post_key': doc.get('post_key')}
+            existing[doc.get('post_key')] = dict(doc, **_pending_fields(Post.collection, query))
+
+        inserted, updated, changed, metric_ops, seen_media = 0, 0, [], [], []
+        for post in posts:
+            key = post.setdefault('post_key', Post.fingerprint(post))
+            fields = Post.upsert_op(page_id, post)[1]['$set']
+            stored = existing.get(key)
+            if stored is None:
+                inserted += 1
+            elif any(stored.get(field) != fields[field] for field in Post.METRIC_FIELDS):
+                updated += 1
+                if buffer is not None and stored.get('comments_count') == fields['comments_count']:
+                    metric_ops.append((
+                        {'page_id': page_id, 'post_key': key},
+                        {'$set': {'likes_count': fields['likes_count'], 'shares_count': fields['shares_count']}}
+                    ))
+                    existing[key] = fields
+                    seen_media.extend(post.get('media_urls') or [])
+                    continue
+            else:
+                seen_media.extend(post.get('media_urls') or [])
+                continue
+            existing[key] = fields
+            changed.append((page_id, post))
+
+        if changed:
+            ingest_posts(changed, stats)
+        if metric_ops:
+            buffer.add(Post.collection, metric_ops, [page_tag(page_id)], [page_id], upsert=False)
+        # Keep the latest, unexpired URL of media on posts that were not rewritten
+        Media.intern([(url, 0) for url in seen_media], stats)
+        return inserted, updated
+
+    @staticmethod
+    def find_by_page(page_id, limit=15, cursor=None, fields=None):
+        """Find posts by page ID, newest first, continuing after ``cursor``"""
+        if Post.collection is None:
+            raise Exception("Database not initialized")
+        query = _after_cursor({"page_id": page_id}, 'created_at', cursor)
+        return Post.collection.find(query, projection(fields, 'created_at')).sort(
+            [("created_at", -1), ("_id", -1)]
+        ).limit(limit)
+
+    @staticmethod
+    def next_cursor(last, count, limit=15):
+        """Cursor continuing after ``last``, the final of ``count`` returned
+        posts, or None when that was the last page"""
+        if count < limit:
+            return None
+        return encode_cursor('created_at', last)
 
 class Comment:
-    collection = db.comments if db else None
+    collection = _LazyCollection('comments')
+
+    INDEXES = [
+        IndexModel([("post_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("post_id", ASCENDING), ("comment_key", ASCENDING)])
+    ]
 
     @staticmethod
     def create_indexes():
         """Create indexes for the Comment collection"""
-        if not Comment.collection:
-            logging.error("Database not initialized, cannot create indexes")
-            return False
-        try:
-            Comment.collection.create_index([("post_id", 1), ("created_at", -1)])
-            logging.info("Successfully created indexes for Comment collection")
-            return True
-        except Exception as e:
-            logging.error(f"Error creating indexes for Comment collection: {e}")
-            return False
+        return sync_indexes(Comment) is not None
 
     @staticmethod
     def create_many(comments):
         """Create multiple comments"""
-        if not Comment.collection:
+        if Comment.collection is None:
             raise Exception("Database not initialized")
         if comments:
             for comment in comments:
@@ -169,34 +683,54 @@ class Comment:
             return Comment.collection.insert_many(comments).inserted_ids
         return None
 
+    @staticmethod
+    def fingerprint(comment):
+        """Stable key identifying a scraped comment within its post"""
+        author = comment.get('author') or {}
+        digest = hashlib.blake2b(digest_size=12)
+        for part in (comment.get('content'), author.get('name'), author.get('profile_url')):
+            digest.update((part or '').encode('utf-8') + b'\0')
+        return digest.hexdigest()
+
+    @staticmethod
+    def upsert_op(page_id, post_id, comment):
+        """(filter, update) pair storing a scraped comment"""
+        key = Comment.fingerprint(comment)
+        fields = {
+            'page_id': page_id,
+            'post_id': post_id,
+            'comment_key': key,
+            'content': comment.get('content'),
+            'author': comment.get('author')
+        }
+        return (
+            {'post_id': post_id, 'comment_key': key},
+            {'$set': fields, '$setOnInsert': {'created_at': comment.get('created_at') or datetime.utcnow()}}
+        )
+
     @staticmethod
     def find_by_post(post_id, limit=50):
         """Find comments by post ID"""
-        if not Comment.collection:
+        if Comment.collection is None:
             raise Exception("Database not initialized")
         return Comment.collection.find({"post_id": post_id}).sort("created_at", -1).limit(limit)
 
 class Follower:
-    collection = db.followers if db else None
+    collection = _LazyCollection('followers')
+
+    INDEXES = [
+        IndexModel([("page_id", ASCENDING), ("follower_id", ASCENDING)], unique=True)
+    ]
 
     @staticmethod
     def create_indexes():
         """Create indexes for the Follower collection"""
-        if not Follower.collection:
-            logging.error("Database not initialized, cannot create indexes")
-            return False
-        try:
-            Follower.collection.create_index([("page_id", 1), ("follower_id", 1)], unique=True)
-            logging.info("Successfully created indexes for Follower collection")
-            return True
-        except Exception as e:
-            logging.error(f"Error creating indexes for Follower collection: {e}")
-            return False
+        return sync_indexes(Follower) is not None
 
     @staticmethod
     def create_many(followers):
         """Create multiple followers"""
-        if not Follower.collection:
+        if Follower.collection is None:
             raise Exception("Database not initialized")
         if followers:
             for follower in followers:
@@ -204,9 +738,1629 @@ class Follower:
             return Follower.collection.insert_many(followers).inserted_ids
         return None
 
+    @staticmethod
+    def identity(follower):
+        """Key identifying a follower within a page"""
+        if follower.get('profile_url'):
+            return follower['profile_url']
+        digest = hashlib.blake2b(digest_size=12)
+        picture = follower.get('profile_pic')
+        for part in (follower.get('name'), Media.normalize_url(picture) if picture else None):
+            digest.update((part or '').encode('utf-8') + b'\0')
+        return digest.hexdigest()
+
+    @staticmethod
+    def upsert_op(page_id, follower):
+        """(filter, update) pair storing a scraped follower"""
+        follower_id = Follower.identity(follower)
+        fields = {
+            'page_id': page_id,
+            'follower_id': follower_id,
+            'name': follower.get('name'),
+            'profile_pic_id': Media.key(follower.get('profile_pic')),
+            'profile_url': follower.get('profile_url')
+        }
+        return (
+            {'page_id': page_id, 'follower_id': follower_id},
+            {'$set': fields, '$setOnInsert': {'created_at': follower.get('created_at') or datetime.utcnow()},
+             '$unset': {'profile_pic': ''}}
+        )
+
+    @staticmethod
+    def picture_refs(ops, urls):
+        """Media references for follower upserts, as (url, count) pairs
+        for Media.intern and the keys of replaced pictures for
+        Media.release. ``urls`` maps picture keys to their URLs."""
+        stored = {}
+        if ops:
+            cursor = Follower.collection.find({
+                'page_id': {'$in': list({query['page_id'] for query, _ in ops})},
+                'follower_id': {'$in': list({query['follower_id'] for query, _ in ops})}
+            }, {'page_id': 1, 'follower_id': 1, 'profile_pic_id': 1})
+            for doc in cursor:
+                stored[(doc['page_id'], doc['follower_id'])] = doc.get('profile_pic_id')
+        refs, released = [], []
+        for query, update in ops:
+            key = (query['page_id'], query['follower_id'])
+            previous = _pending_fields(Follower.collection, query).get('profile_pic_id', stored.get(key))
+            current = update['$set']['profile_pic_id']
+            if current:
+                refs.append((urls.get(current), 0 if current == previous else 1))
+            if previous and previous != current:
+                released.append(previous)
+        return refs, released
+
     @staticmethod
     def find_by_page(page_id, limit=100):
         """Find followers by page ID"""
-        if not Follower.collection:
+        if Follower.collection is None:
+            raise Exception("Database not initialized")
+        return Follower.collection.find({"page_id": page_id}).sort("created_at", -1).limit(limit)
+
+class Media:
+    """Content-addressed store of media URLs.
+
+    Posts and followers keep the key of each image or video, a hash of its
+    normalized URL, instead of the URL itself. The media document holds the
+    normalized URL, the latest URL it was seen under (the one to fetch, as
+    CDN signatures expire) and ``refs``, the number of documents referring
+    to it. Reference counts are kept up as documents are written and can
+    drift under concurrent writes; recount() repairs them.
+    """
+    collection = _LazyCollection('media')
+
+    INDEXES = [
+        IndexModel("refs")
+    ]
+
+    @staticmethod
+    def create_indexes():
+        """Create indexes for the Media collection"""
+        return sync_indexes(Media) is not None
+
+    @staticmethod
+    def normalize_url(url):
+        """``url`` without its volatile query parameters and fragment, with
+        the remaining parameters sorted"""
+        parts = urlsplit(url.strip())
+        query = sorted(
+            (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not any(fnmatch.fnmatchcase(name, pattern) for pattern in Config.MEDIA_VOLATILE_PARAMS)
+        )
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+    @staticmethod
+    def _hash(normalized):
+        return hashlib.blake2b(normalized.encode('utf-8'), digest_size=12).hexdigest()
+
+    @staticmethod
+    def key(url):
+        """Media key of a URL, the same for every fetch of the same asset"""
+        return Media._hash(Media.normalize_url(url)) if url else None
+
+    @staticmethod
+    def intern(refs, stats=None, batch_size=None):
+        """Store (url, count) pairs: the media document of each URL is
+        created if needed, its latest URL updated and ``count`` references
+        added, which may be 0 or negative"""
+        if Media.collection is None:
+            raise Exception("Database not initialized")
+        now = datetime.utcnow()
+        updates = {}
+        for url, count in refs:
+            if not url:
+                continue
+            normalized = Media.normalize_url(url)
+            key = Media._hash(normalized)
+            update = updates.get(key)
+            if update is None:
+                update = updates[key] = {
+                    '$set': {'last_url': url, 'seen_at': now},
+                    '$setOnInsert': {'url': normalized, 'created_at': now},
+                    '$inc': {'refs': 0}
+                }
+            update['$set']['last_url'] = url
+            update['$inc']['refs'] += count
+        ops = [({'_id': key}, update) for key, update in updates.items()]
+        if ops and not _write_behind(Media.collection, ops):
+            _bulk_upsert(Media.collection, ops, stats or IngestStats(), batch_size)
+        return len(ops)
+
+    @staticmethod
+    def release(keys, stats=None, batch_size=None):
+        """Drop one reference to each of ``keys`` (repeats allowed)"""
+        if Media.collection is None:
+            raise Exception("Database not initialized")
+        counts = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        ops = [({'_id': key}, {'$inc': {'refs': -count}}) for key, count in counts.items()]
+        if ops and not _write_behind(Media.collection, ops, upsert=False):
+            _bulk_upsert(Media.collection, ops, stats or IngestStats(), batch_size, upsert=False)
+        return len(ops)
+
+    @staticmethod
+    def resolve(keys):
+        """Map of media key to its latest URL for the stored ones, in one query"""
+        if Media.collection is None:
+            raise Exception("Database not initialized")
+        keys = [key for key in dict.fromkeys(keys) if key]
+        if not keys:
+            return {}
+        return {doc['_id']: doc['last_url'] for doc in Media.collection.find({'_id': {'$in': keys}}, {'last_url': 1})}
+
+    @staticmethod
+    def expand(posts):
+        """Add ``media_urls`` resolved from ``media_ids`` to post documents"""
+        posts = list(posts)
+        urls = Media.resolve(key for post in posts for key in post.get('media_ids') or [])
+        for post in posts:
+            if 'media_ids' in post:
+                post['media_urls'] = [urls.get(key) for key in post['media_ids']]
+        return posts
+
+    @staticmethod
+    def recount(batch_size=None):
+        """Recompute every reference count from the posts and followers
+        that exist; returns the number of media documents corrected"""
+        if Media.collection is None or Post.collection is None or Follower.collection is None:
+            raise Exception("Database not initialized")
+        counts = {}
+        pipelines = (
+            (Post.collection, [{'$unwind': '$media_ids'}, {'$group': {'_id': '$media_ids', 'refs': {'$sum': 1}}}]),
+            (Follower.collection, [
+                {'$match': {'profile_pic_id': {'$ne': None}}},
+                {'$group': {'_id': '$profile_pic_id', 'refs': {'$sum': 1}}}
+            ])
+        )
+        for collection, pipeline in pipelines:
+            for doc in collection.aggregate(pipeline):
+                counts[doc['_id']] = counts.get(doc['_id'], 0) + doc['refs']
+        ops = [
+            ({'_id': doc['_id']}, {'$set': {'refs': counts.get(doc['_id'], 0)}})
+            for doc in Media.collection.find({}, {'refs': 1})
+            if doc.get('refs') != counts.get(doc['_id'], 0)
+        ]
+        _bulk_upsert(Media.collection, ops, IngestStats(), batch_size, upsert=False)
+        return len(ops)
+
+    @staticmethod
+    def backfill(batch_size=None, dry_run=False):
+        """Move posts and followers stored before media keys over to them.
+
+        Their post_key and follower_id hashed raw media URLs. They are
+        rekeyed on normalized URLs, their URLs replaced by media keys and
+        the references interned. A document whose new key is already taken
+        was scraped again since, under the new key, and is deleted as a
+        duplicate, with its comments for a post. Returns counts of the
+        documents converted and deleted.
+        """
+        if Media.collection is None or Post.collection is None or Follower.collection is None:
+            raise Exception("Database not initialized")
+        batch_size = batch_size or Config.INGEST_BATCH_SIZE
+        counts = {'posts': 0, 'duplicate_posts': 0, 'followers': 0, 'duplicate_followers': 0}
+        if dry_run:
+            counts['posts'] = Post.collection.count_documents({'media_urls': {'$exists': True}})
+            counts['followers'] = Follower.collection.count_documents({'profile_pic': {'$exists': True}})
+            return counts
+
+        stats = IngestStats()
+        changed_pages, touched_pages = set(), set()
+        kinds = (
+            (Post.collection, Comment.collection, 'post_key', 'media_urls',
+             {'page_id': 1, 'post_key': 1, 'content': 1, 'media_urls': 1}, 'posts'),
+            (Follower.collection, None, 'follower_id', 'profile_pic',
+             {'page_id': 1, 'follower_id': 1, 'name': 1, 'profile_url': 1, 'profile_pic': 1}, 'followers')
+        )
+        for collection, children, key_field, legacy_field, projection, name in kinds:
+            # Converted documents drop out of the query, so every pass takes the next batch
+            while True:
+                docs = list(collection.find({legacy_field: {'$exists': True}}, projection).limit(batch_size))
+                if not docs:
+                    break
+                keys = {
+                    doc['_id']: Post.fingerprint(doc) if name == 'posts' else Follower.identity(doc)
+                    for doc in docs
+                }
+                taken = {
+                    (doc['page_id'], doc[key_field]): doc['_id']
+                    for doc in collection.find({
+                        'page_id': {'$in': list({doc['page_id'] for doc in docs})},
+                        key_field: {'$in': list(set(keys.values()))}
+                    }, {'page_id': 1, key_field: 1})
+                }
+                duplicates, ops, refs = [], [], []
+                for doc in docs:
+                    key = (doc['page_id'], keys[doc['_id']])
+                    if taken.setdefault(key, doc['_id']) != doc['_id']:
+                        duplicates.append(doc['_id'])
+                        changed_pages.add(doc['page_id'])
+                        continue
+                    if name == 'posts':
+                        urls = doc.get('media_urls') or []
+                        fields = {'media_ids': [Media.key(url) for url in urls]}
+                    else:
+                        urls = [doc['profile_pic']] if doc.get('profile_pic') else []
+                        fields = {'profile_pic_id': Media.key(doc.get('profile_pic'))}
+                    fields[key_field] = keys[doc['_id']]
+                    update = {'$set': fields, '$unset': {legacy_field: ''}}
+                    ops.append(({'_id': doc['_id']}, update))
+                    refs.extend((url, 1) for url in urls)
+                if duplicates:
+                    if children is not None:
+                        children.delete_many({'post_id': {'$in': duplicates}})
+                    collection.delete_many({'_id': {'$in': duplicates}})
+                _bulk_upsert(collection, ops, stats, batch_size, upsert=False)
+                Media.intern(refs, stats, batch_size)
+                counts[name] += len(ops)
+                counts[f'duplicate_{name}'] += len(duplicates)
+                touched_pages.update(doc['page_id'] for doc in docs)
+        flush_writes()
+        if changed_pages:
+            PageStats.refresh(changed_pages, batch_size)
+        if touched_pages:
+            invalidate(*(page_tag(page_id) for page_id in touched_pages))
+        return counts
+
+    @staticmethod
+    def prune():
+        """Delete media no document refers to; returns how many"""
+        if Media.collection is None:
+            raise Exception("Database not initialized")
+        return Media.collection.delete_many({'refs': {'$lte': 0}}).deleted_count
+
+class PageStats:
+    """Engagement rollups per page, recomputed whenever a page's posts or
+    follower count are written"""
+    collection = _LazyCollection('page_stats')
+
+    # Rollup fields /api/leaderboard can rank pages by
+    LEADERBOARD_METRICS = ('engagement_rate', 'avg_likes', 'avg_shares', 'avg_comments',
+                           'posts_per_week', 'follower_count')
+
+    INDEXES = [
+        IndexModel("page_id", unique=True),
+        IndexModel("username", unique=True)
+    ] + [IndexModel([(metric, DESCENDING), ("_id", DESCENDING)]) for metric in LEADERBOARD_METRICS]
+
+    @staticmethod
+    def create_indexes():
+        """Create indexes for the PageStats collection"""
+        return sync_indexes(PageStats) is not None
+
+    @staticmethod
+    def compute(page, posts, now=None):
+        """Rollup document for a page from its posts' metrics and dates"""
+        now = now or datetime.utcnow()
+        count = len(posts)
+        likes = sorted(post.get('likes_count') or 0 for post in posts)
+        shares = sorted(post.get('shares_count') or 0 for post in posts)
+        comments = sorted(post.get('comments_count') or 0 for post in posts)
+        interactions = sum(likes) + sum(shares) + sum(comments)
+        followers = page.get('follower_count') or 0
+        dates = sorted(post['created_at'] for post in posts if post.get('created_at'))
+        # Posting frequency over the span the scraped posts cover, at least a day
+        days = max((dates[-1] - dates[0]).total_seconds() / 86400, 1) if dates else 1
+
+        return {
+            'page_id': page['_id'],
+            'username': page.get('username'),
+            'category': page.get('category'),
+            'follower_count': followers,
+            'post_count': count,
+            'total_likes': sum(likes),
+            'total_shares': sum(shares),
+            'total_comments': sum(comments),
+            'avg_likes': sum(likes) / count if count else 0,
+            'avg_shares': sum(shares) / count if count else 0,
+            'avg_comments': sum(comments) / count if count else 0,
+            'p50_likes': percentile(likes, 50),
+            'p90_likes': percentile(likes, 90),
+            'p50_shares': percentile(shares, 50),
+            'p90_shares': percentile(shares, 90),
+            # Average interactions per post relative to the audience size
+            'engagement_rate': interactions / count / followers if count and followers else 0,
+            'posts_per_day': count / days,
+            'posts_per_week': count * 7 / days,
+            'posts_last_7_days': sum(1 for date in dates if date >= now - timedelta(days=7)),
+            'first_post_at': dates[0] if dates else None,
+            'last_post_at': dates[-1] if dates else None,
+            'updated_at': now
+        }
+
+    @staticmethod
+    def refresh(page_ids, batch_size=None):
+        """Recompute and store the rollups of the given pages.
+
+        Reads only the metric fields of those pages' posts through the
+        (page_id, created_at) index, one query per batch of pages.
+        """
+        if PageStats.collection is None or Page.collection is None or Post.collection is None:
+            raise Exception("Database not initialized")
+        page_ids = list(dict.fromkeys(page_ids))
+        batch_size = batch_size or Config.INGEST_BATCH_SIZE
+        fields = dict.fromkeys(Post.METRIC_FIELDS + ('page_id', 'created_at'), 1)
+        for start in range(0, len(page_ids), batch_size):
+            chunk = page_ids[start:start + batch_size]
+            posts = {page_id: [] for page_id in chunk}
+            for post in Post.collection.find({'page_id': {'$in': chunk}}, fields):
+                posts[post['page_id']].append(post)
+            pages = Page.collection.find(
+                {'_id': {'$in': chunk}}, {'username': 1, 'category': 1, 'follower_count': 1}
+            )
+            ops = [
+                ({'page_id': page['_id']}, {'$set': PageStats.compute(page, posts[page['_id']])})
+                for page in pages
+            ]
+            _bulk_upsert(PageStats.collection, ops, IngestStats(), batch_size)
+        if page_ids:
+            invalidate(LEADERBOARD_TAG, *(page_tag(page_id) for page_id in page_ids))
+
+    @staticmethod
+    def rebuild(batch_size=None):
+        """Recompute the rollups of every page; returns the number of pages"""
+        if Page.collection is None:
+            raise Exception("Database not initialized")
+        page_ids = [page['_id'] for page in Page.collection.find({}, {'_id': 1})]
+        PageStats.refresh(page_ids, batch_size)
+        return len(page_ids)
+
+    @staticmethod
+    def find_by_page(page_id):
+        """Rollup of one page"""
+        if PageStats.collection is None:
+            raise Exception("Database not initialized")
+        return PageStats.collection.find_one({'page_id': page_id}, {'_id': 0})
+
+    @staticmethod
+    def leaderboard(metric='engagement_rate', limit=10):
+        """Pages with the highest ``metric``"""
+        if PageStats.collection is None:
+            raise Exception("Database not initialized")
+        if metric not in PageStats.LEADERBOARD_METRICS:
+            raise ValueError(f"Unsupported metric {metric!r}")
+        limit = max(1, min(limit, Config.MAX_PAGE_SIZE))
+        return PageStats.collection.find({}, {'_id': 0}).sort([(metric, -1), ('_id', -1)]).limit(limit)
+
+class PageHistory:
+    """Follower and like counts over time, stored in buckets.
+
+    Every scrape adds a sample to the page's raw bucket for that day and
+    folds it into per-hour points (one bucket per month) and per-day points
+    (one bucket per year). Buckets expire after the retention configured
+    for their resolution.
+    """
+    collection = _LazyCollection('page_history')
+
+    # resolution: (bucket length, point key format, retention in days)
+    RESOLUTIONS = {
+        'raw': ('day', None, Config.HISTORY_RAW_RETENTION_DAYS),
+        'hour': ('month', '%Y%m%d%H', Config.HISTORY_HOURLY_RETENTION_DAYS),
+        'day': ('year', '%Y%m%d', Config.HISTORY_DAILY_RETENTION_DAYS)
+    }
+
+    INDEXES = [
+        IndexModel([("page_id", ASCENDING), ("resolution", ASCENDING), ("bucket", ASCENDING)], unique=True),
+        IndexModel("expires_at", expireAfterSeconds=0)
+    ]
+
+    @staticmethod
+    def create_indexes():
+        """Create indexes for the PageHistory collection"""
+        return sync_indexes(PageHistory) is not None
+
+    @staticmethod
+    def bucket_bounds(length, ts):
+        """Start and end of the bucket of the given length holding ``ts``"""
+        if length == 'day':
+            start = datetime(ts.year, ts.month, ts.day)
+            return start, start + timedelta(days=1)
+        if length == 'month':
+            start = datetime(ts.year, ts.month, 1)
+            return start, datetime(ts.year + ts.month // 12, ts.month % 12 + 1, 1)
+        return datetime(ts.year, 1, 1), datetime(ts.year + 1, 1, 1)
+
+    @staticmethod
+    def _expires(end, retention):
+        return end + timedelta(days=retention) if retention else None
+
+    @staticmethod
+    def record_ops(samples):
+        """(filter, update) pairs adding (page_id, ts, followers, likes)
+        samples to their buckets, one pair per bucket touched"""
+        updates = {}
+        for page_id, ts, followers, likes in sorted(samples, key=lambda sample: sample[1]):
+            followers, likes = followers or 0, likes or 0
+            length, _, retention = PageHistory.RESOLUTIONS['raw']
+            start, end = PageHistory.bucket_bounds(length, ts)
+            update = updates.setdefault((page_id, 'raw', start), {
+                '$push': {'samples': {'$each': []}},
+                '$inc': {'count': 0},
+                '$setOnInsert': {'expires_at': PageHistory._expires(end, retention)}
+            })
+            update['$push']['samples']['$each'].append({'ts': ts, 'followers': followers, 'likes': likes})
+            update['$inc']['count'] += 1
+
+            for resolution in ('hour', 'day'):
+                length, key_format, retention = PageHistory.RESOLUTIONS[resolution]
+                start, end = PageHistory.bucket_bounds(length, ts)
+                update = updates.setdefault((page_id, resolution, start), {
+                    '$inc': {}, '$min': {}, '$max': {}, '$set': {},
+                    '$setOnInsert': {'expires_at': PageHistory._expires(end, retention)}
+                })
+                point = f"points.{ts.strftime(key_format)}"
+                for name, value in (('followers', followers), ('likes', likes)):
+                    sum_path, min_path, max_path = f'{point}.{name}_sum', f'{point}.{name}_min', f'{point}.{name}_max'
+                    update['$inc'][sum_path] = update['$inc'].get(sum_path, 0) + value
+                    update['$min'][min_path] = min(update['$min'].get(min_path, value), value)
+                    update['$max'][max_path] = max(update['$max'].get(max_path, value), value)
+                    # Latest value in the interval
+                    update['$set'][f'{point}.{name}'] = value
+                update['$inc'][f'{point}.count'] = update['$inc'].get(f'{point}.count', 0) + 1
+                update['$set'][f'{point}.ts'] = ts
+
+        return [
+            ({'page_id': page_id, 'resolution': resolution, 'bucket': bucket}, update)
+            for (page_id, resolution, bucket), update in updates.items()
+        ]
+
+    @staticmethod
+    def record(samples, stats=None, batch_size=None):
+        """Store (page_id, ts, followers, likes) samples, through the write
+        buffer when write-behind is on"""
+        if PageHistory.collection is None:
+            raise Exception("Database not initialized")
+        stats = stats or IngestStats()
+        ops = PageHistory.record_ops(samples)
+        tags = {page_tag(page_id) for page_id, _, _, _ in samples}
+        if not _write_behind(PageHistory.collection, ops, tags):
+            _bulk_upsert(PageHistory.collection, ops, stats, batch_size)
+        return stats
+
+    @staticmethod
+    def pick_resolution(start, end):
+        """Coarsest resolution that still gives useful detail for the range"""
+        span = end - start
+        if span <= timedelta(days=2):
+            return 'raw'
+        if span <= timedelta(days=90):
+            return 'hour'
+        return 'day'
+
+    @staticmethod
+    def find_range(page_id, start, end, resolution=None):
+        """Points between ``start`` and ``end`` at ``resolution``, oldest first"""
+        if PageHistory.collection is None:
+            raise Exception("Database not initialized")
+        resolution = resolution or PageHistory.pick_resolution(start, end)
+        if resolution not in PageHistory.RESOLUTIONS:
+            raise ValueError(f"Unsupported resolution {resolution!r}")
+        length, key_format, _ = PageHistory.RESOLUTIONS[resolution]
+        buckets = PageHistory.collection.find({
+            'page_id': page_id,
+            'resolution': resolution,
+            'bucket': {'$gte': PageHistory.bucket_bounds(length, start)[0], '$lte': end}
+        }).sort('bucket', 1)
+
+        points = []
+        for bucket in buckets:
+            if resolution == 'raw':
+                points.extend(
+                    {'ts': sample['ts'], 'followers': sample['followers'], 'likes': sample['likes']}
+                    for sample in bucket.get('samples', [])
+                )
+                continue
+            for key in sorted(bucket.get('points', {})):
+                point = bucket['points'][key]
+                count = point.get('count') or 1
+                points.append({
+                    'ts': datetime.strptime(key, key_format),
+                    'followers': point.get('followers'),
+                    'followers_min': point.get('followers_min'),
+                    'followers_max': point.get('followers_max'),
+                    'followers_avg': point.get('followers_sum', 0) / count,
+                    'likes': point.get('likes'),
+                    'likes_min': point.get('likes_min'),
+                    'likes_max': point.get('likes_max'),
+                    'likes_avg': point.get('likes_sum', 0) / count,
+                    'samples': point.get('count', 0)
+                })
+        return resolution, [point for point in points if start <= point['ts'] <= end]
+
+class Lock:
+    """Named leases shared by all worker processes through the database"""
+    collection = _LazyCollection('locks')
+
+    INDEXES = [
+        # Expired leases are removed by the TTL monitor
+        IndexModel("expires_at", expireAfterSeconds=0)
+    ]
+
+    @staticmethod
+    def create_indexes():
+        """Create indexes for the Lock collection"""
+        return sync_indexes(Lock) is not None
+
+    @staticmethod
+    def acquire(name, ttl):
+        """Take the lease ``name`` for ``ttl`` seconds, returning a token or None if it is held"""
+        if Lock.collection is None:
+            raise Exception("Database not initialized")
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        try:
+            # Matches only a missing or expired lease; a live lease makes the
+            # upsert collide on _id instead
+            Lock.collection.find_one_and_update(
+                {'_id': name, 'expires_at': {'$lt': now}},
+                {'$set': {'token': token, 'expires_at': now + timedelta(seconds=ttl)}},
+                upsert=True
+            )
+            return token
+        except errors.DuplicateKeyError:
+            return None
+
+    @staticmethod
+    def is_held(name):
+        """Check whether an unexpired lease exists"""
+        if Lock.collection is None:
+            raise Exception("Database not initialized")
+        return Lock.collection.count_documents(
+            {'_id': name, 'expires_at': {'$gte': datetime.utcnow()}}, limit=1
+        ) > 0
+
+    @staticmethod
+    def renew(name, token, ttl):
+        """Extend a lease owned by ``token`` by ``ttl`` seconds from now;
+        False when it was lost"""
+        if Lock.collection is None:
+            raise Exception("Database not initialized")
+        return Lock.collection.update_one(
+            {'_id': name, 'token': token},
+            {'$set': {'expires_at': datetime.utcnow() + timedelta(seconds=ttl)}}
+        ).matched_count == 1
+
+    @staticmethod
+    def release(name, token):
+        """Release a lease if it is still owned by ``token``"""
+        if Lock.collection is None:
+            raise Exception("Database not initialized")
+        return Lock.collection.delete_one({'_id': name, 'token': token}).deleted_count == 1
+
+class CacheInvalidation:
+    """Cache tags invalidated by each process, read back by every other
+    process's cache through caching.InvalidationFeed"""
+    collection = _LazyCollection('cache_invalidations')
+
+    INDEXES = [
+        # Readers only look a few seconds back, the TTL monitor removes the rest
+        IndexModel("at", expireAfterSeconds=3600)
+    ]
+
+    @staticmethod
+    def create_indexes():
+        """Create indexes for the CacheInvalidation collection"""
+        return sync_indexes(CacheInvalidation) is not None
+
+    @staticmethod
+    def add(tags, origin):
+        """Log that the process ``origin`` invalidated ``tags``"""
+        if CacheInvalidation.collection is None:
             raise Exception("Database not initialized")
-        return Follower.collection.find({"page_id": page_id}).sort("created_at", -1).limit(limit)
\ No newline at end of file
+        CacheInvalidation.collection.insert_one({'tags': list(tags), 'origin': origin, 'at': datetime.utcnow()})
+
+    @staticmethod
+    def since(at):
+        """Invalidations logged at or after ``at``, oldest first"""
+        if CacheInvalidation.collection is None:
+            raise Exception("Database not initialized")
+        return list(CacheInvalidation.collection.find({'at': {'$gte': at}}).sort('at', ASCENDING))
+
+class Schedule:
+    """Refresh schedule of each page with the change and demand statistics
+    it is derived from, maintained by scheduler.py"""
+    collection = _LazyCollection('schedules')
+
+    INDEXES = [
+        IndexModel("username", unique=True),
+        IndexModel([("next_refresh_at", ASCENDING), ("priority", DESCENDING)])
+    ]
+
+    @staticmethod
+    def create_indexes():
+        """Create indexes for the Schedule collection"""
+        return sync_indexes(Schedule) is not None
+
+    @staticmethod
+    def find(username):
+        """Schedule of ``username``, or None"""
+        if Schedule.collection is None:
+            raise Exception("Database not initialized")
+        return Schedule.collection.find_one({'username': username})
+
+    @staticmethod
+    def seed(batch_size=None):
+        """Create a schedule for every stored page that has none, due one
+        default interval after its last scrape; returns how many"""
+        if Schedule.collection is None or Page.collection is None:
+            raise Exception("Database not initialized")
+        batch_size = batch_size or Config.INGEST_BATCH_SIZE
+        known = set(doc['username'] for doc in Schedule.collection.find({}, {'_id': 0, 'username': 1}))
+        stats = IngestStats()
+        ops = []
+        count = 0
+        pages = Page.collection.find({'partial': {'$ne': True}}, {'_id': 0, 'username': 1, 'scraped_at': 1})
+        for page in pages.batch_size(batch_size):
+            if page['username'] in known:
+                continue
+            scraped_at = page.get('scraped_at') or datetime.utcnow()
+            due = scraped_at + timedelta(hours=1 / Config.SCHEDULE_PRIOR_CHANGE_RATE)
+            ops.append(({'username': page['username']}, {
+                '$setOnInsert': {'last_scraped_at': scraped_at, 'next_refresh_at': due}
+            }))
+            if len(ops) >= batch_size:
+                count += len(_bulk_upsert(Schedule.collection, ops, stats, batch_size))
+                ops = []
+        if ops:
+            count += len(_bulk_upsert(Schedule.collection, ops, stats, batch_size))
+        return count
+
+    @staticmethod
+    def save(username, fields, views=0):
+        """Set ``fields`` on the schedule of ``username``, creating it if
+        needed, and take ``views`` already counted into it off the pending
+        requests"""
+        if Schedule.collection is None:
+            raise Exception("Database not initialized")
+        update = {'$set': fields}
+        if views:
+            update['$inc'] = {'views': -views}
+        Schedule.collection.update_one({'username': username}, update, upsert=True)
+
+    @staticmethod
+    def save_many(updates, batch_size=None):
+        """Apply (username, fields, views) triples like save(), in bulk"""
+        if Schedule.collection is None:
+            raise Exception("Database not initialized")
+        ops = []
+        for username, fields, views in updates:
+            update = {'$set': fields}
+            if views:
+                update['$inc'] = {'views': -views}
+            ops.append(({'username': username}, update))
+        _bulk_upsert(Schedule.collection, ops, IngestStats(), batch_size)
+
+    @staticmethod
+    def add_views(counts):
+        """Add {username: requests} to the pending requests of scheduled
+        pages; pages without a schedule are not tracked"""
+        if Schedule.collection is None:
+            raise Exception("Database not initialized")
+        ops = [({'username': username}, {'$inc': {'views': count}}) for username, count in counts.items()]
+        if ops and not _write_behind(Schedule.collection, ops, upsert=False):
+            _bulk_upsert(Schedule.collection, ops, IngestStats(), upsert=False)
+
+    @staticmethod
+    def iter_all(batch_size=None):
+        """Every schedule, read in batches"""
+        if Schedule.collection is None:
+            raise Exception("Database not initialized")
+        return Schedule.collection.find({}, {'_id': 0}).batch_size(batch_size or Config.INGEST_BATCH_SIZE)
+
+    @staticmethod
+    def due(now, limit):
+        """Up to ``limit`` schedules due by ``now``, highest priority first"""
+        if Schedule.collection is None:
+            raise Exception("Database not initialized")
+        if limit <= 0:
+            return []
+        return list(Schedule.collection.find({'next_refresh_at': {'$lte': now}}, {'_id': 0}).sort(
+            [('priority', DESCENDING), ('next_refresh_at', ASCENDING)]
+        ).limit(limit))
+
+class Job:
+    """Scrape and refresh jobs queued for the worker processes.
+
+    At most one job per username is active (queued or running); enqueueing
+    again returns that job, raising its priority if needed. Workers claim
+    the highest priority job that is due under a lease; a job whose lease
+    runs out is claimed again by another worker, or marked failed once it
+    has used up its attempts.
+    """
+    collection = _LazyCollection('jobs')
+
+    TYPES = ('scrape', 'refresh')
+
+    INDEXES = [
+        IndexModel("username", unique=True, partialFilterExpression={'active': True},
+                   name='active_username'),
+        IndexModel([("status", ASCENDING), ("priority", DESCENDING), ("run_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)]),
+        IndexModel([("username", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("source", ASCENDING), ("created_at", DESCENDING)]),
+        # Finished jobs are removed by the TTL monitor
+        IndexModel("expires_at", expireAfterSeconds=0)
+    ]
+
+    @staticmethod
+    def create_indexes():
+        """Create indexes for the Job collection"""
+        return sync_indexes(Job) is not None
+
+    @staticmethod
+    def enqueue(job_type, username, priority=0, max_attempts=None, source=None):
+        """Queue a job for ``username`` or return the one already active.
+        ``source`` is recorded on a new job to count them with created_since()"""
+        if Job.collection is None:
+            raise Exception("Database not initialized")
+        if job_type not in Job.TYPES:
+            raise ValueError(f"Unsupported job type {job_type!r}")
+        now = datetime.utcnow()
+        fields = {
+            'type': job_type,
+            'status': 'queued',
+            'attempts': 0,
+            'max_attempts': max_attempts or Config.JOB_MAX_ATTEMPTS,
+            'run_at': now,
+            'created_at': now
+        }
+        if source:
+            fields['source'] = source
+        for _ in range(2):
+            try:
+                return Job.collection.find_one_and_update(
+                    {'username': username, 'active': True},
+                    {'$max': {'priority': priority}, '$setOnInsert': fields},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except errors.DuplicateKeyError:
+                # Lost the race to insert; the other job is active now
+                continue
+        raise Exception(f"Could not enqueue {job_type} job for {username}")
+
+    @staticmethod
+    def created_since(source, since):
+        """Number of jobs from ``source`` created since ``since``, as far
+        back as finished jobs are retained"""
+        if Job.collection is None:
+            raise Exception("Database not initialized")
+        return Job.collection.count_documents({'source': source, 'created_at': {'$gte': since}})
+
+    @staticmethod
+    def claim(worker, lease_seconds=None):
+        """Lease the next due job to ``worker``, or return None"""
+        if Job.collection is None:
+            raise Exception("Database not initialized")
+        now = datetime.utcnow()
+        lease = timedelta(seconds=lease_seconds or Config.JOB_LEASE_SECONDS)
+        expired = {'status': 'running', 'lease_until': {'$lt': now}}
+        # A job whose worker died on its last attempt is not handed out again
+        Job.collection.update_many(
+            dict(expired, **{'$expr': {'$gte': ['$attempts', '$max_attempts']}}),
+            {
+                '$set': {'status': 'failed', 'error': 'Lease expired', 'finished_at': now, 'updated_at': now,
+                         'expires_at': now + timedelta(seconds=Config.JOB_RETENTION_SECONDS)},
+                '$unset': {'active': '', 'lease_token': '', 'lease_until': ''}
+            }
+        )
+        for query in ({'status': 'queued', 'run_at': {'$lte': now}},
+                      dict(expired, **{'$expr': {'$lt': ['$attempts', '$max_attempts']}})):
+            job = Job.collection.find_one_and_update(
+                query,
+                {
+                    '$set': {'status': 'running', 'worker': worker, 'lease_token': uuid.uuid4().hex,
+                             'lease_until': now + lease, 'started_at': now},
+                    '$inc': {'attempts': 1}
+                },
+                sort=[('priority', DESCENDING), ('run_at', ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if job is not None:
+                return job
+        return None
+
+    @staticmethod
+    def _finish(job, fields, unset=None):
+        now = datetime.utcnow()
+        update = {'$set': dict(fields, updated_at=now)}
+        if unset:
+            update['$unset'] = dict.fromkeys(unset, '')
+        # Only the worker still holding the lease may record the outcome
+        return Job.collection.update_one(
+            {'_id': job['_id'], 'status': 'running', 'lease_token': job['lease_token']}, update
+        ).modified_count == 1
+
+    @staticmethod
+    def complete(job, result):
+        """Mark a claimed job done"""
+        if Job.collection is None:
+            raise Exception("Database not initialized")
+        now = datetime.utcnow()
+        return Job._finish(job, {
+            'status': 'done',
+            'result': result,
+            'finished_at': now,
+            'expires_at': now + timedelta(seconds=Config.JOB_RETENTION_SECONDS)
+        }, unset=('active', 'lease_token', 'lease_until'))
+
+    @staticmethod
+    def fail(job, error, retry_delay=0, retry=True):
+        """Queue a claimed job again after ``retry_delay`` seconds, or mark
+        it failed when ``retry`` is False or it used up its attempts"""
+        if Job.collection is None:
+            raise Exception("Database not initialized")
+        now = datetime.utcnow()
+        if retry and job['attempts'] < job['max_attempts']:
+            return Job._finish(job, {
+                'status': 'queued',
+                'error': error,
+                'run_at': now + timedelta(seconds=retry_delay)
+            }, unset=('lease_token', 'lease_until'))
+        return Job._finish(job, {
+            'status': 'failed',
+            'error': error,
+            'finished_at': now,
+            'expires_at': now + timedelta(seconds=Config.JOB_RETENTION_SECONDS)
+        }, unset=('active', 'lease_token', 'lease_until'))
+
+    @staticmethod
+    def find(job_id):
+        """Find a job by id"""
+        if Job.collection is None:
+            raise Exception("Database not initialized")
+        try:
+            job_id = ObjectId(job_id)
+        except Exception:
+            return None
+        return Job.collection.find_one({'_id': job_id}, {'lease_token': 0, 'active': 0})
+
+    @staticmethod
+    def latest(username):
+        """Most recent job for ``username``"""
+        if Job.collection is None:
+            raise Exception("Database not initialized")
+        return Job.collection.find_one(
+            {'username': username}, {'lease_token': 0, 'active': 0}, sort=[('created_at', DESCENDING)]
+        )
+
+    @staticmethod
+    def latest_many(usernames):
+        """Map of username to its most recent job, in one query"""
+        if Job.collection is None:
+            raise Exception("Database not initialized")
+        cursor = Job.collection.find(
+            {'username': {'$in': list(usernames)}}, {'lease_token': 0, 'active': 0}
+        ).sort('created_at', DESCENDING)
+        latest = {}
+        for job in cursor:
+            latest.setdefault(job['username'], job)
+        return latest
+
+class Migration:
+    """Applied schema versions, one document per migration name"""
+    collection = _LazyCollection('migrations')
+
+    @staticmethod
+    def get_version(name):
+        if Migration.collection is None:
+            raise Exception("Database not initialized")
+        doc = Migration.collection.find_one({'_id': name})
+        return doc.get('version') if doc else None
+
+    @staticmethod
+    def set_version(name, version):
+        if Migration.collection is None:
+            raise Exception("Database not initialized")
+        Migration.collection.update_one(
+            {'_id': name}, {'$set': {'version': version, 'applied_at': datetime.utcnow()}}, upsert=True
+        )
+
+class Search:
+    """Ranked, prefix-aware search over page names and about texts and post
+    contents.
+
+    MongoDB answers with its text indexes, plus an indexed prefix match of
+    the word still being typed on ``search_terms``. mongomock has no text
+    search, so there a process-wide InvertedIndex is built from the
+    collections on first use and kept current by the model write paths.
+    """
+    TYPES = ('page', 'post')
+    # Same field weights as the search_text indexes
+    PAGE_FIELDS = (('name', 10), ('about', 2))
+    POST_FIELDS = (('content', 1),)
+    # Score added to documents matching the typed prefix in MongoDB
+    PREFIX_SCORE = 0.5
+
+    _index = None
+    _index_lock = threading.Lock()
+
+    @staticmethod
+    def _collection(kind):
+        return Page.collection if kind == 'page' else Post.collection
+
+    @staticmethod
+    def _add(index, kind, docs):
+        fields = Search.PAGE_FIELDS if kind == 'page' else Search.POST_FIELDS
+        for doc in docs:
+            if doc.get('_id') is not None:
+                index.add((kind, doc['_id']), [(doc.get(field), weight) for field, weight in fields])
+
+    @staticmethod
+    def fallback_index():
+        """The in-process index, built from the collections on first use"""
+        with Search._index_lock:
+            if Search._index is None:
+                index = InvertedIndex()
+                Search._add(index, 'page', Page.collection.find({}, {'name': 1, 'about': 1}))
+                Search._add(index, 'post', Post.collection.find({}, {'content': 1}))
+                Search._index = index
+                logging.info(f"Built in-process search index of {len(index)} documents")
+            return Search._index
+
+    @staticmethod
+    def _update(kind, docs):
+        # Holding the lock also covers writes racing with the initial build
+        with Search._index_lock:
+            if Search._index is not None:
+                Search._add(Search._index, kind, docs)
+
+    @staticmethod
+    def index_pages(pages):
+        """Update the in-process index, if it is in use, after pages were written"""
+        Search._update('page', pages)
+
+    @staticmethod
+    def index_posts(posts):
+        """Update the in-process index, if it is in use, after posts were written"""
+        Search._update('post', posts)
+
+    @staticmethod
+    def _mongo_scores(kind, query, limit):
+        collection = Search._collection(kind)
+        scores = {}
+        cursor = collection.find(
+            {'$text': {'$search': query}}, {'score': {'$meta': 'textScore'}}
+        ).sort([('score', {'$meta': 'textScore'})]).limit(limit)
+        for doc in cursor:
+            scores[(kind, doc['_id'])] = doc['score']
+        _, prefix = parse_query(query)
+        if prefix and len(prefix) >= Config.SEARCH_MIN_PREFIX:
+            # Anchored, case-sensitive regex: a range scan on the search_terms index
+            cursor = collection.find(
+                {'search_terms': {'$regex': f'^{re.escape(prefix)}'}}, {'_id': 1}
+            ).limit(limit)
+            for doc in cursor:
+                key = (kind, doc['_id'])
+                scores[key] = scores.get(key, 0) + Search.PREFIX_SCORE
+        return scores
+
+    @staticmethod
+    def query(query, types=TYPES, limit=20):
+        """Best matches as dicts with ``type``, ``score`` and the ``doc``"""
+        if Page.collection is None or Post.collection is None:
+            raise Exception("Database not initialized")
+        unknown = [kind for kind in types if kind not in Search.TYPES]
+        if unknown:
+            raise ValueError(f"Unsupported search types: {', '.join(unknown)}")
+        limit = max(1, min(limit, Config.MAX_PAGE_SIZE))
+
+        if _is_mock(Page.collection):
+            ranked = Search.fallback_index().search(query, limit, accept=lambda key: key[0] in types)
+        else:
+            scores = {}
+            for kind in types:
+                scores.update(Search._mongo_scores(kind, query, limit))
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+        docs = {}
+        for kind in types:
+            ids = [_id for (doc_kind, _id), _ in ranked if doc_kind == kind]
+            if ids:
+                for doc in Search._collection(kind).find({'_id': {'$in': ids}}, HIDDEN_FIELDS):
+                    docs[(kind, doc['_id'])] = doc
+        return [
+            {'type': key[0], 'score': round(score, 4), 'doc': docs[key]}
+            for key, score in ranked if key in docs
+        ]
+
+# Models whose INDEXES are managed by sync_indexes
+MODELS = (Page, Post, Comment, Follower, Media, PageStats, PageHistory, Lock, CacheInvalidation, Schedule, Job)
+
+# Index options that make an existing index differ from its declaration
+_INDEX_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression', 'weights')
+
+def _is_text_index(key):
+    # Declared keys map fields to TEXT; stored text indexes show up as _fts
+    items = key.items() if hasattr(key, 'items') else key
+    return any(value == TEXT or field == '_fts' for field, value in items)
+
+def _index_options(spec, like=None):
+    """Comparable options of an index from index_information(), or of a
+    declaration when ``like`` is the stored index to compare it with"""
+    options = {option: spec[option] for option in _INDEX_OPTIONS if option in spec}
+    if like is not None:
+        if 'weights' not in like:
+            # mongomock does not report text index weights
+            options.pop('weights', None)
+        elif _is_text_index(spec['key']):
+            options['weights'] = dict(
+                {field: 1 for field, value in spec['key'].items() if value == TEXT}, **options.get('weights', {})
+            )
+    if 'weights' in options:
+        options['weights'] = dict(options['weights'])
+    return options
+
+def sync_indexes(model, drop_extra=False, dry_run=False):
+    """Bring a model's indexes in line with its INDEXES declaration.
+
+    Missing indexes are created and indexes whose options changed are
+    rebuilt; indexes that are not declared are reported, and dropped with
+    ``drop_extra``. Returns a report dict, or None on failure.
+    """
+    name = vars(model)['collection'].name
+    if model.collection is None:
+        logging.error("Database not initialized, cannot create indexes")
+        return None
+    try:
+        existing = model.collection.index_information()
+        report = {'created': [], 'rebuilt': [], 'extra': [], 'dropped': []}
+        missing = []
+        for index in model.INDEXES:
+            spec = index.document
+            current = existing.get(spec['name'])
+            if current is None:
+                report['created'].append(spec['name'])
+                missing.append(index)
+            elif _index_options(current) != _index_options(spec, like=current):
+                report['rebuilt'].append(spec['name'])
+                missing.append(index)
+                if not dry_run:
+                    model.collection.drop_index(spec['name'])
+
+        declared = {index.document['name'] for index in model.INDEXES}
+        report['extra'] = [index for index in existing if index != '_id_' and index not in declared]
+        if drop_extra:
+            report['dropped'] = report['extra']
+            if not dry_run:
+                for index in report['extra']:
+                    model.collection.drop_index(index)
+
+        # A collection can only have one text index, so a replaced one goes first
+        if any(_is_text_index(index.document['key']) for index in missing):
+            for index in list(report['extra']):
+                if _is_text_index(existing[index]['key']) and index not in report['dropped']:
+                    report['dropped'].append(index)
+                    if not dry_run:
+                        model.collection.drop_index(index)
+
+        if missing and not dry_run:
+            model.collection.create_indexes(missing)
+        logging.info(f"Indexes for {name}: {report}")
+        return report
+    except Exception as e:
+        logging.error(f"Error creating indexes for {name} collection: {e}")
+        return None
+
+def index_version():
+    """Fingerprint of every declared index, changing whenever one is added,
+    removed or altered"""
+    digest = hashlib.blake2b(digest_size=8)
+    for model in MODELS:
+        for index in model.INDEXES:
+            spec = sorted((key, repr(value)) for key, value in index.document.items())
+            digest.update(repr((vars(model)['collection'].name, spec)).encode('utf-8'))
+    return digest.hexdigest()
+
+class IngestStats:
+    """Write statistics for one ingestion run, one entry per bulk batch"""
+
+    def __init__(self):
+        self.batches = []
+        self.page_ids = {}
+
+    def add(self, collection, operations, matched, modified, upserted, seconds):
+        self.batches.append({
+            'collection': collection,
+            'operations': operations,
+            'matched': matched,
+            'modified': modified,
+            'upserted': upserted,
+            'seconds': round(seconds, 6)
+        })
+
+    def totals(self):
+        """Sum the batch counters per collection"""
+        totals = {}
+        for batch in self.batches:
+            total = totals.setdefault(batch['collection'], {
+                'batches': 0, 'operations': 0, 'matched': 0, 'modified': 0, 'upserted': 0, 'seconds': 0
+            })
+            total['batches'] += 1
+            for field in ('operations', 'matched', 'modified', 'upserted', 'seconds'):
+                total[field] += batch[field]
+        return totals
+
+    def to_dict(self):
+        return {'batches': self.batches, 'totals': self.totals()}
+
+def _bulk_upsert(collection, ops, stats, batch_size=None, upsert=True, applied=None, unknown=None):
+    """Apply (filter, update) upserts in unordered batches of ``batch_size``,
+    or plain updates with ``upsert=False``.
+
+    Returns {op_index: _id} for the documents that were inserted. When a
+    write fails, the ``applied`` set, if given, holds the indexes of the
+    ops known to have landed, and ``unknown`` those of the batch whose
+    outcome was lost with the error.
+    """
+    batch_size = batch_size or Config.INGEST_BATCH_SIZE
+    # mongomock can't execute UpdateOne requests built by current pymongo
+    is_mock = _is_mock(collection)
+    applied = set() if applied is None else applied
+    unknown = set() if unknown is None else unknown
+    upserted = {}
+    for start in range(0, len(ops), batch_size):
+        chunk = ops[start:start + batch_size]
+        started = time.perf_counter()
+        if is_mock:
+            matched = modified = 0
+            for index, (query, update) in enumerate(chunk):
+                result = collection.update_one(query, update, upsert=upsert)
+                applied.add(start + index)
+                matched += result.matched_count
+                modified += result.modified_count
+                if result.upserted_id is not None:
+                    upserted[start + index] = result.upserted_id
+        else:
+            try:
+                result = collection.bulk_write(
+                    [UpdateOne(query, update, upsert=upsert) for query, update in chunk],
+                    ordered=False
+                )
+            except errors.BulkWriteError as e:
+                # Unordered: every op without a write error was applied
+                failed = {error['index'] for error in e.details.get('writeErrors', [])}
+                applied.update(start + index for index in range(len(chunk)) if index not in failed)
+                raise
+            except Exception:
+                unknown.update(range(start, start + len(chunk)))
+                raise
+            applied.update(range(start, start + len(chunk)))
+            matched, modified = result.matched_count, result.modified_count
+            for index, _id in result.upserted_ids.items():
+                upserted[start + index] = _id
+        stats.add(collection.name, len(chunk), matched, modified,
+                  sum(1 for index in upserted if index >= start), time.perf_counter() - started)
+    return upserted
+
+def _unique_ops(ops):
+    """Drop all but the last op for each filter so one batch never races itself"""
+    unique = {}
+    for query, update in ops:
+        unique[tuple(sorted(query.items()))] = (query, update)
+    return list(unique.values())
+
+def _push_each(value):
+    # Only plain and $each pushes can be concatenated
+    if not isinstance(value, dict):
+        return [value]
+    if set(value) != {'$each'}:
+        raise ValueError(f"Cannot merge $push {value!r} into a buffered update")
+    return list(value['$each'])
+
+def _copy_update(update):
+    copy = {op: dict(fields) for op, fields in update.items()}
+    for path, value in copy.get('$push', {}).items():
+        copy['$push'][path] = {'$each': _push_each(value)}
+    return copy
+
+def _merge_update(update, newer):
+    """Fold ``newer`` into ``update`` in place, so that applying the result
+    once has the effect of applying both in order"""
+    for op, fields in newer.items():
+        target = update.setdefault(op, {})
+        for path, value in fields.items():
+            if op == '$set':
+                update.get('$unset', {}).pop(path, None)
+                target[path] = value
+            elif op == '$unset':
+                update.get('$set', {}).pop(path, None)
+                target[path] = value
+            elif op == '$setOnInsert':
+                target.setdefault(path, value)
+            elif op == '$inc':
+                target[path] = target.get(path, 0) + value
+            elif op == '$min':
+                target[path] = min(target[path], value) if path in target else value
+            elif op == '$max':
+                target[path] = max(target[path], value) if path in target else value
+            elif op == '$push':
+                target.setdefault(path, {'$each': []})['$each'].extend(_push_each(value))
+            else:
+                raise ValueError(f"Cannot merge {op} {value!r} into a buffered update")
+    for op in [op for op, fields in update.items() if not fields]:
+        del update[op]
+    return update
+
+def _is_idempotent(update):
+    """Whether applying ``update`` twice has the same effect as once"""
+    return all(op in ('$set', '$unset', '$setOnInsert', '$min', '$max') for op in update)
+
+WRITE_BUFFER_OPS = metrics.Counter(
+    'write_buffer_operations_total', "Updates through the write-behind buffer: queued, merged into a "
+    "pending update, written, failed and requeued, or dropped after a write with an unknown outcome",
+    ('result',)
+)
+WRITE_BUFFER_FLUSH = metrics.Histogram('write_buffer_flush_seconds', "Time to write one write-behind batch")
+WRITE_BUFFER_PENDING = metrics.Gauge(
+    'write_buffer_pending', "Documents with buffered updates",
+    callback=lambda: [({}, len(_write_buffer.pending))] if _write_buffer is not None else []
+)
+
+class WriteBuffer:
+    """Write-behind buffer for updates whose result nobody waits for.
+
+    Updates are queued per document, and a later update to a document that
+    is still pending is merged into it, so a page refreshed many times
+    between flushes is written once. A background thread writes everything
+    pending as unordered bulk batches every ``interval`` seconds, or as
+    soon as ``max_ops`` documents are pending; writers block once
+    ``max_pending`` are. Cache tags are invalidated and rollups recomputed
+    after the write that makes them stale. When a flush fails, the updates
+    that did not land are requeued in front of newer ones and retried on
+    the next flush.
+    """
+
+    def __init__(self, max_ops=None, interval=None, max_pending=None):
+        self.max_ops = max_ops or Config.WRITE_BEHIND_MAX_OPS
+        self.interval = interval or Config.WRITE_BEHIND_INTERVAL
+        self.max_pending = max_pending or Config.WRITE_BEHIND_MAX_PENDING
+        # (collection name, filter) -> [collection, filter, update, upsert]
+        self.pending = {}
+        # Entries of the flush in progress, still visible to pending_fields
+        self.flushing = {}
+        self.tags = set()
+        self.rollups = set()
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.closed = False
+        self.flushes = 0
+        self.written = 0
+        self.merged = 0
+        self.errors = 0
+        self.last_flush_seconds = None
+
+    def add(self, collection, ops, tags=(), rollups=(), upsert=True):
+        """Queue (filter, update) pairs for ``collection``; ``tags`` are
+        invalidated and the rollups of the ``rollups`` page ids recomputed
+        once they are written"""
+        with self.lock:
+            while len(self.pending) >= self.max_pending and not self.closed:
+                self.wake.set()
+                self.not_full.wait()
+            merged = self._queue([[collection, query, update, upsert] for query, update in ops])
+            self.merged += merged
+            self.tags.update(tags)
+            self.rollups.update(rollups)
+            full = len(self.pending) >= self.max_ops
+        WRITE_BUFFER_OPS.inc(len(ops) - merged, result='queued')
+        WRITE_BUFFER_OPS.inc(merged, result='merged')
+        if self.closed:
+            self.flush()
+            return
+        if full:
+            self.wake.set()
+        self._start()
+
+    def _queue(self, entries):
+        # Called with the lock held; returns how many entries were merged
+        merged = 0
+        for collection, query, update, upsert in entries:
+            key = (collection.name, tuple(sorted(query.items())))
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = [collection, query, _copy_update(update), upsert]
+                continue
+            _merge_update(entry[2], update)
+            entry[3] = entry[3] or upsert
+            merged += 1
+        return merged
+
+    def _start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while not self.closed:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Write-behind flush failed: {e}")
+
+    def flush(self):
+        """Write everything pending now; returns the number of documents written"""
+        with self.flush_lock:
+            with self.lock:
+                entries, tags, rollups = self.pending, self.tags, self.rollups
+                self.pending, self.tags, self.rollups = {}, set(), set()
+                self.flushing = entries
+                self.not_full.notify_all()
+            if not entries:
+                return 0
+
+            started = time.perf_counter()
+            groups = {}
+            for key, (collection, query, update, upsert) in entries.items():
+                group = groups.setdefault((collection.name, upsert), (collection, [], []))
+                group[1].append(key)
+                group[2].append((query, update))
+            landed, uncertain = set(), set()
+            try:
+                stats = IngestStats()
+                for (_, upsert), (collection, keys, ops) in groups.items():
+                    applied, unknown = set(), set()
+                    try:
+                        _bulk_upsert(collection, ops, stats, upsert=upsert, applied=applied, unknown=unknown)
+                    finally:
+                        landed.update(keys[index] for index in applied)
+                        uncertain.update(keys[index] for index in unknown)
+            except Exception as e:
+                # Updates that landed are not requeued: $inc and $push would apply
+                # twice. Where the outcome is unknown only idempotent updates are
+                # retried, the others are dropped rather than risk double counting
+                retry = {
+                    key: entry for key, entry in entries.items()
+                    if key not in landed and (key not in uncertain or _is_idempotent(entry[2]))
+                }
+                dropped = len(entries) - len(landed) - len(retry)
+                logging.error(f"Write-behind flush failed after {len(landed)} of {len(entries)} documents, "
+                              f"requeued {len(retry)}, dropped {dropped} with an unknown outcome: {e}")
+                with self.lock:
+                    newer, self.pending, self.flushing = self.pending, {}, {}
+                    self._queue(retry.values())
+                    self._queue(newer.values())
+                    self.tags.update(tags)
+                    self.rollups.update(rollups)
+                self.errors += 1
+                self.written += len(landed)
+                WRITE_BUFFER_OPS.inc(len(landed), result='written')
+                WRITE_BUFFER_OPS.inc(len(retry), result='failed')
+                WRITE_BUFFER_OPS.inc(dropped, result='dropped')
+                return len(landed)
+
+            with self.lock:
+                self.flushing = {}
+            elapsed = time.perf_counter() - started
+            WRITE_BUFFER_FLUSH.observe(elapsed)
+            WRITE_BUFFER_OPS.inc(len(entries), result='written')
+            self.flushes += 1
+            self.written += len(entries)
+            self.last_flush_seconds = round(elapsed, 6)
+            logging.debug(f"Write-behind flushed {len(entries)} documents in {elapsed * 1000:.1f}ms")
+            if rollups:
+                PageStats.refresh(rollups)
+            if tags:
+                invalidate(*tags)
+            return len(entries)
+
+    def pending_fields(self, collection, query):
+        """Fields set by updates to the document matching ``query`` that
+        are not written yet"""
+        key = (collection.name, tuple(sorted(query.items())))
+        fields = {}
+        with self.lock:
+            for entries in (self.flushing, self.pending):
+                entry = entries.get(key)
+                if entry is not None:
+                    fields.update(entry[2].get('$set', {}))
+        return fields
+
+    def close(self):
+        """Stop the flush thread and write what is still pending"""
+        self.closed = True
+        self.wake.set()
+        with self.lock:
+            self.not_full.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=self.interval + 5)
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+        return {
+            'pending': pending,
+            'flushes': self.flushes,
+            'written': self.written,
+            'merged': self.merged,
+            'errors': self.errors,
+            'last_flush_seconds': self.last_flush_seconds
+        }
+
+_write_buffer = None
+_write_buffer_lock = threading.Lock()
+
+def get_write_buffer():
+    """This process's WriteBuffer, or None unless WRITE_BEHIND is on"""
+    global _write_buffer
+    if Config.WRITE_BEHIND != 'on':
+        return None
+    if _write_buffer is None:
+        with _write_buffer_lock:
+            if _write_buffer is None:
+                _write_buffer = WriteBuffer()
+                atexit.register(_write_buffer.close)
+    return _write_buffer
+
+def flush_writes():
+    """Write buffered updates now, e.g. before reading them back"""
+    if _write_buffer is not None:
+        _write_buffer.flush()
+
+def _pending_fields(collection, query):
+    """Buffered fields of a document, to lay over a read of it before
+    comparing it with new data"""
+    return _write_buffer.pending_fields(collection, query) if _write_buffer is not None else {}
+
+def _write_behind(collection, ops, tags=(), rollups=(), upsert=True):
+    """Queue ops on the write buffer; False when write-behind is off"""
+    buffer = get_write_buffer()
+    if buffer is None:
+        return False
+    buffer.add(collection, ops, tags, rollups, upsert)
+    return True
+
+def ingest_posts(items, stats=None, batch_size=None, rollups=True):
+    """Upsert (page_id, post) pairs and the comments of those posts, then
+    recompute the rollups of their pages unless ``rollups`` is False"""
+    stats = stats or IngestStats()
+    if Post.collection is None or Comment.collection is None:
+        raise Exception("Database not initialized")
+    items = [(page_id, as_doc(post)) for page_id, post in items]
+
+    ops = _unique_ops([Post.upsert_op(page_id, post) for page_id, post in items])
+    upserted = _bulk_upsert(Post.collection, ops, stats, batch_size)
+
+    # A post's media are part of its key, so only new posts add references
+    inserted = {(ops[index][0]['page_id'], ops[index][0]['post_key']) for index in upserted}
+    media = []
+    for page_id, post in items:
+        key = (page_id, post.get('post_key') or Post.fingerprint(post))
+        count = 1 if key in inserted else 0
+        inserted.discard(key)
+        media.extend((url, count) for url in post.get('media_urls') or [])
+    Media.intern(media, stats, batch_size)
+
+    # Posts that already existed need one lookup per batch for their _id
+    post_ids = {(ops[index][0]['page_id'], ops[index][0]['post_key']): _id for index, _id in upserted.items()}
+    missing = [query for index, (query, _) in enumerate(ops) if index not in upserted]
+    if missing:
+        cursor = Post.collection.find({
+            'page_id': {'$in': list({query['page_id'] for query in missing})},
+            'post_key': {'$in': list({query['post_key'] for query in missing})}
+        }, {'page_id': 1, 'post_key': 1})
+        for doc in cursor:
+            post_ids.setdefault((doc['page_id'], doc['post_key']), doc['_id'])
+
+    comment_ops, searchable = [], []
+    for page_id, post in items:
+        post_id = post_ids.get((page_id, post.get('post_key') or Post.fingerprint(post)))
+        searchable.append({'_id': post_id, 'content': post.get('content')})
+        for comment in post.get('comments') or []:
+            comment_ops.append(Comment.upsert_op(page_id, post_id, comment))
+    _bulk_upsert(Comment.collection, _unique_ops(comment_ops), stats, batch_size)
+    Search.index_posts(searchable)
+    page_ids = list(dict.fromkeys(page_id for page_id, _ in items))
+    if rollups:
+        PageStats.refresh(page_ids, batch_size)
+    invalidate(*(page_tag(page_id) for page_id in page_ids))
+    return stats
+
+def ingest_followers(items, stats=None, batch_size=None):
+    """Upsert (page_id, follower) pairs, through the write buffer when
+    write-behind is on"""
+    stats = stats or IngestStats()
+    if Follower.collection is None:
+        raise Exception("Database not initialized")
+    items = [(page_id, as_doc(follower)) for page_id, follower in items]
+    ops = _unique_ops([Follower.upsert_op(page_id, follower) for page_id, follower in items])
+    media, released = Follower.picture_refs(ops, {
+        Media.key(follower.get('profile_pic')): follower.get('profile_pic') for _, follower in items
+    })
+    if not _write_behind(Follower.collection, ops):
+        _bulk_upsert(Follower.collection, ops, stats, batch_size)
+    Media.intern(media, stats, batch_size)
+    Media.release(released, stats, batch_size)
+    return stats
+
+def ingest(results, batch_size=None, stats=None):
+    """Store scrape results, dicts or records.Page, normalized into the
+    pages, posts, comments and followers collections.
+
+    Every document is written with an upsert keyed on its natural key
+    (username, page_id + post_key, post_id + comment_key, page_id +
+    follower_id), so re-scrapes and repeated imports are idempotent. Writes
+    go out as unordered bulk batches of ``batch_size`` operations. Returns
+    an IngestStats with per-batch counters and the page ids by username.
+    """
+    if Page.collection is None:
+        raise Exception("Database not initialized")
+    batch_size = batch_size or Config.INGEST_BATCH_SIZE
+    stats = stats or IngestStats()
+    results = [as_doc(page_data) for page_data in results if page_data]
+
+    for start in range(0, len(results), batch_size):
+        group = results[start:start + batch_size]
+        ops = _unique_ops([Page.upsert_op(page_data) for page_data in group])
+        upserted = _bulk_upsert(Page.collection, ops, stats, batch_size)
+
+        page_ids = {ops[index][0]['username']: _id for index, _id in upserted.items()}
+        missing = [query['username'] for index, (query, _) in enumerate(ops) if index not in upserted]
+        if missing:
+            for doc in Page.collection.find({'username': {'$in': missing}}, {'username': 1}):
+                page_ids[doc['username']] = doc['_id']
+        stats.page_ids.update(page_ids)
+        written = [dict(page_data, _id=page_ids[page_data['username']]) for page_data in group]
+        Search.index_pages(written)
+        TopPages.update(written)
+        invalidate(PAGES_TAG, *(page_tag(page_id) for page_id in page_ids.values()))
+
+        ingest_posts([
+            (page_ids[page_data['username']], post)
+            for page_data in group for post in page_data.get('posts') or []
+        ], stats, batch_size, rollups=False)
+        ingest_followers([
+            (page_ids[page_data['username']], follower)
+            for page_data in group for follower in page_data.get('followers') or []
+        ], stats, batch_size)
+        # Follower counts may have changed even for pages without new posts
+        PageStats.refresh(page_ids.values(), batch_size)
+        PageHistory.record([
+            (page_ids[page_data['username']], page_data.get('scraped_at') or datetime.utcnow(),
+             page_data.get('follower_count'), page_data.get('likes_count'))
+            for page_data in group
+        ], stats, batch_size)
+
+    return stats
+
+def ingest_scrape(username, batches, batch_size=None):
+    """Store the output of FacebookScraper.iter_scrape batch by batch.
+
+    Posts and followers are written as they arrive, against a page
+    document created for ``username`` if it does not exist yet; the page's
+    own fields, rollups and history are written by ingest once the final
+    ('page', Page) item arrives. A page created here is marked ``partial``
+    until then, so a download that never finishes does not leave a page
+    that lookups serve; the next scrape completes it. Returns an IngestStats.
+    """
+    if Page.collection is None:
+        raise Exception("Database not initialized")
+    stats = IngestStats()
+    page_id = None
+    for kind, records in batches:
+        if kind == 'page':
+            ingest([records], batch_size, stats)
+            continue
+        if page_id is None:
+            page_id = Page.collection.find_one_and_update(
+                {'username': username},
+                {'$setOnInsert': {'created_at': datetime.utcnow(), 'partial': True}},
+                projection={'_id': 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )['_id']
+            stats.page_ids[username] = page_id
+        if kind == 'posts':
+            ingest_posts([(page_id, post) for post in records], stats, batch_size, rollups=False)
+        else:
+            ingest_followers([(page_id, follower) for follower in records], stats, batch_size)
+    return stats
@@ -0,0 +1,205 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+from datetime import datetime
+from metrics import Counter
+from scraper import parse_page
+import bson
+import gzip
+import logging
+import multiprocessing
+import os
+import threading
+
+DUMP_SUFFIXES = ('.html.gz', '.htm.gz', '.html', '.htm')
+
+PARSE_CRASHES = Counter('parse_worker_crashes_total', "Parser processes that died while parsing")
+
+
+def encode_page(page_data, batch_size=None):
+    """Split a scraped page dict into BSON chunks: the page fields first,
+    then its posts and followers ``batch_size`` at a time.
+
+    Chunks are plain bytes, so results cross the process boundary as a few
+    buffers instead of a pickled tree of small objects, and no single chunk
+    grows with the page.
+    """
+    batch_size = batch_size or Config.SCRAPE_BATCH_SIZE
+    page = dict(page_data)
+    posts = page.pop('posts', [])
+    followers = page.pop('followers', None) or []
+    chunks = [bson.encode(page)]
+    for key, items in (('posts', posts), ('followers', followers)):
+        for start in range(0, len(items), batch_size):
+            chunks.append(bson.encode({key: items[start:start + batch_size]}))
+    return chunks
+
+
+def decode_page(chunks):
+    """Reassemble the page dict from encode_page chunks"""
+    page = bson.decode(chunks[0])
+    page['posts'] = []
+    for chunk in chunks[1:]:
+        for key, items in bson.decode(chunk).items():
+            page.setdefault(key, []).extend(items)
+    return page
+
+
+def username_for(path):
+    """Username of a dump saved as <username>.html, .htm or .html.gz"""
+    name = os.path.basename(path)
+    for suffix in DUMP_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def parse_body(username, url, body, encoding=None, parser='html.parser', batch_size=None):
+    """Worker entry point: extract a downloaded page into encode_page chunks"""
+    return encode_page(parse_page(username, url, body, encoding, parser), batch_size)
+
+
+def parse_file(path, base_url=None, parser='html.parser', batch_size=None):
+    """Worker entry point: extract a saved page dump into encode_page chunks.
+
+    The file is read in the worker, so only its path is sent over, and the
+    page is dated by the file's modification time.
+    """
+    username = username_for(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        body = f.read()
+    url = f"{(base_url or Config.SCRAPER_BASE_URL).rstrip('/')}/{username}"
+    scraped_at = datetime.utcfromtimestamp(os.path.getmtime(path))
+    return encode_page(parse_page(username, url, body, None, parser, scraped_at), batch_size)
+
+
+def _context():
+    # Forking a process that runs threads can copy locks in a held state,
+    # so start workers from a clean server process where available
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['parsing'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+class _Workers:
+    """A ProcessPoolExecutor, started on first use and replaced once one of
+    its processes has died"""
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.processes, mp_context=_context())
+            return self.executor
+
+    def discard(self, broken):
+        """Drop ``broken`` unless another thread already has"""
+        with self.lock:
+            if self.executor is broken:
+                PARSE_CRASHES.inc()
+                logging.error("A parser process died, restarting the parser pool")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+    def submit(self, fn, *args):
+        """``(executor, future)`` for ``fn(*args)``, on a fresh pool if the current one is broken"""
+        executor = self.get()
+        try:
+            return executor, executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self.discard(executor)
+        executor = self.get()
+        return executor, executor.submit(fn, *args)
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+
+
+class ParsePool:
+    """Run HTML parsing in a pool of worker processes.
+
+    Calls block once ``max_pending`` parses are in flight, so fetching
+    threads slow down to the speed of the parsers instead of queueing
+    bodies in memory.
+
+    A parser process that dies (a crash in a C extension, an OOM kill)
+    breaks every parse in flight on the pool. The pool is replaced, and
+    each of those parses is retried on its own in a separate one-process
+    pool: the others succeed, and the document that kills its parser fails
+    alone with BrokenProcessPool instead of taking the run down.
+    """
+
+    def __init__(self, processes=None, max_pending=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.max_pending = max_pending or self.processes * Config.PARSE_MAX_PENDING
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.workers = _Workers(self.processes)
+        self.quarantine = _Workers(1)
+        self.retry_lock = threading.Lock()
+
+    def run(self, fn, *args):
+        """``fn(*args)`` in a worker process; safe to call from many threads"""
+        with self.slots:
+            executor, future = self.workers.submit(fn, *args)
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                self.workers.discard(executor)
+            return self._retry(fn, *args)
+
+    def imap(self, fn, items):
+        """Yield ``(item, result)`` for ``fn(item)`` over ``items`` in
+        completion order, with at most ``max_pending`` calls in flight.
+        ``result`` is the exception when a call failed."""
+        items = iter(items)
+        pending = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.max_pending:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                    break
+                executor, future = self.workers.submit(fn, item)
+                pending[future] = (item, executor)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item, executor = pending.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    self.workers.discard(executor)
+                    try:
+                        result = self._retry(fn, item)
+                    except Exception as e:
+                        result = e
+                except Exception as e:
+                    result = e
+                yield item, result
+
+    def _retry(self, fn, *args):
+        # One at a time, away from the main pool, so a repeat crash only
+        # costs this call
+        with self.retry_lock:
+            executor, future = self.quarantine.submit(fn, *args)
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                self.quarantine.discard(executor)
+                raise
+
+    def close(self):
+        self.workers.close()
+        self.quarantine.close()
@@ -0,0 +1,74 @@
+import bisect
+
+def rank_key(value, doc_id):
+    """Sort key of a document in (value desc, _id desc) order as MongoDB
+    sorts it, where a missing or null value ranks below every number"""
+    return (value is not None, value if value is not None else 0, doc_id)
+
+class TopN:
+    """The ``size`` highest ranked documents of a set, by rank_key.
+
+    The entries are always an exact prefix of the set's full ranking: a
+    document that drops below the last entry is removed instead of kept
+    out of order, and one that ranks below it is only added when the list
+    holds the whole set (``complete``). Not thread-safe.
+    """
+
+    def __init__(self, size, entries=(), complete=False):
+        entries = sorted(entries)
+        self.size = size
+        # Ascending, so the lowest ranked entry is first
+        self.entries = entries[-size:] if size else []
+        self.keys = {key[-1]: key for key in self.entries}
+        self.complete = complete and len(self.entries) == len(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.keys
+
+    def remove(self, doc_id):
+        key = self.keys.pop(doc_id, None)
+        if key is not None:
+            del self.entries[bisect.bisect_left(self.entries, key)]
+
+    def update(self, doc_id, value):
+        """Move a document to its new ``value``; returns the id of the
+        document that dropped off the end to make room, if any"""
+        self.remove(doc_id)
+        key = rank_key(value, doc_id)
+        if not self.complete and (not self.entries or key < self.entries[0]):
+            return None
+        bisect.insort(self.entries, key)
+        self.keys[doc_id] = key
+        if len(self.entries) <= self.size:
+            return None
+        self.complete = False
+        dropped = self.entries.pop(0)[-1]
+        del self.keys[dropped]
+        return dropped
+
+    def window(self, low=None, high=None, after=None, offset=0, limit=10):
+        """Ids of the documents ranked ``offset`` to ``offset + limit``
+        among those with ``low <= value <= high`` that rank below the
+        ``after`` key, or None when the entries cannot tell"""
+        ids = []
+        stop = len(self.entries)
+        if after is not None:
+            stop = bisect.bisect_left(self.entries, after)
+        # Like MongoDB range operators, bounds (and a cursor past a value) never match null
+        bounded = low is not None or high is not None or (after is not None and after[0])
+        for index in range(stop - 1, -1, -1):
+            has_value, value, doc_id = self.entries[index]
+            # Everything further down ranks lower still
+            if bounded and not has_value:
+                return ids[offset:]
+            if low is not None and value < low:
+                return ids[offset:]
+            if high is not None and value > high:
+                continue
+            ids.append(doc_id)
+            if len(ids) >= offset + limit:
+                return ids[offset:]
+        return ids[offset:] if self.complete else None
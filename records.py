@@ -0,0 +1,109 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+# Compact records for scrape results. Slotted instances have no per-object
+# __dict__, and to_doc() returns the plain dict stored in MongoDB, with the
+# same keys scrape_page() has always produced.
+
+@dataclass(slots=True)
+class Author:
+    name: Optional[str] = None
+    profile_url: Optional[str] = None
+
+    def to_doc(self):
+        return {'name': self.name, 'profile_url': self.profile_url}
+
+@dataclass(slots=True)
+class Comment:
+    content: str
+    created_at: datetime
+    author: Optional[Author] = None
+
+    def to_doc(self):
+        return {
+            'content': self.content,
+            'created_at': self.created_at,
+            'author': self.author.to_doc() if self.author else None
+        }
+
+@dataclass(slots=True)
+class Post:
+    content: Optional[str]
+    created_at: Optional[datetime]
+    likes_count: int = 0
+    shares_count: int = 0
+    comments: list = field(default_factory=list)
+    media_urls: list = field(default_factory=list)
+
+    def to_doc(self):
+        return {
+            'content': self.content,
+            'created_at': self.created_at,
+            'likes_count': self.likes_count,
+            'comments': [comment.to_doc() for comment in self.comments],
+            'shares_count': self.shares_count,
+            'media_urls': list(self.media_urls)
+        }
+
+@dataclass(slots=True)
+class Follower:
+    name: Optional[str]
+    profile_pic: Optional[str]
+    profile_url: Optional[str]
+    created_at: datetime
+
+    def to_doc(self):
+        return {
+            'name': self.name,
+            'profile_pic': self.profile_pic,
+            'profile_url': self.profile_url,
+            'created_at': self.created_at
+        }
+
+@dataclass(slots=True)
+class Page:
+    username: str
+    url: str
+    scraped_at: datetime
+    name: Optional[str] = None
+    profile_pic: Optional[str] = None
+    email: Optional[str] = None
+    website: Optional[str] = None
+    category: Optional[str] = None
+    follower_count: int = 0
+    likes_count: int = 0
+    creation_date: Optional[datetime] = None
+    about: Optional[str] = None
+    posts: list = field(default_factory=list)
+    followers: list = field(default_factory=list)
+    # Conditional fetch validators, set by the scraper
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+
+    def to_doc(self):
+        doc = {
+            'username': self.username,
+            'url': self.url,
+            'scraped_at': self.scraped_at,
+            'name': self.name,
+            'profile_pic': self.profile_pic,
+            'email': self.email,
+            'website': self.website,
+            'category': self.category,
+            'follower_count': self.follower_count,
+            'likes_count': self.likes_count,
+            'creation_date': self.creation_date,
+            'about': self.about,
+            'posts': [post.to_doc() for post in self.posts]
+        }
+        if self.followers:
+            doc['followers'] = [follower.to_doc() for follower in self.followers]
+        if self.content_hash is not None:
+            doc.update(etag=self.etag, last_modified=self.last_modified, content_hash=self.content_hash)
+        return doc
+
+def as_doc(value):
+    """The stored dict for a record; dicts are returned unchanged"""
+    return value.to_doc() if hasattr(value, 'to_doc') else value
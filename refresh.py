@@ -0,0 +1,61 @@
+import requests
+from models import Page, PageHistory, Post, ingest, ingest_followers
+from scraper import FacebookScraper, NOT_MODIFIED
+import logging
+
+# Stored page fields needed to decide on and apply an incremental refresh
+REFRESH_PROJECTION = dict.fromkeys(Page.SCRAPED_FIELDS + Page.VALIDATOR_FIELDS, 1)
+
+def get_validators(page):
+    """Conditional fetch validators stored on a page document"""
+    if not page:
+        return None
+    return {field: page.get(field) for field in Page.VALIDATOR_FIELDS}
+
+def apply_refresh(page, page_data):
+    """Write only what changed between a stored page and a fresh scrape.
+
+    Changed page fields are set in place, new posts are inserted and known
+    posts only get their changed metrics updated. Returns 'updated' or
+    'unchanged'.
+    """
+    changes = Page.changed_fields(page, page_data)
+    inserted, updated = Post.sync_page_posts(page['_id'], page_data.get('posts', []))
+    ingest_followers([(page['_id'], follower) for follower in page_data.get('followers') or []])
+    PageHistory.record([
+        (page['_id'], page_data['scraped_at'], page_data.get('follower_count'), page_data.get('likes_count'))
+    ])
+    status = 'updated' if changes or inserted or updated else 'unchanged'
+
+    # Validators always move forward so the next refresh compares against this body
+    changes.update({field: page_data.get(field) for field in Page.VALIDATOR_FIELDS})
+    changes['scraped_at'] = page_data['scraped_at']
+    Page.update_fields(page['_id'], changes)
+    logging.debug(f"Refreshed {page_data['username']}: {status}, {inserted} new posts, {updated} updated posts")
+    return status
+
+def refresh_page(username, scraper=None, raise_errors=False):
+    """Refresh one page incrementally, scraping it in full if it is not stored yet.
+
+    Returns 'created', 'updated', 'unchanged', 'not_modified' or 'not_found'.
+    Scrape failures count as 'not_found' unless ``raise_errors`` is set.
+    """
+    scraper = scraper or FacebookScraper()
+    page = Page.find_by_username(username, REFRESH_PROJECTION)
+    if raise_errors:
+        try:
+            page_data = scraper.fetch_page(username, get_validators(page))
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return 'not_found'
+            raise
+    else:
+        page_data = scraper.scrape_page(username, get_validators(page))
+    if page_data is NOT_MODIFIED:
+        return 'not_modified'
+    if not page_data:
+        return 'not_found'
+    if page is None:
+        ingest([page_data])
+        return 'created'
+    return apply_refresh(page, page_data)
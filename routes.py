@@ -1,49 +1,275 @@
-from flask import Blueprint, jsonify, request
-from models import Page, Post
-from scraper import FacebookScraper
-from flask_caching import Cache
+from flask import Blueprint, Response, jsonify, request, stream_with_context, url_for
+from models import Job, Lock, Media, Page, PageHistory, PageStats, Post, Search, database_stats, ingest
+from scheduler import record_scrape, record_views
+from caching import LEADERBOARD_TAG, PAGES_TAG, get_cache, page_tag, query_key
 from config import Config
+from utils import SingleFlight, json_encoder
+from metrics import span
+import http_cache
+from datetime import datetime, timedelta, timezone
 import logging
+import time
 
 api = Blueprint('api', __name__)
 cache = None
+# One in-flight scrape per username within this process
+scrape_flight = SingleFlight()
 
 def init_cache(app):
     global cache
-    cache = Cache(app)
+    cache = get_cache()
     return cache
 
-@api.route('/api/page/<username>')
-def get_page(username):
-    if cache:
-        # Only use cache if it's properly initialized
-        cached_result = cache.get(f'page_{username}')
-        if cached_result:
-            return jsonify(cached_result)
+def _cached(key, loader, tags=()):
+    """``loader()`` through the cache when it is initialized"""
+    def load():
+        with span('db'):
+            return loader()
+
+    if cache is None:
+        return load()
+    with span('cache'):
+        return cache.get_or_load(key, load, tags=tags)
+
+def _cached_json(key, loader, tags=(), max_age=None, view=None):
+    """Conditional JSON response for ``loader()``, cached already encoded,
+    or None when it returns None.
+
+    The cache holds the serialized body with its compressed variants and
+    ETag, so a hit is answered without serializing anything and a request
+    whose If-None-Match matches gets a 304. ``view`` shapes the loaded
+    value into the response body; ``tags`` may be a function of the
+    loaded value.
+    """
+    def load():
+        value = loader()
+        if value is None:
+            return None
+        entry = http_cache.encode(view(value) if view else value)
+        entry['tags'] = tuple(tags(value) if callable(tags) else tags)
+        return entry
+
+    entry = _cached(key, load, tags=lambda entry: entry['tags'])
+    if entry is None:
+        return None
+    return http_cache.respond(entry, max_age)
+
+def _wait_for_scrape(username, lock_name):
+    """Wait for another worker's scrape of ``username`` to land"""
+    deadline = time.monotonic() + Config.SCRAPE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        page = Page.find_by_username(username)
+        if page or not Lock.is_held(lock_name):
+            return page
+        time.sleep(Config.SCRAPE_LOCK_POLL_INTERVAL)
+    return Page.find_by_username(username)
+
+def scrape_and_store(username):
+    """Scrape and store a page, holding a database lease so that only one
+    worker process scrapes a given username at a time"""
+    lock_name = f'scrape:{username}'
+    token = Lock.acquire(lock_name, Config.SCRAPE_LOCK_TTL)
+    if token is None:
+        return _wait_for_scrape(username, lock_name)
 
     try:
+        # The previous lease holder may have finished just before we got ours
         page = Page.find_by_username(username)
+        if page:
+            return page
+
+        # requests and bs4 are only loaded once a worker first has to scrape
+        from scraper import FacebookScraper
+        scraper = FacebookScraper()
+        page_data = scraper.scrape_page(username)
+        if not page_data:
+            return None
+
+        ingest([page_data])
+        try:
+            record_scrape(username, 'created')
+        except Exception as e:
+            logging.error(f"Failed to schedule refreshes of {username}: {e}")
+        return Page.find_by_username(username)
+    finally:
+        Lock.release(lock_name, token)
+
+def _job_response(job):
+    """202 response pointing at a queued job"""
+    response = jsonify({'job_id': job['_id'], 'status': job['status']})
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_job', job_id=str(job['_id']))
+    return response
 
-        if not page:
-            # Try to scrape the page
-            scraper = FacebookScraper()
-            page_data = scraper.scrape_page(username)
-
-            if page_data:
-                page_id = Page.create(page_data)
-                if 'posts' in page_data:
-                    Post.create_many(page_data['posts'])
-                page = Page.find_by_username(username)
-            else:
+def _recently_not_found(username):
+    """Whether the last scrape of ``username`` found no page upstream"""
+    return _is_not_found(Job.latest(username))
+
+def _is_not_found(job):
+    """Whether ``job`` is a recent scrape that found no page upstream"""
+    return bool(
+        job and job['status'] == 'done' and job.get('result') == 'not_found'
+        and job['finished_at'] > datetime.utcnow() - timedelta(seconds=Config.JOB_NOT_FOUND_TTL)
+    )
+
+def _page_response(page):
+    """Conditional response for a stored page, with the same ETag whether
+    it came from the cache or was just scraped"""
+    modified = page.get('updated_at') or page.get('scraped_at')
+    etag = http_cache.etag_for(page['_id'], modified) if modified else http_cache.encode(page)['etag']
+    return http_cache.conditional(
+        etag, Config.HTTP_MAX_AGE['page'], lambda: jsonify(page), last_modified=modified
+    )
+
+@api.route('/api/page/<username>')
+def get_page(username):
+    try:
+        page = _cached(
+            f'page:{username}',
+            lambda: Page.find_by_username(username),
+            tags=lambda page: (page_tag(page['_id']),)
+        )
+        if page:
+            record_views((username,))
+            return _page_response(page)
+
+        if Config.SCRAPE_MODE == 'inline':
+            page = scrape_flight.do(username, lambda: scrape_and_store(username))
+            if not page:
                 return jsonify({'error': 'Page not found'}), 404
+            return _page_response(page)
 
-        if cache:
-            cache.set(f'page_{username}', page, timeout=300)
-        return jsonify(page)
+        if _recently_not_found(username):
+            return jsonify({'error': 'Page not found'}), 404
+        return _job_response(Job.enqueue('scrape', username, priority=Config.JOB_PRIORITY_INTERACTIVE))
     except Exception as e:
         logging.error(f"Error getting page {username}: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@api.route('/api/pages/batch', methods=['POST'])
+def get_pages_batch():
+    """Pages for a list of usernames in one request.
+
+    Takes ``{"usernames": [...], "scrape": false}``. Cached pages come from
+    one cache multi-get and the rest from one database query. With
+    ``scrape`` set, unknown pages are queued for scraping, or with
+    SCRAPE_MODE=inline the first BATCH_INLINE_SCRAPES of them are scraped
+    during the request. Returns ``{"pages": {username: page or null},
+    "jobs": {username: {"job_id", "status"}}, "unscraped": [username]}``,
+    where unscraped lists the unknown pages an inline request left alone.
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        usernames = body.get('usernames')
+        if not isinstance(usernames, list) or not all(isinstance(u, str) and u.strip() for u in usernames):
+            return jsonify({'error': 'usernames must be a list of usernames'}), 400
+        usernames = list(dict.fromkeys(u.strip() for u in usernames))
+        if not usernames or len(usernames) > Config.BATCH_MAX_USERNAMES:
+            return jsonify({'error': f'Pass 1 to {Config.BATCH_MAX_USERNAMES} usernames'}), 400
+
+        def load(keys):
+            with span('db'):
+                pages = Page.find_by_usernames(key[len('page:'):] for key in keys)
+            return {f"page:{username}": page for username, page in pages.items()}
+
+        keys = [f'page:{username}' for username in usernames]
+        if cache is None:
+            found = load(keys)
+        else:
+            with span('cache'):
+                found = cache.get_or_load_many(keys, load, tags=lambda page: (page_tag(page['_id']),))
+        pages = {username: found.get(f'page:{username}') for username in usernames}
+        record_views(username for username, page in pages.items() if page)
+
+        jobs = {}
+        unscraped = []
+        unknown = [username for username, page in pages.items() if page is None]
+        if unknown and body.get('scrape') and Config.SCRAPE_MODE == 'inline':
+            # Each scrape holds up the whole response, so only a few run
+            unscraped = unknown[Config.BATCH_INLINE_SCRAPES:]
+            for username in unknown[:Config.BATCH_INLINE_SCRAPES]:
+                try:
+                    pages[username] = scrape_flight.do(username, lambda: scrape_and_store(username))
+                except Exception as e:
+                    logging.error(f"Error scraping {username} for pages batch: {e}")
+                    unscraped.append(username)
+        elif unknown and body.get('scrape'):
+            latest = Job.latest_many(unknown)
+            for username in unknown:
+                if _is_not_found(latest.get(username)):
+                    continue
+                job = Job.enqueue('scrape', username, priority=Config.JOB_PRIORITY_INTERACTIVE)
+                jobs[username] = {'job_id': job['_id'], 'status': job['status']}
+        return jsonify({'pages': pages, 'jobs': jobs, 'unscraped': unscraped})
+    except Exception as e:
+        logging.error(f"Error getting pages batch: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/api/page/<username>/refresh', methods=['POST'])
+def queue_refresh(username):
+    try:
+        return _job_response(Job.enqueue('refresh', username, priority=Config.JOB_PRIORITY_INTERACTIVE))
+    except Exception as e:
+        logging.error(f"Error queueing refresh of {username}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    try:
+        job = Job.find(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        return http_cache.cache_headers(jsonify(job), None)
+    except Exception as e:
+        logging.error(f"Error getting job {job_id}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def _requested_fields():
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+def _streaming():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+def _expand_media():
+    return 'media' in request.args.get('expand', '').split(',')
+
+def _expanded(posts, batch_size=100):
+    """Posts with their media URLs, resolved one batch at a time"""
+    batch = []
+    for post in posts:
+        batch.append(post)
+        if len(batch) >= batch_size:
+            yield from Media.expand(batch)
+            batch = []
+    yield from Media.expand(batch)
+
+def _list_body(key, cursor, next_cursor):
+    docs = list(cursor)
+    return {key: docs, 'next_cursor': next_cursor(docs[-1] if docs else None, len(docs))}
+
+def _stream_response(key, cursor, next_cursor):
+    """Respond with ``{key: [...], 'next_cursor': ...}`` for a Mongo cursor,
+    encoding and sending documents as the cursor yields them instead of
+    buffering; ``next_cursor(last, count)`` is called once the cursor is
+    exhausted."""
+    def generate():
+        count, last = 0, None
+        yield '{"%s":[' % key
+        try:
+            for doc in cursor:
+                yield (',' if count else '') + json_encoder.encode(doc)
+                count, last = count + 1, doc
+        except Exception as e:
+            # Headers are already sent, so the truncated body is all we can signal
+            logging.error(f"Error streaming {key}: {e}")
+            raise
+        yield '],"next_cursor":%s}' % json_encoder.encode(next_cursor(last, count))
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 @api.route('/api/pages')
 def get_pages():
     try:
@@ -52,18 +278,37 @@ def get_pages():
         min_followers = request.args.get('min_followers', type=int)
         max_followers = request.args.get('max_followers', type=int)
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-
-        pages = Page.find_by_filters(
-            name=name,
-            category=category,
-            min_followers=min_followers,
-            max_followers=max_followers,
-            page=page,
-            per_page=per_page
-        )
+        per_page = request.args.get('per_page', Config.DEFAULT_PAGE_SIZE, type=int)
+        cursor = request.args.get('cursor')
+        sort = request.args.get('sort', 'follower_count')
+        fields = _requested_fields()
+
+        def find():
+            return Page.find_by_filters(
+                name=name,
+                category=category,
+                min_followers=min_followers,
+                max_followers=max_followers,
+                page=page,
+                per_page=per_page,
+                cursor=cursor,
+                sort=sort,
+                fields=fields
+            )
 
-        return jsonify({'pages': list(pages)})
+        def next_cursor(last, count):
+            return Page.next_cursor(last, count, per_page, sort)
+
+        if _streaming():
+            return _stream_response('pages', find(), next_cursor)
+        return _cached_json(
+            query_key('pages', request.args, ignore=('stream',)),
+            lambda: _list_body('pages', find(), next_cursor),
+            tags=(PAGES_TAG,),
+            max_age=Config.HTTP_MAX_AGE['pages']
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error getting pages: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -71,14 +316,187 @@ def get_pages():
 @api.route('/api/page/<username>/posts')
 def get_page_posts(username):
     try:
-        page = Page.find_by_username(username)
-        if not page:
-            return jsonify({'error': 'Page not found'}), 404
+        limit = max(1, min(request.args.get('limit', 15, type=int), Config.MAX_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        fields = _requested_fields()
+        # Read here, as load() may run on a revalidation thread outside the request
+        expand = _expand_media()
+
+        def find(page_id):
+            return Post.find_by_page(page_id, limit=limit, cursor=cursor, fields=fields)
+
+        def next_cursor(last, count):
+            return Post.next_cursor(last, count, limit)
 
-        limit = request.args.get('limit', 15, type=int)
-        posts = Post.find_by_page(page['_id'], limit=limit)
+        def load():
+            page = Page.find_by_username(username, {'_id': 1})
+            if not page:
+                return None
+            body = _list_body('posts', find(page['_id']), next_cursor)
+            if expand:
+                body['posts'] = Media.expand(body['posts'])
+            return dict(body, page_id=page['_id'])
 
-        return jsonify({'posts': list(posts)})
+        if _streaming():
+            page = Page.find_by_username(username, {'_id': 1})
+            if not page:
+                return jsonify({'error': 'Page not found'}), 404
+            posts = find(page['_id'])
+            return _stream_response('posts', _expanded(posts) if expand else posts, next_cursor)
+
+        response = _cached_json(
+            query_key(f'posts:{username}', request.args, ignore=('stream',)),
+            load,
+            tags=lambda body: (page_tag(body['page_id']),),
+            max_age=Config.HTTP_MAX_AGE['posts'],
+            view=lambda body: {'posts': body['posts'], 'next_cursor': body['next_cursor']}
+        )
+        if response is None:
+            return jsonify({'error': 'Page not found'}), 404
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error getting posts for page {username}: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/api/media/resolve', methods=['POST'])
+def resolve_media():
+    """URLs for media ids from posts' ``media_ids`` and followers'
+    ``profile_pic_id``.
+
+    Takes ``{"ids": [...]}`` and returns ``{"media": {id: url or null}}``
+    with the latest URL each medium was seen under.
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        ids = body.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(media_id, str) for media_id in ids):
+            return jsonify({'error': 'ids must be a list of media ids'}), 400
+        ids = list(dict.fromkeys(ids))
+        if not ids or len(ids) > Config.MEDIA_RESOLVE_MAX:
+            return jsonify({'error': f'Pass 1 to {Config.MEDIA_RESOLVE_MAX} ids'}), 400
+        with span('db'):
+            urls = Media.resolve(ids)
+        return jsonify({'media': {media_id: urls.get(media_id) for media_id in ids}})
+    except Exception as e:
+        logging.error(f"Error resolving media: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/api/page/<username>/stats')
+def get_page_stats(username):
+    try:
+        def load():
+            page = Page.find_by_username(username, {'_id': 1})
+            if not page:
+                return None
+            stats = PageStats.find_by_page(page['_id'])
+            if stats is None:
+                # Pages stored before rollups existed get theirs on first request
+                PageStats.refresh([page['_id']])
+                stats = PageStats.find_by_page(page['_id'])
+            return stats
+
+        response = _cached_json(
+            f'stats:{username}', load,
+            tags=lambda stats: (page_tag(stats['page_id']),),
+            max_age=Config.HTTP_MAX_AGE['stats']
+        )
+        if response is None:
+            return jsonify({'error': 'Page not found'}), 404
+        return response
+    except Exception as e:
+        logging.error(f"Error getting stats for page {username}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def _datetime_arg(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name} date {value!r}")
+    # History timestamps are stored as naive UTC
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@api.route('/api/page/<username>/history')
+def get_page_history(username):
+    try:
+        end = _datetime_arg('to', datetime.utcnow())
+        start = _datetime_arg('from', end - timedelta(days=Config.HISTORY_DEFAULT_RANGE_DAYS))
+        resolution = request.args.get('resolution') or None
+        if resolution is not None and resolution not in PageHistory.RESOLUTIONS:
+            raise ValueError(f"Unsupported resolution {resolution!r}")
+
+        def load():
+            page = Page.find_by_username(username, {'_id': 1})
+            if not page:
+                return None
+            resolution_used, points = PageHistory.find_range(page['_id'], start, end, resolution)
+            return {'page_id': page['_id'], 'resolution': resolution_used, 'points': points}
+
+        response = _cached_json(
+            query_key(f'history:{username}', request.args), load,
+            tags=lambda history: (page_tag(history['page_id']),),
+            max_age=Config.HTTP_MAX_AGE['history'],
+            view=lambda history: {'resolution': history['resolution'], 'points': history['points']}
+        )
+        if response is None:
+            return jsonify({'error': 'Page not found'}), 404
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error getting history for page {username}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/api/search')
+def search():
+    try:
+        query = request.args.get('q', '')
+        if not query.strip():
+            return jsonify({'error': 'Missing search query'}), 400
+        types = request.args.get('type')
+        types = [kind.strip() for kind in types.split(',') if kind.strip()] if types else Search.TYPES
+        limit = request.args.get('limit', Config.DEFAULT_PAGE_SIZE, type=int)
+        # Not cached server side, but a client polling the same query still gets 304s
+        entry = http_cache.encode({'results': Search.query(query, types, limit)})
+        return http_cache.respond(entry, Config.HTTP_MAX_AGE['search'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error searching for {request.args.get('q')!r}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/api/leaderboard')
+def get_leaderboard():
+    try:
+        metric = request.args.get('metric', 'engagement_rate')
+        limit = request.args.get('limit', Config.DEFAULT_PAGE_SIZE, type=int)
+
+        def load():
+            return {'metric': metric, 'pages': list(PageStats.leaderboard(metric, limit))}
+
+        return _cached_json(
+            query_key('leaderboard', request.args), load,
+            tags=(LEADERBOARD_TAG,),
+            max_age=Config.HTTP_MAX_AGE['leaderboard']
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error getting leaderboard: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/api/admin/db')
+def get_database_stats():
+    return http_cache.cache_headers(jsonify(database_stats()), None)
+
+@api.route('/api/cache/stats')
+def get_cache_stats():
+    if cache is None:
+        return jsonify({'error': 'Cache not initialized'}), 503
+    return http_cache.cache_headers(jsonify(cache.stats()), None)
@@ -0,0 +1,369 @@
+from config import Config
+from datetime import datetime, timedelta
+from models import Job, Lock, Schedule
+from utils import setup_logging
+import metrics
+import argparse
+import atexit
+import collections
+import logging
+import math
+import random
+import threading
+import time
+
+# refresh.refresh_page results that tell whether a page changed, and those that found it changed
+OBSERVED = ('created', 'updated', 'unchanged', 'not_modified')
+CHANGED = ('created', 'updated')
+
+# Schedule fields written by observe()
+OBSERVED_FIELDS = ('checks', 'changes', 'hours', 'change_rate', 'last_scraped_at', 'last_changed_at',
+                   'next_refresh_at')
+
+LEADER_LOCK = 'scheduler'
+# Job source of the refreshes queued by the scheduler
+JOB_SOURCE = 'scheduler'
+
+SCHEDULED = metrics.Counter('scheduled_refreshes_total', "Refresh jobs queued by the scheduler")
+SCHEDULE_OUTCOMES = metrics.Counter('schedule_observations_total', "Scrapes seen by the scheduler by outcome",
+                                    ('changed',))
+
+# Scheduling policy, shared by the scheduler and the simulation. A schedule
+# is a dict with the fields stored in the schedules collection.
+
+def change_rate(checks, changes, hours):
+    """Estimated changes per hour of a page that was found changed on
+    ``changes`` of ``checks`` scrapes taking ``hours`` in total.
+
+    Counting changes per check would miss every change but one between two
+    scrapes; the estimator for a Poisson process by Cho and Garcia-Molina
+    corrects for that. The estimate is then blended with one change per
+    SCHEDULE_PRIOR_CHANGE_RATE hours of prior, so that a few unchanged
+    scrapes do not push a page out to the longest interval.
+    """
+    prior = Config.SCHEDULE_PRIOR_CHANGE_RATE
+    if checks <= 0 or hours <= 0:
+        return prior
+    rate = max(0.0, -math.log((checks - changes + 0.5) / (checks + 0.5)) * checks / hours)
+    return (rate * hours + 1) / (hours + 1 / prior)
+
+
+def observe(schedule, changed, now):
+    """Record a scrape of the page and schedule its next refresh"""
+    previous = schedule.get('last_scraped_at')
+    if previous is not None:
+        decay = Config.SCHEDULE_HISTORY_DECAY
+        schedule['checks'] = schedule.get('checks', 0) * decay + 1
+        schedule['changes'] = schedule.get('changes', 0) * decay + (1 if changed else 0)
+        schedule['hours'] = schedule.get('hours', 0) * decay + max((now - previous).total_seconds() / 3600, 1e-6)
+        schedule['change_rate'] = change_rate(schedule['checks'], schedule['changes'], schedule['hours'])
+    schedule['last_scraped_at'] = now
+    if changed:
+        schedule['last_changed_at'] = now
+    interval = schedule.get('interval') or _clamp(3600 / Config.SCHEDULE_PRIOR_CHANGE_RATE)
+    schedule['next_refresh_at'] = now + timedelta(seconds=interval)
+    return schedule
+
+
+def fold_views(schedule, now):
+    """Fold requests counted since the last fold into the page's request
+    rate, an exponentially decaying average per hour. Returns how many."""
+    views = schedule.get('views') or 0
+    updated = schedule.get('rate_updated_at')
+    elapsed = (now - updated).total_seconds() / 3600 if updated else 0
+    window = Config.SCHEDULE_DEMAND_WINDOW
+    schedule['view_rate'] = (schedule.get('view_rate') or 0) * math.exp(-elapsed / window) + views / window
+    schedule['views'] = 0
+    schedule['rate_updated_at'] = now
+    return views
+
+
+def weight(schedule):
+    """Share of the budget a page deserves.
+
+    Stale reads per hour grow with the request rate times the change
+    rate; spreading a fixed number of scrapes to minimize their sum gives
+    every page refreshes in proportion to the square root of that product.
+    """
+    demand = (schedule.get('view_rate') or 0) + Config.SCHEDULE_BASE_DEMAND
+    rate = schedule.get('change_rate')
+    return math.sqrt(demand * (Config.SCHEDULE_PRIOR_CHANGE_RATE if rate is None else rate))
+
+
+def _clamp(seconds):
+    return min(max(seconds, Config.SCHEDULE_MIN_INTERVAL), Config.SCHEDULE_MAX_INTERVAL)
+
+
+def assign(schedule, total_weight, budget, now):
+    """Set the page's refresh interval for its share of ``budget``
+    scrapes per hour, and its next refresh time"""
+    share = schedule['priority'] = weight(schedule)
+    per_hour = budget * share / total_weight if total_weight else 0
+    schedule['interval'] = _clamp(3600 / per_hour if per_hour else float('inf'))
+    last = schedule.get('last_scraped_at')
+    queued = schedule.get('enqueued_at')
+    # A page waiting for its queued refresh keeps the retry time set by enqueue
+    if last is not None and not (queued and queued > last):
+        schedule['next_refresh_at'] = last + timedelta(seconds=schedule['interval'])
+    return schedule
+
+
+def allowance(budget, used, tick):
+    """Refreshes that may be queued in this pass: what is left of the
+    hourly budget, paced evenly over the hour"""
+    return max(0, min(budget - used, math.ceil(budget * tick / 3600)))
+
+
+class ViewCounter:
+    """API requests per page, counted in memory and added to the schedules
+    in one bulk write every ``interval`` seconds"""
+
+    def __init__(self, interval=None):
+        self.interval = interval or Config.SCHEDULE_VIEW_FLUSH
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, usernames):
+        with self.lock:
+            self.counts.update(usernames)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, collections.Counter()
+        if counts:
+            try:
+                Schedule.add_views(counts)
+            except Exception as e:
+                logging.error(f"Failed to record {sum(counts.values())} page requests: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+_views = ViewCounter()
+
+
+def record_views(usernames):
+    """Count API requests for these pages towards their refresh priority"""
+    _views.add(usernames)
+
+
+def record_scrape(username, result, now=None):
+    """Update a page's schedule after a scrape or refresh that returned ``result``"""
+    if result not in OBSERVED:
+        return
+    changed = result in CHANGED
+    now = now or datetime.utcnow()
+    schedule = observe(Schedule.find(username) or {'username': username}, changed, now)
+    Schedule.save(username, {field: schedule[field] for field in OBSERVED_FIELDS if field in schedule})
+    SCHEDULE_OUTCOMES.inc(changed=changed)
+
+
+class Scheduler:
+    """Queue refresh jobs for due pages within the hourly budget.
+
+    Every SCHEDULE_PLAN_INTERVAL seconds each page's interval is
+    recomputed from its change rate and request rate. Every tick the pages
+    whose refresh is due are queued as low priority refresh jobs for
+    worker.py, highest priority first, as far as the budget allows. Only
+    one scheduler process acts at a time, holding the 'scheduler' lease.
+    """
+
+    def __init__(self, budget=None, tick=None, plan_interval=None):
+        self.budget = budget or Config.SCHEDULE_BUDGET
+        self.tick = tick or Config.SCHEDULE_TICK
+        self.plan_interval = plan_interval or Config.SCHEDULE_PLAN_INTERVAL
+        self.planned_at = None
+        self.token = None
+        self.stopping = threading.Event()
+
+    def plan(self, now=None):
+        """Recompute the interval of every page; returns the number of pages"""
+        now = now or datetime.utcnow()
+        seeded = Schedule.seed()
+        if seeded:
+            logging.info(f"Scheduling {seeded} new pages")
+        # The budget is shared out by weight, so the total is needed first
+        total = 0.0
+        for schedule in Schedule.iter_all():
+            fold_views(schedule, now)
+            total += weight(schedule)
+
+        count, updates = 0, []
+        for schedule in Schedule.iter_all():
+            views = fold_views(schedule, now)
+            assign(schedule, total, self.budget, now)
+            fields = {key: schedule[key] for key in ('view_rate', 'rate_updated_at', 'priority', 'interval')}
+            if 'next_refresh_at' in schedule:
+                fields['next_refresh_at'] = schedule['next_refresh_at']
+            updates.append((schedule['username'], fields, views))
+            count += 1
+            if len(updates) >= Config.INGEST_BATCH_SIZE:
+                Schedule.save_many(updates)
+                updates = []
+        if updates:
+            Schedule.save_many(updates)
+        self.planned_at = now
+        logging.info(f"Planned refreshes of {count} pages")
+        return count
+
+    def run_once(self, now=None):
+        """Queue the refreshes due now; returns the usernames queued"""
+        now = now or datetime.utcnow()
+        if self.planned_at is None or (now - self.planned_at).total_seconds() >= self.plan_interval:
+            self.plan(now)
+        # Jobs actually created, so a page refreshed several times an hour counts each time
+        used = Job.created_since(JOB_SOURCE, now - timedelta(hours=1))
+        queued = []
+        for schedule in Schedule.due(now, allowance(self.budget, used, self.tick)):
+            username = schedule['username']
+            Job.enqueue('refresh', username, source=JOB_SOURCE)
+            # Picked again if the refresh has not landed by then
+            Schedule.save(username, {
+                'enqueued_at': now,
+                'next_refresh_at': now + timedelta(seconds=Config.SCHEDULE_MIN_INTERVAL)
+            })
+            queued.append(username)
+        if queued:
+            SCHEDULED.inc(len(queued))
+            logging.info(f"Queued {len(queued)} refreshes, {used + len(queued)}/{self.budget} this hour")
+        return queued
+
+    def _lead(self):
+        ttl = self.tick * 3
+        if self.token is not None and Lock.renew(LEADER_LOCK, self.token, ttl):
+            return True
+        self.token = Lock.acquire(LEADER_LOCK, ttl)
+        if self.token is not None:
+            # A new leader does not know when the previous one last planned
+            self.planned_at = None
+        return self.token is not None
+
+    def run(self):
+        """Schedule until stop() is called"""
+        while not self.stopping.is_set():
+            try:
+                if self._lead():
+                    self.run_once()
+            except Exception as e:
+                logging.error(f"Scheduler pass failed: {e}")
+            self.stopping.wait(self.tick)
+        if self.token is not None:
+            Lock.release(LEADER_LOCK, self.token)
+
+    def stop(self):
+        self.stopping.set()
+
+
+def simulate(pages=1000, budget=None, days=7, step=300, seed=1):
+    """Replay the policy against synthetic pages with known change and
+    request rates, in virtual time and without a database.
+
+    Compares it with refreshing every page at the same interval for the
+    same budget, and returns the stale read fraction, the share of scrapes
+    that found no change and the scrapes per hour of both.
+    """
+    budget = budget or Config.SCHEDULE_BUDGET
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    # Most pages change every few days, a few every hour; requests follow a power law
+    truth = [
+        {'change_rate': min(math.exp(rng.gauss(math.log(1 / 72), 1.5)), 4.0), 'view_rate': 20.0 / (rank + 1) ** 1.1}
+        for rank in range(pages)
+    ]
+    rng.shuffle(truth)
+
+    def run(policy):
+        state = [{'next_change': rng.expovariate(page['change_rate']) * 3600, 'stale': False} for page in truth]
+        schedules = [{'username': str(i), 'last_scraped_at': start, 'next_refresh_at': start} for i in range(pages)]
+        uniform = pages * 3600 / budget
+        for i, schedule in enumerate(schedules):
+            # Staggered so that the uniform baseline spends its budget evenly
+            schedule['next_refresh_at'] = start + timedelta(seconds=uniform * i / pages)
+        enqueued = collections.deque()
+        totals = {'views': 0.0, 'stale_views': 0.0, 'scrapes': 0, 'unchanged': 0}
+        planned_at = None
+        steps = int(days * 86400 / step)
+        for n in range(steps):
+            seconds = n * step
+            now = start + timedelta(seconds=seconds)
+            for page, page_state, schedule in zip(truth, state, schedules):
+                while page_state['next_change'] <= seconds:
+                    page_state['stale'] = True
+                    page_state['next_change'] += rng.expovariate(page['change_rate']) * 3600
+                views = page['view_rate'] * step / 3600
+                totals['views'] += views
+                if page_state['stale']:
+                    totals['stale_views'] += views
+                schedule['views'] = schedule.get('views', 0) + views
+
+            if policy == 'adaptive' and (planned_at is None or seconds - planned_at >= Config.SCHEDULE_PLAN_INTERVAL):
+                total = 0.0
+                for schedule in schedules:
+                    fold_views(schedule, now)
+                    total += weight(schedule)
+                for schedule in schedules:
+                    assign(schedule, total, budget, now)
+                planned_at = seconds
+
+            while enqueued and enqueued[0] <= now - timedelta(hours=1):
+                enqueued.popleft()
+            due = [i for i, schedule in enumerate(schedules) if schedule['next_refresh_at'] <= now]
+            due.sort(key=lambda i: (-schedules[i].get('priority', 0), schedules[i]['next_refresh_at']))
+            for i in due[:allowance(budget, len(enqueued), step)]:
+                enqueued.append(now)
+                changed = state[i]['stale']
+                state[i]['stale'] = False
+                totals['scrapes'] += 1
+                totals['unchanged'] += 0 if changed else 1
+                if policy == 'adaptive':
+                    observe(schedules[i], changed, now)
+                else:
+                    schedules[i]['next_refresh_at'] = now + timedelta(seconds=uniform)
+        hours = steps * step / 3600
+        return {
+            'stale_read_fraction': round(totals['stale_views'] / totals['views'], 4),
+            'unchanged_scrape_fraction': round(totals['unchanged'] / max(totals['scrapes'], 1), 4),
+            'scrapes_per_hour': round(totals['scrapes'] / hours, 1)
+        }
+
+    return {'adaptive': run('adaptive'), 'uniform': run('uniform')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schedule page refreshes by change rate and demand")
+    parser.add_argument('--budget', type=int, default=Config.SCHEDULE_BUDGET, help="Refreshes per hour")
+    parser.add_argument('--once', action='store_true', help="Plan and queue due refreshes once, then exit")
+    parser.add_argument('--simulate', action='store_true',
+                        help="Compare the policy with uniform refreshes on synthetic pages, without a database")
+    parser.add_argument('--pages', type=int, default=1000, help="Synthetic pages for --simulate")
+    parser.add_argument('--days', type=float, default=7, help="Simulated days for --simulate")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.simulate:
+        for policy, result in simulate(args.pages, args.budget, args.days, seed=args.seed).items():
+            logging.info(f"{policy}: {result}")
+        return
+    scheduler = Scheduler(budget=args.budget)
+    if args.once:
+        scheduler.plan()
+        logging.info(f"Queued {len(scheduler.run_once())} refreshes")
+        return
+    import signal
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: scheduler.stop())
+    logging.info(f"Scheduler started with a budget of {args.budget} refreshes per hour")
+    scheduler.run()
+
+
+if __name__ == '__main__':
+    main()
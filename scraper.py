@@ -1,227 +1,200 @@
 import requests
 from bs4 import BeautifulSoup
-import time
+from bs4.builder import builder_registry
+from config import Config
+from extractor import PageExtractor, StreamingParser, walk_soup
+from metrics import Histogram, span
+import codecs
+import hashlib
 import logging
-from datetime import datetime
-import re
+
+# Parser backends: tree backends build a BeautifulSoup DOM with the named
+# tree builder, 'stream' tokenizes response chunks without building a DOM
+PARSER_BACKENDS = ('html.parser', 'lxml', 'stream')
+
+# Returned by fetch_page/scrape_page when a conditional fetch found no change
+NOT_MODIFIED = object()
+
+SCRAPE_DURATION = Histogram('scrape_duration_seconds', "Time to fetch and extract a page", ('parser',))
+
+def resolve_parser(parser):
+    """The PARSER_BACKENDS entry to use for ``parser``, falling back to
+    html.parser when lxml is not installed"""
+    if parser not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend {parser!r}, expected one of {PARSER_BACKENDS}")
+    if parser == 'lxml' and builder_registry.lookup('lxml') is None:
+        logging.warning("lxml is not installed, falling back to html.parser")
+        return 'html.parser'
+    return parser
+
+def page_extractor(username, url, **kwargs):
+    """PageExtractor limited to MAX_POSTS_PER_PAGE posts and
+    MAX_FOLLOWERS_PER_PAGE followers"""
+    return PageExtractor(username, url, post_limit=Config.MAX_POSTS_PER_PAGE,
+                         follower_limit=Config.MAX_FOLLOWERS_PER_PAGE, **kwargs)
+
+def parse_page(username, url, body, encoding=None, parser='html.parser', scraped_at=None):
+    """Extract the scrape_page() dict from a raw HTML body with one of the
+    PARSER_BACKENDS. Pure CPU work, so it can run in another process."""
+    parser = resolve_parser(parser)
+    extractor = page_extractor(username, url, scraped_at=scraped_at)
+    if parser == 'lxml':
+        # Let lxml handle the byte stream and its own charset detection
+        return walk_soup(BeautifulSoup(body, 'lxml'), extractor)
+    try:
+        text = str(body, encoding or 'utf-8', errors='replace')
+    except LookupError:
+        text = str(body, 'utf-8', errors='replace')
+    if parser == 'stream':
+        stream = StreamingParser(extractor)
+        stream.feed(text)
+        return stream.close()
+    # Walk the parsed document once, filling every field in that pass
+    return walk_soup(BeautifulSoup(text, 'html.parser'), extractor)
 
 class FacebookScraper:
-    def __init__(self):
+    def __init__(self, parser=None, base_url=None):
         self.session = requests.Session()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self.parser = resolve_parser(parser or Config.SCRAPER_PARSER)
+        self.base_url = (base_url or Config.SCRAPER_BASE_URL).rstrip('/')
+
+    def page_url(self, username):
+        return f"{self.base_url}/{username}"
+
+    def _conditional_headers(self, validators):
+        headers = dict(self.headers)
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    @staticmethod
+    def _validators(response, content_hash):
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash': content_hash
+        }
 
-    def _get_soup(self, url):
-        try:
-            response = self.session.get(url, headers=self.headers)
+    def _stream_page(self, url, extractor, validators=None):
+        """Fetch and extract a page chunk by chunk without building a DOM"""
+        headers = self._conditional_headers(validators)
+        with self.session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                return NOT_MODIFIED
             response.raise_for_status()
-            return BeautifulSoup(response.text, 'html.parser')
-        except Exception as e:
-            logging.error(f"Error fetching URL {url}: {str(e)}")
-            return None
+            decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+            digest = hashlib.blake2b(digest_size=16)
+            parser = StreamingParser(extractor)
+            for chunk in response.iter_content(chunk_size=Config.SCRAPER_CHUNK_SIZE):
+                digest.update(chunk)
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b'', final=True))
+            page_data = parser.close()
+
+        # Parsing overlaps the download here, so an unchanged body only saves the write
+        content_hash = digest.hexdigest()
+        if validators and validators.get('content_hash') == content_hash:
+            return NOT_MODIFIED
+        page_data.update(self._validators(response, content_hash))
+        return page_data
 
-    def _extract_number(self, text):
-        """Extract number from text like '1.2K' or '1.2M'"""
-        if not text:
-            return 0
-        text = text.strip().upper()
-        multipliers = {'K': 1000, 'M': 1000000, 'B': 1000000000}
-        try:
-            if text[-1] in multipliers:
-                number = float(text[:-1]) * multipliers[text[-1]]
-            else:
-                number = float(text.replace(',', ''))
-            return int(number)
-        except (ValueError, IndexError):
-            return 0
-
-    def scrape_page(self, username):
-        url = f"https://www.facebook.com/{username}"
-        soup = self._get_soup(url)
-        if not soup:
-            return None
+    def fetch_page(self, username, validators=None):
+        """Scrape a page, raising on network and HTTP errors.
+
+        ``validators`` holds the etag, last_modified and content_hash stored
+        from a previous scrape. When given, a conditional GET is sent and
+        NOT_MODIFIED is returned on 304 or when the body hash is unchanged.
+        """
+        with span('scrape'), SCRAPE_DURATION.time(parser=self.parser):
+            return self._fetch_page(username, validators)
+
+    def _fetch_page(self, username, validators=None):
+        url = self.page_url(username)
+        if self.parser == 'stream':
+            return self._stream_page(url, page_extractor(username, url), validators)
+
+        fetched = self.fetch_body(username, validators)
+        if fetched is NOT_MODIFIED:
+            return NOT_MODIFIED
+        page_data = parse_page(username, url, fetched['body'], fetched['encoding'], self.parser)
+        page_data.update(fetched['validators'])
+        return page_data
 
-        # Extract basic page information
-        page_data = {
-            'username': username,
+    def fetch_body(self, username, validators=None):
+        """Download a page without parsing it.
+
+        Returns NOT_MODIFIED like fetch_page, or a dict with the ``url``, raw
+        ``body`` bytes, its text ``encoding`` and the new ``validators``,
+        ready for parse_page.
+        """
+        url = self.page_url(username)
+        response = self.session.get(url, headers=self._conditional_headers(validators))
+        if response.status_code == 304:
+            return NOT_MODIFIED
+        response.raise_for_status()
+        content_hash = hashlib.blake2b(response.content, digest_size=16).hexdigest()
+        if validators and validators.get('content_hash') == content_hash:
+            return NOT_MODIFIED
+        return {
             'url': url,
-            'scraped_at': datetime.utcnow(),
-            'name': self._extract_page_name(soup),
-            'profile_pic': self._extract_profile_pic(soup),
-            'email': self._extract_email(soup),
-            'website': self._extract_website(soup),
-            'category': self._extract_category(soup),
-            'follower_count': self._extract_follower_count(soup),
-            'likes_count': self._extract_likes_count(soup),
-            'creation_date': self._extract_creation_date(soup),
-            'about': self._extract_about(soup),
-            'posts': self._extract_posts(soup, limit=30)
+            'body': response.content,
+            # Same fallback as response.text; lxml detects the charset itself
+            'encoding': response.encoding or (None if self.parser == 'lxml' else response.apparent_encoding),
+            'validators': self._validators(response, content_hash)
         }
 
-        # Add followers/following if available
-        followers = self._extract_followers(soup)
-        if followers:
-            page_data['followers'] = followers
-
-        return page_data
-
-    def _extract_page_name(self, soup):
-        name_element = soup.find('h1', {'class': re.compile(r'.*page-name.*')})
-        if not name_element:
-            name_element = soup.find('h1')
-        return name_element.text.strip() if name_element else None
-
-    def _extract_profile_pic(self, soup):
-        img = soup.find('img', {'class': re.compile(r'.*profile.*pic.*')})
-        if img:
-            return img.get('src')
-        return None
-
-    def _extract_email(self, soup):
-        email_element = soup.find('a', {'href': re.compile(r'mailto:.*')})
-        if email_element:
-            href = email_element.get('href', '')
-            return href.replace('mailto:', '')
-        return None
-
-    def _extract_website(self, soup):
-        website_element = soup.find('a', {'href': re.compile(r'https?://(?!.*facebook\.com).*')})
-        if website_element:
-            return website_element.get('href')
-        return None
-
-    def _extract_category(self, soup):
-        category_element = soup.find('div', {'class': re.compile(r'.*category.*')})
-        return category_element.text.strip() if category_element else None
-
-    def _extract_follower_count(self, soup):
-        followers_element = soup.find(string=re.compile(r'.*followers.*', re.I))
-        if followers_element:
-            return self._extract_number(followers_element.parent.text)
-        return 0
-
-    def _extract_likes_count(self, soup):
-        likes_element = soup.find(string=re.compile(r'.*people like this.*', re.I))
-        if likes_element:
-            return self._extract_number(likes_element.parent.text)
-        return 0
-
-    def _extract_creation_date(self, soup):
-        date_element = soup.find(string=re.compile(r'.*Page created.*', re.I))
-        if date_element:
-            try:
-                date_text = date_element.parent.text
-                date_match = re.search(r'(\w+ \d+,? \d{4})', date_text)
-                if date_match:
-                    return datetime.strptime(date_match.group(1), '%B %d, %Y')
-            except Exception as e:
-                logging.error(f"Error parsing creation date: {e}")
-        return None
-
-    def _extract_about(self, soup):
-        about_element = soup.find('div', {'class': re.compile(r'.*about.*')})
-        return about_element.text.strip() if about_element else None
-
-    def _extract_posts(self, soup, limit=30):
-        posts = []
-        post_elements = soup.find_all('div', {'class': re.compile(r'.*feed.*story.*')}, limit=limit)
-
-        for post in post_elements:
-            post_data = {
-                'content': self._extract_post_content(post),
-                'created_at': self._extract_post_date(post),
-                'likes_count': self._extract_post_likes(post),
-                'comments': self._extract_post_comments(post),
-                'shares_count': self._extract_post_shares(post),
-                'media_urls': self._extract_post_media(post)
-            }
-            posts.append(post_data)
-
-        return posts
-
-    def _extract_post_content(self, post):
-        content_element = post.find('div', {'class': re.compile(r'.*post-content.*')})
-        return content_element.text.strip() if content_element else None
-
-    def _extract_post_date(self, post):
-        date_element = post.find('abbr')
-        if date_element and date_element.get('title'):
-            try:
-                return datetime.strptime(date_element['title'], '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                pass
-        return datetime.utcnow()
-
-    def _extract_post_likes(self, post):
-        likes_element = post.find('span', {'class': re.compile(r'.*like.*count.*')})
-        return self._extract_number(likes_element.text) if likes_element else 0
-
-    def _extract_post_comments(self, post):
-        comments = []
-        comment_elements = post.find_all('div', {'class': re.compile(r'.*comment.*')})
-
-        for comment in comment_elements:
-            comment_data = {
-                'content': comment.text.strip(),
-                'created_at': datetime.utcnow(),  # Facebook might hide actual dates
-                'author': self._extract_comment_author(comment)
-            }
-            comments.append(comment_data)
-
-        return comments
-
-    def _extract_comment_author(self, comment):
-        author_element = comment.find('a', {'class': re.compile(r'.*author.*')})
-        if author_element:
-            return {
-                'name': author_element.text.strip(),
-                'profile_url': author_element.get('href')
-            }
-        return None
-
-    def _extract_post_shares(self, post):
-        shares_element = post.find('span', {'class': re.compile(r'.*share.*count.*')})
-        return self._extract_number(shares_element.text) if shares_element else 0
-
-    def _extract_post_media(self, post):
-        media_urls = []
-        media_elements = post.find_all(['img', 'video'])
-
-        for media in media_elements:
-            if media.name == 'img':
-                url = media.get('src')
-            else:  # video
-                url = media.get('src') or media.get('data-url')
-
-            if url:
-                media_urls.append(url)
-
-        return media_urls
-
-    def _extract_followers(self, soup):
-        followers = []
-        follower_elements = soup.find_all('div', {'class': re.compile(r'.*follower.*item.*')})
-
-        for follower in follower_elements:
-            follower_data = {
-                'name': self._extract_follower_name(follower),
-                'profile_pic': self._extract_follower_pic(follower),
-                'profile_url': self._extract_follower_url(follower),
-                'created_at': datetime.utcnow()
-            }
-            followers.append(follower_data)
-
-        return followers
-
-    def _extract_follower_name(self, follower):
-        name_element = follower.find('a', {'class': re.compile(r'.*name.*')})
-        return name_element.text.strip() if name_element else None
-
-    def _extract_follower_pic(self, follower):
-        img = follower.find('img')
-        return img.get('src') if img else None
-
-    def _extract_follower_url(self, follower):
-        link = follower.find('a')
-        return link.get('href') if link else None
\ No newline at end of file
+    def iter_scrape(self, username, batch_size=None):
+        """Scrape a page incrementally, without holding it in memory.
+
+        The response is parsed chunk by chunk as it downloads. Yields
+        ('posts', [Post]) and ('followers', [Follower]) batches of up to
+        ``batch_size`` records as their elements close, then ('page', Page)
+        with the page-level fields and validators once the document ends.
+        Raises on network and HTTP errors like fetch_page.
+        """
+        batch_size = batch_size or Config.SCRAPE_BATCH_SIZE
+        url = self.page_url(username)
+        extractor = page_extractor(username, url, keep=False)
+        parser = StreamingParser(extractor)
+        pending = {'posts': [], 'followers': []}
+
+        def batches(final=False):
+            posts, followers = extractor.drain()
+            pending['posts'].extend(posts)
+            pending['followers'].extend(followers)
+            for kind, records in pending.items():
+                while len(records) >= batch_size or (final and records):
+                    yield kind, records[:batch_size]
+                    del records[:batch_size]
+
+        with self.session.get(url, headers=self.headers, stream=True) as response:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+            digest = hashlib.blake2b(digest_size=16)
+            for chunk in response.iter_content(chunk_size=Config.SCRAPER_CHUNK_SIZE):
+                digest.update(chunk)
+                parser.feed(decoder.decode(chunk))
+                yield from batches()
+            parser.feed(decoder.decode(b'', final=True))
+            parser.finish()
+            page = extractor.record()
+            yield from batches(final=True)
+
+        validators = self._validators(response, digest.hexdigest())
+        page.etag, page.last_modified, page.content_hash = (
+            validators['etag'], validators['last_modified'], validators['content_hash']
+        )
+        yield 'page', page
+
+    def scrape_page(self, username, validators=None):
+        try:
+            return self.fetch_page(username, validators)
+        except Exception as e:
+            logging.error(f"Error fetching URL {self.page_url(username)}: {str(e)}")
+            return None
@@ -0,0 +1,136 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in', 'is', 'it', 'its',
+    'of', 'on', 'or', 'that', 'the', 'to', 'was', 'were', 'will', 'with'
+))
+
+def tokenize(text):
+    """Lowercased word tokens of ``text`` without stopwords"""
+    if not text:
+        return []
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+def search_terms(*texts):
+    """Sorted unique tokens of ``texts``, stored on documents for indexed prefix lookups"""
+    return sorted({token for text in texts for token in tokenize(text)})
+
+def parse_query(query):
+    """Split a search box query into (terms, prefix).
+
+    The last word is treated as a prefix while it is still being typed,
+    that is unless the query ends with whitespace.
+    """
+    terms = tokenize(query)
+    if not terms or not query or query[-1].isspace() or not query[-1].isalnum():
+        return terms, None
+    return terms[:-1], terms[-1]
+
+class InvertedIndex:
+    """In-process inverted index with BM25 ranking and prefix expansion.
+
+    Documents are keyed by any hashable and indexed as (text, weight)
+    fields; a term's frequency in a document is the sum of the weights of
+    the fields it occurs in. Posting lists map each term to {doc: weighted
+    frequency}, and a sorted vocabulary serves prefix lookups.
+    """
+
+    # Score factor for terms that only match the typed prefix
+    PREFIX_WEIGHT = 0.5
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.vocabulary = []
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc, fields):
+        """Index or re-index ``doc`` from (text, weight) pairs"""
+        counts = {}
+        for text, weight in fields:
+            for term in tokenize(text):
+                counts[term] = counts.get(term, 0) + weight
+        with self.lock:
+            self._remove(doc)
+            if not counts:
+                return
+            for term, count in counts.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = {}
+                    bisect.insort(self.vocabulary, term)
+                postings[doc] = count
+            self.doc_terms[doc] = tuple(counts)
+            length = sum(counts.values())
+            self.doc_lengths[doc] = length
+            self.total_length += length
+
+    def remove(self, doc):
+        with self.lock:
+            self._remove(doc)
+
+    def _remove(self, doc):
+        terms = self.doc_terms.pop(doc, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(doc)
+        for term in terms:
+            postings = self.postings[term]
+            del postings[doc]
+            if not postings:
+                del self.postings[term]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+
+    def expand(self, prefix, limit=50):
+        """Up to ``limit`` indexed terms starting with ``prefix``"""
+        with self.lock:
+            start = bisect.bisect_left(self.vocabulary, prefix)
+            terms = []
+            for term in self.vocabulary[start:start + limit]:
+                if not term.startswith(prefix):
+                    break
+                terms.append(term)
+            return terms
+
+    def search(self, query, limit=20, accept=None):
+        """Best (doc, score) matches of any query term, highest first.
+
+        ``accept`` optionally filters document keys.
+        """
+        terms, prefix = parse_query(query)
+        weighted = {term: 1.0 for term in terms}
+        if prefix:
+            for term in self.expand(prefix):
+                weighted.setdefault(term, 1.0 if term == prefix else self.PREFIX_WEIGHT)
+
+        with self.lock:
+            count = len(self.doc_lengths)
+            if not count or not weighted:
+                return []
+            average = self.total_length / count
+            scores = {}
+            for term, weight in weighted.items():
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, frequency in postings.items():
+                    if accept is not None and not accept(doc):
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc] / average)
+                    score = weight * idf * frequency * (self.k1 + 1) / (frequency + norm)
+                    scores[doc] = scores.get(doc, 0) + score
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
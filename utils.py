@@ -1,19 +1,85 @@
+import json
 import logging
+import threading
+from bson import ObjectId
+from config import Config
+from datetime import date, datetime
 from functools import wraps
 from flask import jsonify
+from flask.json.provider import DefaultJSONProvider
 
-def setup_logging():
+def setup_logging(level=None):
     logging.basicConfig(
-        level=logging.DEBUG,
+        level=(level or Config.LOG_LEVEL).upper(),
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
+def json_default(o):
+    """Encode the BSON types stored in our documents"""
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+# Shared compact encoder for streamed responses
+json_encoder = json.JSONEncoder(default=json_default, separators=(',', ':'), ensure_ascii=False)
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes ObjectId and datetime values"""
+
+    @staticmethod
+    def default(o):
+        return json_default(o)
+
 def handle_errors(f):
     @wraps(f)
     def wrapped(*args, **kwargs):
         try:
             return f(*args, **kwargs)
         except Exception as e:
-            logging.error(f"Error: {str(e)}")
+            logging.exception(f"Error: {str(e)}")
             return jsonify({'error': 'Internal server error'}), 500
     return wrapped
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for it and receive the same result or exception.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
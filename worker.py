@@ -0,0 +1,162 @@
+from config import Config
+from bulk import HostRateLimiter, is_retryable
+from models import Job, Page, flush_writes
+from refresh import refresh_page
+from scheduler import record_scrape
+from scraper import FacebookScraper
+from utils import setup_logging
+import metrics
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+
+JOB_DURATION = metrics.Histogram('job_duration_seconds', "Time to run a job", ('type', 'outcome'))
+
+
+class Worker:
+    """Run queued scrape and refresh jobs on a pool of threads.
+
+    Each thread waits for a rate limit token, then claims the next due job
+    under a lease, runs it and records the outcome; taking the token first
+    keeps the wait from eating into the lease. Transient failures are
+    retried with exponential backoff until the job runs out of attempts; a
+    worker that dies mid-job leaves the lease to expire so that another
+    worker picks the job up.
+    """
+
+    def __init__(self, concurrency=None, lease_seconds=None, rate_limit=None,
+                 scraper_factory=FacebookScraper, exit_when_idle=False):
+        self.concurrency = concurrency or Config.JOB_WORKERS
+        self.lease_seconds = lease_seconds or Config.JOB_LEASE_SECONDS
+        self.limiter = HostRateLimiter(rate_limit)
+        self.scraper_factory = scraper_factory
+        self.exit_when_idle = exit_when_idle
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.local = threading.local()
+        self.stopping = threading.Event()
+        self.counts = {'done': 0, 'retried': 0, 'failed': 0}
+        self.lock = threading.Lock()
+
+    def _scraper(self):
+        # requests.Session is not thread-safe, keep one scraper per thread
+        scraper = getattr(self.local, 'scraper', None)
+        if scraper is None:
+            scraper = self.local.scraper = self.scraper_factory()
+        return scraper
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def run_job(self, job):
+        """Run one job and return its result"""
+        username = job['username']
+        if job['type'] == 'scrape' and Page.find_by_username(username, {'_id': 1}):
+            return 'exists'
+        # Spend the token _loop took before claiming the job
+        self.local.token = False
+        return refresh_page(username, self._scraper(), raise_errors=True)
+
+    def process(self, job):
+        """Run a claimed job and record its outcome"""
+        started = time.monotonic()
+        try:
+            result = self.run_job(job)
+        except Exception as e:
+            JOB_DURATION.observe(time.monotonic() - started, type=job['type'], outcome='error')
+            retry = is_retryable(e) and job['attempts'] < job['max_attempts']
+            delay = min(Config.JOB_BACKOFF_MAX, Config.JOB_BACKOFF_BASE * 2 ** (job['attempts'] - 1))
+            delay *= random.uniform(0.5, 1.0)
+            if retry:
+                logging.warning(f"Job {job['_id']} for {job['username']} failed, retrying in {delay:.1f}s: {e}")
+            else:
+                logging.error(f"Job {job['_id']} for {job['username']} failed: {e}")
+            Job.fail(job, str(e), delay, retry)
+            self._count('retried' if retry else 'failed')
+            return
+        JOB_DURATION.observe(time.monotonic() - started, type=job['type'], outcome=result)
+        if Job.complete(job, result):
+            logging.info(f"Job {job['_id']} {job['type']} {job['username']}: {result}")
+            self._count('done')
+            try:
+                record_scrape(job['username'], result)
+            except Exception as e:
+                logging.error(f"Failed to update the refresh schedule of {job['username']}: {e}")
+        else:
+            logging.warning(f"Lease on job {job['_id']} expired before it finished")
+
+    def _loop(self, name):
+        while not self.stopping.is_set():
+            # A token not spent on the last job, e.g. one that existed already, is kept
+            if not getattr(self.local, 'token', False):
+                self.limiter.acquire(self._scraper().page_url(''))
+                self.local.token = True
+                if self.stopping.is_set():
+                    return
+            try:
+                job = Job.claim(name, self.lease_seconds)
+            except Exception as e:
+                logging.error(f"Failed to claim a job: {e}")
+                job = None
+            if job is not None:
+                self.process(job)
+            elif self.exit_when_idle:
+                return
+            else:
+                self.stopping.wait(Config.JOB_POLL_INTERVAL)
+
+    def run(self):
+        """Process jobs until stop() is called"""
+        threads = [
+            threading.Thread(target=self._loop, args=(f"{self.name}/{i}",), daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return dict(self.counts)
+
+    def stop(self):
+        """Let running jobs finish, then return from run()"""
+        self.stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued scrape and refresh jobs")
+    parser.add_argument('--concurrency', type=int, default=Config.JOB_WORKERS)
+    parser.add_argument('--lease', type=int, default=Config.JOB_LEASE_SECONDS,
+                        help="Seconds before an unfinished job is handed to another worker")
+    parser.add_argument('--rate-limit', default=Config.SCRAPE_RATELIMIT,
+                        help="Requests per host, e.g. '100/hour'")
+    parser.add_argument('--exit-when-idle', action='store_true',
+                        help="Exit once no job is due instead of polling")
+    parser.add_argument('--metrics-port', type=int,
+                        help="Serve Prometheus metrics of this worker on this port")
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    worker = Worker(
+        concurrency=args.concurrency,
+        lease_seconds=args.lease,
+        rate_limit=args.rate_limit,
+        exit_when_idle=args.exit_when_idle
+    )
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: worker.stop())
+    logging.info(f"Worker {worker.name} started with {worker.concurrency} threads")
+    counts = worker.run()
+    flush_writes()
+    logging.info(f"Worker {worker.name} stopped: {counts}")
+
+
+if __name__ == '__main__':
+    main()